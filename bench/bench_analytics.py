@@ -0,0 +1,93 @@
+"""
+權益曲線（core.analytics）的耗時：合成 N 年 × M 檔的 ledger + 隨機漫步歷史價（全部離線）
+
+    python -m bench.bench_analytics --years 5 --codes 300 --rows 50000
+    python -m bench.bench_analytics --history-latency 0.02   # 模擬每檔一次歷史價查詢的延遲
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def make_history(codes, start, end, seed=0):
+    """每檔一條隨機漫步收盤價（只有平日）"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end)
+    steps = rng.normal(0, 0.02, (len(dates), len(codes)))
+    base = rng.uniform(20, 500, len(codes))
+    return pd.DataFrame(base * np.exp(np.cumsum(steps, axis=0)), index=dates, columns=codes).round(2)
+
+
+def make_ledger(history, rows, null_ratio=0.1, seed=0):
+    """在交易日上隨機買賣；有價格的列用當天收盤價 ± 1%"""
+    rng = np.random.default_rng(seed)
+    day = np.sort(rng.integers(0, len(history), rows))
+    col = rng.integers(0, len(history.columns), rows)
+    close = history.to_numpy()[day, col] * rng.uniform(0.99, 1.01, rows)
+
+    df = pd.DataFrame({
+        "date": history.index[day].strftime("%Y-%m-%d"),
+        "code": history.columns[col],
+        "action": np.array(["buy", "keep", "sell", "reduce"])[rng.choice(4, rows, p=[0.45, 0.15, 0.1, 0.3])],
+        "value": np.round(close, 2).astype(str),
+    })
+    df.loc[rng.random(rows) < null_ratio, "value"] = "null"
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--history-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ["TRACE_LOG"] = "off"
+
+    from core.analytics import equity_curve, format_summary, summarize
+    from core.metrics import set_trace_log
+    from core.price import LocalPriceProvider
+
+    set_trace_log("off")
+
+    end = pd.Timestamp("2025-12-31")
+    start = end - pd.DateOffset(years=args.years)
+    codes = pd.Index([str(1000 + i) for i in range(args.codes)])
+    history = make_history(codes, start, end)
+    ledger = make_ledger(history, args.rows)
+
+    buffer = io.StringIO()
+    ledger.to_csv(buffer, index=False)
+    data = buffer.getvalue().encode("utf-8")
+
+    provider = LocalPriceProvider(history.iloc[-1].to_dict(), latency=args.history_latency, history=history)
+    print(f"{args.years} years × {args.codes} codes, {len(history)} trading days, {args.rows:,} ledger rows")
+
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        from core import metrics
+
+        metrics.registry.reset()
+        start_time = time.perf_counter()
+        curve = equity_curve(data, provider, end=end)
+        total = time.perf_counter() - start_time
+
+        for s in metrics.registry.snapshot()["summaries"]:
+            if s["name"] == "stage_seconds" and s["stage"].startswith("analytics_"):
+                timings[s["stage"]] = s["sum"]
+
+    for name, seconds in timings.items():
+        print(f"  {name:<20} {seconds:8.3f}s")
+    print(f"  {'total':<20} {total:8.3f}s  history lookups={provider.calls}  matrix={len(curve)}×{args.codes}")
+    print()
+    print(format_summary(summarize(curve)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+回測（core.backtest）的吞吐量：合成 N 年 × M 檔的 ledger + 隨機漫步歷史價（全部離線）
+
+    python -m bench.bench_backtest --years 5 --codes 300 --rows 50000 --workers 1 4
+
+- baseline（不加任何規則）的損益須等於權益曲線（core.analytics）最後一天的總損益
+- 同一組參數格點分別以不同 worker 數執行，結果須相同；印出每秒評估的規則組數
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bench.bench_analytics import make_history, make_ledger
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    os.environ["TRACE_LOG"] = "off"
+
+    from core.analytics import equity_curve
+    from core.backtest import format_results, load_trades, parameter_grid, run_grid
+    from core.metrics import set_trace_log
+    from core.price import LocalPriceProvider
+
+    set_trace_log("off")
+
+    end = pd.Timestamp("2025-12-31")
+    start = end - pd.DateOffset(years=args.years)
+    codes = pd.Index([str(1000 + i) for i in range(args.codes)])
+    history = make_history(codes, start, end)
+    ledger = make_ledger(history, args.rows)
+    provider = LocalPriceProvider(history.iloc[-1].to_dict(), history=history)
+
+    started = time.perf_counter()
+    trades = load_trades(ledger, provider, end)
+    print(f"{len(trades):,} trades × {trades.X.shape[1]} days "
+          f"({sum(a.nbytes for a in trades.arrays().values()) / 1e6:.0f} MB shared), "
+          f"built in {time.perf_counter() - started:.2f}s")
+
+    failed = False
+    baseline = run_grid(trades, parameter_grid(), max_workers=1).iloc[0]["pnl"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        equity = equity_curve(ledger, provider, end)["equity"].iloc[-1]
+    same = np.isclose(baseline, equity, rtol=1e-9)
+    failed = failed or not same
+    print(f"baseline pnl {baseline:,.2f} vs equity curve {equity:,.2f}: {'ok' if same else 'MISMATCH'}")
+
+    grid = parameter_grid(
+        stops=list(range(0, 21)),
+        trails=list(range(0, 31, 2)),
+        caps=[0, 5, 10, 20, 40, 60, 120, 250],
+        sizing=["ledger", "equal"],
+    )
+    first = None
+    for workers in args.workers:
+        started = time.perf_counter()
+        results = run_grid(trades, grid, max_workers=workers)
+        elapsed = time.perf_counter() - started
+        print(f"workers={workers:<3} {len(grid):,} rule sets in {elapsed:6.2f}s → "
+              f"{len(grid) / elapsed:8,.0f} rule sets/s  ({len(grid) * len(trades) / elapsed / 1e6:,.1f}M trade evaluations/s)")
+        if first is None:
+            first = results
+        elif not first.equals(results):
+            failed = True
+            print("❌ 結果與 workers=1 不同")
+
+    print(format_results(first, top=5))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+批次匯入：多行訊息 / CSV 檔一次解析、整批只寫一個 ledger segment，全部離線
+
+    python -m bench.bench_bulk --rows 10000 --bad 0.01 --latency 0.02
+
+- parse：向量化的 parse_bulk vs 逐行 parse_trade_message
+- end-to-end：一則多行訊息 + 一個 CSV 檔訊息（FakeBlob 提供內容）送進 process_batch，
+  MemoryStore 上的 ledger 只能多一個 segment，列數 = 通過檢查的行數
+結果不符預期時 exit 1
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+
+def make_lines(n, bad, rng):
+    """→ (行, 預期錯誤行數)；bad 比例的行故意寫錯（日期 / 動作 / 價格 / 欄位數）"""
+    lines, n_bad = [], 0
+    for i in range(n):
+        day = f"2025/{1 + i % 12:02d}/{1 + i % 28:02d}"
+        line = f"{day}, {1000 + i % 500}, {'BUY' if i % 3 else 'SELL'}, {10 + i % 97}.5, {1 + i % 5}000"
+        if rng.random() < bad:
+            n_bad += 1
+            line = rng.choice([
+                f"2025/13/40, 2330, BUY, 10",
+                f"{day}, 2330, HOLD, 10",
+                f"{day}, 2330, BUY, abc",
+                f"{day}, 2330",
+            ])
+        lines.append(line)
+    return lines, n_bad
+
+
+class FakeBlob:
+    """AsyncMessagingApiBlob 的替身：get_message_content → 檔案內容"""
+
+    def __init__(self, files, latency):
+        self.files = files
+        self.latency = latency
+
+    async def get_message_content(self, message_id):
+        await asyncio.sleep(self.latency)
+        return self.files[message_id]
+
+
+class FakeLine:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_message(self, req):
+        self.replies.append(req.messages[0].text)
+
+
+def make_event(i, message):
+    return SimpleNamespace(
+        reply_token=f"token-{i}",
+        webhook_event_id=f"01BULK{i:020d}",
+        source=SimpleNamespace(type="user", user_id="Ubench", group_id=None, room_id=None),
+        message=SimpleNamespace(**dict(dict(id=str(i), type="text", text="", file_name=None, file_size=None), **message)),
+    )
+
+
+def parse(lines, n_bad):
+    from webhook.bulk import parse_bulk
+    from webhook.webhook_server import parse_trade_message
+
+    text = "\n".join(lines)
+    start = time.perf_counter()
+    rows, errors = parse_bulk(text)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    looped = [parse_trade_message(line)[0] for line in lines]
+    per_line = time.perf_counter() - start
+    return vectorized, per_line, len(rows), len(errors), sum(r is not None for r in looped)
+
+
+def end_to_end(lines, latency):
+    from storage.gcs import MemoryStore, set_store
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+    from webhook import webhook_server
+    from webhook.dedupe import EventDeduper
+
+    store = MemoryStore(latency=latency)
+    set_store(store)
+    store.write("bench", "trades.csv", "date,code,action,value,qty,fee\n")
+    backend = GCSLedgerBackend("bench", store)
+    webhook_server.ledger = AppendOnlyLedger(backend)
+    webhook_server.deduper = EventDeduper(backend)
+    webhook_server.line_api = line = FakeLine()
+
+    half = len(lines) // 2
+    csv_body = ("日期,代號,動作,價格,股數,手續費\n" + "\n".join(lines[half:])).encode("cp950")
+    webhook_server.line_api_blob = FakeBlob({"2": csv_body}, latency)
+    batch = [
+        (time.time(), make_event(1, dict(text="\n".join(lines[:half])))),
+        (time.time(), make_event(2, dict(type="file", file_name="fills.csv", file_size=len(csv_body)))),
+        (time.time(), make_event(3, dict(text="2025/01/02, 2330, BUY, 600"))),
+    ]
+
+    start = time.perf_counter()
+    asyncio.run(webhook_server.process_batch(batch))
+    elapsed = time.perf_counter() - start
+
+    _, segments = webhook_server.ledger.read_parts()
+    rows = sum(segment.count(b"\n") for segment in segments)
+    return elapsed, len(segments), rows, line.replies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--bad", type=float, default=0.01, help="故意寫錯的行比例")
+    parser.add_argument("--latency", type=float, default=0.02, help="每次 storage / 下載的延遲（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.update(TRACE_LOG="off", BULK_MAX_ROWS=str(args.rows))
+    from core.metrics import set_trace_log
+
+    set_trace_log("off")
+    import linebot.v3.messaging  # noqa: F401  reply models 先載入
+
+    lines, n_bad = make_lines(args.rows, args.bad, random.Random(args.seed))
+    failed = False
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        parse(lines[:100], 0)  # pandas 載入不計
+        vectorized, per_line, accepted, rejected, looped = parse(lines, n_bad)
+    print(f"parse {args.rows} lines: vectorized {vectorized * 1000:.1f} ms, "
+          f"per-line parse_trade_message {per_line * 1000:.1f} ms ({per_line / vectorized:.1f}x)")
+    print(f"      accepted {accepted}, rejected {rejected} (injected {n_bad}; per-line loop accepted {looped})")
+    if accepted != args.rows - n_bad or rejected != n_bad:
+        failed = True
+        print(f"❌ 預期 {args.rows - n_bad} 列通過、{n_bad} 行錯誤")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, segments, rows, replies = end_to_end(lines, args.latency)
+    print(f"e2e   multi-line message + CSV file + single trade: {elapsed * 1000:.1f} ms, "
+          f"ledger segments written {segments}, rows {rows}")
+    for reply in replies:
+        print("      reply: " + reply.splitlines()[0])
+    expected_rows = args.rows - n_bad + 1
+    if segments != 1 or rows != expected_rows or len(replies) != 3:
+        failed = True
+        print(f"❌ 預期 1 個 segment、{expected_rows} 列、3 則回覆")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+LINE 重送的負載測試：同一批事件以不同組合重送，ledger 每個 webhookEventId 只能有一列
+MemoryStore 模擬 GCS（含延遲）、FakeLine 模擬 Messaging API，全部離線
+
+    python -m bench.bench_dedupe --events 300 --redeliveries 3 --threads 8 --latency 0.02
+
+- burst：每個事件送 1 + redeliveries 次（打散順序、一個 request 1～3 個事件、多執行緒同時送）
+- restart：換一個空的 LRU（模擬重啟 / 另一個 instance）再整批重送 → 全部由 storage 上的標記擋下
+ledger 列數、回覆數不等於事件數時 exit 1
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SECRET = "bench-dedupe"
+
+
+class FakeLine:
+    """AsyncMessagingApi 的替身：記錄 reply_token（與回覆的第一則訊息）"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.replies = []
+        self.texts = {}
+
+    async def reply_message(self, req):
+        import asyncio
+
+        await asyncio.sleep(self.latency)
+        self.replies.append(req.reply_token)
+        self.texts[req.reply_token] = req.messages[0].text
+
+
+def make_event(i, redelivery=False):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": 1760000000000 + i,
+        "webhookEventId": f"01BENCH{i:020d}",
+        "deliveryContext": {"isRedelivery": redelivery},
+        "replyToken": f"token-{i}",
+        "source": {"type": "user", "userId": "Ubench"},
+        "message": {"id": str(i), "type": "text", "text": f"2025/01/02, {1000 + i % 50}, BUY, {10 + i % 7}"},
+    }
+
+
+def sign(body, secret=SECRET):
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def deliveries(n, redeliveries, rng):
+    """→ [[event, ...], ...]：每個 request 的事件（重送的事件可能與原本的在同一個 request）"""
+    events = [make_event(i) for i in range(n)]
+    events += [make_event(i, redelivery=True) for i in range(n) for _ in range(redeliveries)]
+    rng.shuffle(events)
+
+    bodies = []
+    while events:
+        size = rng.randint(1, 3)
+        bodies.append(events[:size])
+        events = events[size:]
+    return bodies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--redeliveries", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="每次 storage 呼叫的延遲（秒）")
+    parser.add_argument("--line-latency", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.update(LINE_CHANNEL_SECRET=SECRET, TRACE_LOG="off", WEBHOOK_FLUSH_INTERVAL="0.05")
+
+    from fastapi.testclient import TestClient
+
+    # reply 用的 messaging models 先載入（冷啟動另由 bench.importtime 量測）
+    import linebot.v3.messaging  # noqa: F401
+
+    from storage.gcs import MemoryStore, set_store
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+    from webhook import webhook_server
+    from webhook.dedupe import EventDeduper
+
+    store = MemoryStore(latency=args.latency)
+    set_store(store)
+    backend = GCSLedgerBackend("bench", store)
+    webhook_server.ledger = AppendOnlyLedger(backend)
+    webhook_server.deduper = EventDeduper(backend)
+    line = webhook_server.line_api = FakeLine(args.line_latency)
+    rng = random.Random(args.seed)
+
+    def send(client, events):
+        body = json.dumps({"destination": "Ubot", "events": events})
+        start = time.perf_counter()
+        res = client.post("/callback", content=body, headers={"X-Line-Signature": sign(body)})
+        assert res.status_code == 200, res.text
+        return time.perf_counter() - start
+
+    def replay(client, bodies):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            latencies = sorted(pool.map(lambda events: send(client, events), bodies))
+        client.portal.call(webhook_server.event_queue.join)
+        elapsed = time.perf_counter() - start
+        return elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+    def ledger_rows():
+        _, segments = webhook_server.ledger.read_parts()
+        return sum(segment.count(b"\n") for segment in segments)
+
+    failed = False
+    with contextlib.redirect_stdout(io.StringIO()), TestClient(webhook_server.app) as client:
+        bodies = deliveries(args.events, args.redeliveries, rng)
+        sent = sum(len(b) for b in bodies)
+        burst = replay(client, bodies)
+        burst_stats = dict(webhook_server.stats.to_dict(0), rows=ledger_rows(), replies=len(line.replies))
+        burst_calls = dict(store.calls)
+
+        # 重啟 / 另一個 instance：LRU 是空的，只剩 storage 上的標記
+        webhook_server.deduper = EventDeduper(backend)
+        restart = replay(client, deliveries(args.events, 0, rng))
+        restart_stats = dict(webhook_server.stats.to_dict(0), rows=ledger_rows(), replies=len(line.replies))
+
+    print(f"burst    {sent} deliveries of {args.events} events in {len(bodies)} requests: "
+          f"{burst[0]:.2f} s, callback p50 {burst[1]:.1f} ms p99 {burst[2]:.1f} ms")
+    print(f"         duplicates dropped {burst_stats['duplicates']}, ledger rows {burst_stats['rows']}, "
+          f"replies {burst_stats['replies']}, store writes {burst_calls['write']}")
+    print(f"restart  {args.events} redeliveries: {restart[0]:.2f} s, "
+          f"duplicates dropped {restart_stats['duplicates'] - burst_stats['duplicates']}, "
+          f"ledger rows {restart_stats['rows']}, replies {restart_stats['replies']}")
+
+    for name, result in [("burst", burst_stats), ("restart", restart_stats)]:
+        if result["rows"] != args.events or result["replies"] != args.events:
+            failed = True
+            print(f"❌ {name}: 預期 {args.events} 列 / {args.events} 則回覆")
+    if burst_stats["duplicates"] != sent - args.events:
+        failed = True
+        print(f"❌ burst: 預期丟掉 {sent - args.events} 個重送")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+欄位式持倉引擎 vs 舊的逐列 loop（合成 ledger，離線）
+
+    python -m bench.bench_engine --rows 10000 100000 1000000
+"""
+import argparse
+import time
+
+from bench.synthetic import make_ledger
+from core.engine import compute_positions, resolve_prices
+from core.trade_parser import resolve_price
+from core.utils import calc_avg_cost
+
+def legacy_positions(df, prices, valid_sell_dates):
+    """舊版 process_trades 的 iterrows 迴圈（不含公司名稱），作為正確性基準"""
+    positions = {}
+    completed = []
+
+    for _, row in df.iterrows():
+        date, code, action, value = row["date"], row["code"], row["action"], row["value"]
+        pos = positions.setdefault(code, {"buys": []})
+
+        if action in ["buy", "keep"]:
+            price = resolve_price(code, value, prices)
+            if price is not None:
+                pos["buys"].append({"date": date, "price": price})
+            continue
+
+        if action in ["sell", "reduce"]:
+            if len(pos["buys"]) == 0:
+                continue
+            price = resolve_price(code, value, prices)
+            if price is None:
+                continue
+
+            avg_cost = calc_avg_cost(pos["buys"])
+            if date in valid_sell_dates or action == "reduce":
+                completed.append({
+                    "code": code,
+                    "buy_detail": pos["buys"].copy(),
+                    "sell_date": date,
+                    "action": action,
+                    "avg_cost": avg_cost,
+                    "sell_price": price,
+                    "pct": ((price - avg_cost) / avg_cost) * 100
+                })
+            pos["buys"] = []
+
+    open_buys = {code: pos["buys"] for code, pos in positions.items() if pos["buys"]}
+    return completed, open_buys
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--skip-legacy-above", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df, prices = make_ledger(rows, args.codes)
+        valid = set(df["date"].iloc[-2:])
+
+        start = time.perf_counter()
+        frame = df.assign(price=resolve_prices(df, prices))
+        columnar = compute_positions(frame, valid)
+        columnar_time = time.perf_counter() - start
+
+        line = f"rows={rows:>9,}  columnar={columnar_time:7.2f}s"
+        if rows <= args.skip_legacy_above:
+            start = time.perf_counter()
+            legacy = legacy_positions(df, prices, valid)
+            legacy_time = time.perf_counter() - start
+
+            assert columnar[0] == legacy[0], "completed trades differ from legacy loop"
+            assert list(columnar[1].items()) == list(legacy[1].items()), "open positions differ from legacy loop"
+            line += f"  legacy={legacy_time:7.2f}s  speedup={legacy_time / columnar_time:5.1f}x"
+
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
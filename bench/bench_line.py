@@ -0,0 +1,286 @@
+"""
+LINE 推播的送出端：本機的 mock LINE server（http.server，跑在背景執行緒），全部離線
+
+    python -m bench.bench_line --users 300 --workers 8 --error-rate 0.05 --drop-rate 0.02
+
+mock server 的行為與 Messaging API 相同的部分：
+- 檢查 Authorization、一次最多 5 則訊息、每則最多 5000 字、multicast 最多 500 人
+- X-Line-Retry-Key 已經收過 → 409（不重複推播）
+- error-rate：回 500；drop-rate：收下訊息但不回應就斷線（回應遺失，重試要靠 retry key）
+- 第 throttle-at 個 request 起 Retry-After 秒內一律 429
+
+情境
+- baseline：每個 request 新開連線（原本的 requests.post）vs LineClient 的連線池
+- flaky：push_messages（長報表、部分收件者內容相同 → multicast），每位使用者每段只收到一次
+- outage：LINE 全部回 503 → 進 outbox；恢復後下一次執行（新的 client）先送出 outbox
+結果不符預期時 exit 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN = "bench-line"
+
+
+class MockLine:
+    """mock server 的狀態（所有 handler 執行緒共用）"""
+
+    def __init__(self, error_rate=0.0, drop_rate=0.0, throttle_at=None, retry_after=1, seed=0):
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.throttle_at = throttle_at
+        self.retry_after = retry_after
+        self.outage = False
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.connections = 0
+        self.status = {}
+        self.keys = set()
+        # (收件者, 訊息內容) → 收到幾次
+        self.delivered = {}
+        self.throttled_until = None
+
+    def handle(self, path, headers, body):
+        """→ (status, extra headers, drop)"""
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            if self.outage:
+                return 503, {}, False
+            if self.throttle_at and self.requests == self.throttle_at:
+                self.throttled_until = now + self.retry_after
+            if self.throttled_until and now < self.throttled_until:
+                return 429, {"Retry-After": str(self.retry_after)}, False
+            if headers.get("Authorization") != f"Bearer {TOKEN}":
+                return 401, {}, False
+
+            payload = json.loads(body)
+            messages = payload.get("messages", [])
+            to = payload["to"] if path.endswith("multicast") else [payload["to"]]
+            if not 1 <= len(messages) <= 5 or any(len(m["text"]) > 5000 for m in messages) or len(to) > 500:
+                return 400, {}, False
+
+            key = headers.get("X-Line-Retry-Key")
+            if key in self.keys:
+                return 409, {}, False
+            if self.rng.random() < self.error_rate:
+                return 500, {}, False
+
+            self.keys.add(key)
+            for user_id in to:
+                for m in messages:
+                    self.delivered[(user_id, m["text"])] = self.delivered.get((user_id, m["text"]), 0) + 1
+            return 200, {}, self.rng.random() < self.drop_rate
+
+
+def serve(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # header 與 body 分兩次寫出；不關 Nagle 的話 keep-alive 連線每個回應會卡在 delayed ACK
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with mock.lock:
+                mock.connections += 1
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            status, extra, drop = mock.handle(self.path, self.headers, body)
+            with mock.lock:
+                mock.status[status] = mock.status.get(status, 0) + 1
+            if drop:
+                self.close_connection = True
+                self.connection.close()
+                return
+            data = b"{}"
+            self.send_response(status)
+            for name, value in extra.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_reports(users, rng):
+    """一半的使用者內容相同（multicast），其中部分報表超過 5000 字（切成多則訊息）"""
+    shared = "\n".join(f"共同報表 {i:04d} " + "持股明細 " * 20 for i in range(60))
+    reports = []
+    for i in range(users):
+        user_id = f"U{i:032d}"
+        if i % 2:
+            reports.append((user_id, shared))
+        else:
+            lines = rng.randint(1, 80)
+            reports.append((user_id, "\n".join(f"{user_id} 第 {j} 行 " + "損益 " * 40 for j in range(lines))))
+    return reports
+
+
+def expected_deliveries(reports):
+    from notify.push_bot import split_text
+
+    return {(user_id, chunk) for user_id, text in reports for chunk in split_text(text)}
+
+
+def delivery_errors(mock, reports):
+    """→ (沒收到的, 收到不只一次的) (收件者, 訊息內容)"""
+    expected = expected_deliveries(reports)
+    missing = expected - set(mock.delivered)
+    duplicated = [k for k, n in mock.delivered.items() if n > 1]
+    return missing, duplicated
+
+
+def check(name, mock, reports):
+    """每位使用者的每一段訊息剛好收到一次"""
+    expected = expected_deliveries(reports)
+    missing, duplicated = delivery_errors(mock, reports)
+    print(f"         {name}: {len(expected)} user × message pairs, missing {len(missing)}, "
+          f"duplicated {len(duplicated)}")
+    return not missing and not duplicated
+
+
+def baseline(url, mock, n, workers):
+    """原本的寫法：每個 request 一個新的 requests.post（新連線、沒有 timeout）"""
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+
+    from notify.line_client import LineClient
+
+    body = {"to": "Ubaseline", "messages": [{"type": "text", "text": "hello"}]}
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {TOKEN}"}
+
+    rows = []
+    mock.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda _: requests.post(url + "/v2/bot/message/push", headers=headers, data=json.dumps(body)),
+                      range(n)))
+    rows.append(("requests.post", time.perf_counter() - start, mock.connections))
+
+    mock.reset()
+    client = LineClient(TOKEN, base_url=url, pool_size=workers, rate=None)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda _: client.send("push", body), range(n)))
+    rows.append(("LineClient", time.perf_counter() - start, mock.connections))
+    client.close()
+    return rows
+
+
+def latency_summary():
+    from core.metrics import registry
+
+    snapshot = registry.snapshot()
+    delivery = [s for s in snapshot["summaries"] if s["name"] == "line_delivery_seconds"]
+    retries = sum(c["value"] for c in snapshot["counters"] if c["name"] == "retries_total" and c["service"] == "line")
+    parts = [f"{s['op']} n={s['count']} p50 {s['p50'] * 1000:.1f} ms p99 {s['p99'] * 1000:.1f} ms" for s in delivery]
+    return ", ".join(parts) + f", retries {retries}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000, help="baseline 的 request 數")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--drop-rate", type=float, default=0.02)
+    parser.add_argument("--throttle-at", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockLine(args.error_rate, args.drop_rate, args.throttle_at, seed=args.seed)
+    server, url = serve(mock)
+
+    # outbox 放在 MemoryStore（GCS backend 的 in-memory 版本）
+    os.environ.update(
+        LINE_API_BASE=url, LINE_CHANNEL_TOKEN=TOKEN, LINE_BACKOFF="0.05", LINE_RETRIES="4",
+        LINE_POOL_SIZE=str(args.workers), LINE_PUSH_WORKERS=str(args.workers),
+        LEDGER_BACKEND="gcs", GCS_BUCKET="bench", TRACE_LOG="off",
+    )
+    from core.metrics import registry, set_trace_log
+    from notify import line_client, push_bot
+    from storage.gcs import MemoryStore, set_store
+
+    set_trace_log("off")
+    store = MemoryStore()
+    set_store(store)
+    rng = random.Random(args.seed)
+    failed = False
+
+    # ---- baseline：連線數（server 不出錯）----
+    mock.error_rate = mock.drop_rate = 0.0
+    mock.throttle_at = None
+    for name, elapsed, connections in baseline(url, mock, args.requests, args.workers):
+        print(f"baseline {name:<14} {args.requests} pushes: {elapsed:.2f} s "
+              f"({args.requests / elapsed:,.0f}/s), {connections} TCP connections")
+    failed = failed or mock.connections > args.workers
+
+    # ---- flaky：500 / 斷線 / 429 ----
+    mock.error_rate, mock.drop_rate, mock.throttle_at = args.error_rate, args.drop_rate, args.throttle_at
+    mock.reset()
+    registry.reset()
+    line_client.reset_clients()
+    reports = make_reports(args.users, rng)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        statuses = push_bot.push_messages(reports)
+    elapsed = time.perf_counter() - start
+    ok = sum(push_bot._ok(s) for s in statuses.values())
+    print(f"flaky    {args.users} users: {elapsed:.2f} s, {mock.requests} requests "
+          f"over {mock.connections} connections, server status {dict(sorted(mock.status.items()))}")
+    print(f"         delivered ok {ok}/{len(statuses)}, {latency_summary()}")
+    failed = not check("flaky", mock, reports) or ok != args.users or failed
+    # Retry-After 期間其他執行緒也暫停：429 最多是當下在途的 request
+    if mock.status.get(429, 0) > 2 * args.workers:
+        failed = True
+        print(f"❌ 429 × {mock.status[429]}：Retry-After 期間仍持續送出")
+
+    # ---- outage → outbox → 下一次執行 drain ----
+    mock.reset()
+    mock.outage = True
+    mock.throttle_at = None
+    line_client.reset_clients()
+    reports = make_reports(args.users // 3, rng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        statuses = push_bot.push_messages(reports)
+    queued = len(store.list("bench", line_client.OUTBOX_PREFIX))
+    print(f"outage   {len(reports)} users: all failed {not any(push_bot._ok(s) for s in statuses.values())}, "
+          f"{queued} requests queued in outbox")
+
+    mock.outage = False
+    line_client.reset_clients()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client = line_client.get_client(TOKEN)
+    remaining = len(store.list("bench", line_client.OUTBOX_PREFIX))
+    print(f"next run drained outbox in {time.perf_counter() - start:.2f} s, {remaining} left, "
+          f"client stats {client.stats}")
+    failed = not check("outage", mock, reports) or queued == 0 or remaining != 0 or failed
+
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Webhook 查詢（持倉 / 報告 / 代號）的回應時間：MemoryStore 模擬 GCS、stub 報價 / 公司名稱，全部離線
+
+    python -m bench.bench_live --rows 50000 --codes 300 --latency 0.03 --price-latency 0.05
+
+- cold：第一次查詢（完整下載 + 重播）
+- warm：之後的查詢只用記憶體中的持倉 + TTL 報價，不應碰 storage / 資料源
+- append：webhook 寫入一列後 apply()，下一個查詢立刻看得到、不重新下載
+- 其他 instance 寫入 → 版本變了才重新載入；結果須與完整重播相同
+warm 查詢的 p99 超過 --target-ms 時 exit 1
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.03, help="每次 storage 呼叫的延遲（秒）")
+    parser.add_argument("--price-latency", type=float, default=0.05, help="每次查價的延遲（秒）")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--target-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    os.environ["TRACE_LOG"] = "off"
+
+    from bench.synthetic import StubNameLookup, make_ledger
+    from core import company
+    from core.live import LivePortfolio, QuoteCache
+    from core.metrics import set_trace_log
+    from core.price import LocalPriceProvider
+    from core.trade_parser import replay_trades, valid_sell_dates
+    from storage.gcs import MemoryStore, set_store
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+    from webhook import webhook_server
+
+    set_trace_log("off")
+    company._lookup_yahoo = StubNameLookup()
+    company._cache = company.NameCache(tempfile.mkdtemp())
+
+    df, prices = make_ledger(args.rows, args.codes)
+    store = MemoryStore(latency=args.latency)
+    set_store(store)
+    store.write("bench", "trades.csv", df.to_csv(index=False))
+    ledger = AppendOnlyLedger(GCSLedgerBackend("bench", store))
+
+    provider = LocalPriceProvider({c: p[0] for c, p in prices.items()}, latency=args.price_latency)
+    live = LivePortfolio(ledger, QuoteCache(provider), check_interval=60)
+    webhook_server.live_portfolios[None] = live
+    some_code = df["code"].iloc[-1]
+
+    class Event:
+        source = None
+
+    def query(text):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            texts = webhook_server.answer_query(Event(), webhook_server.parse_query(text))
+        return time.perf_counter() - start, texts
+
+    def pct(samples, p):
+        samples = sorted(samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+    cold, _ = query("持倉")
+    print(f"cold   持倉   {cold * 1000:8.1f} ms  (store calls {dict(store.calls)})")
+
+    failed = False
+    for text in ["持倉", "報告", some_code]:
+        before = dict(store.calls)
+        latencies = [query(text)[0] for _ in range(args.queries)]
+        p99 = pct(latencies, 0.99)
+        touched = {k: v - before[k] for k, v in store.calls.items() if v != before[k]}
+        failed = failed or p99 > args.target_ms
+        print(f"warm   {text:<6} p50 {pct(latencies, 0.5):7.1f} ms  p99 {p99:7.1f} ms  storage calls {touched or 0}")
+
+    # webhook 自己寫入 → apply，下一個查詢立刻反映、不重新載入
+    row = {"date": valid_sell_dates().pop(), "code": some_code, "action": "BUY", "value": "123.45"}
+    with contextlib.redirect_stdout(io.StringIO()):
+        segment = ledger.append([row])
+        start = time.perf_counter()
+        live.apply([row], segment)
+    applied = time.perf_counter() - start
+    elapsed, texts = query(some_code)
+    assert "123.45" in "\n".join(texts), "apply 之後的查詢沒有看到新寫入的列"
+    print(f"append apply {applied * 1000:6.1f} ms → 代號查詢 {elapsed * 1000:7.1f} ms  (loads={live.loads})")
+
+    # 其他 instance 寫入 → 版本變了，下一次確認時重新載入
+    other = dict(row, value="99.5")
+    with contextlib.redirect_stdout(io.StringIO()):
+        ledger.append([other])
+    live.checked_at -= live.check_interval
+    elapsed, texts = query(some_code)
+    assert live.loads == 2 and "99.50" in "\n".join(texts), "沒有偵測到 ledger 版本變動"
+    print(f"reload       → 代號查詢 {elapsed * 1000:7.1f} ms  (loads={live.loads})")
+
+    # 與完整重播比對
+    with contextlib.redirect_stdout(io.StringIO()):
+        live.apply([dict(row, value="77.7")], ledger.append([dict(row, value="77.7")]))
+        completed, open_buys, _ = replay_trades(ledger.read_bytes(), QuoteCache(provider))
+    same = (live.completed, live.open_buys) == (completed, open_buys)
+    print(f"matches full replay: {same}")
+    assert same
+
+    if failed:
+        print(f"❌ warm p99 超過 {args.target_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
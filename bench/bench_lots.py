@@ -0,0 +1,50 @@
+"""
+Lot 引擎（core.lots）每筆 fill 的耗時：ledger 越長，每筆的成本應該維持不變
+
+    python -m bench.bench_lots --rows 10000 100000 1000000 --codes 50
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.lots import FeeSchedule, compute_lot_positions
+
+
+def make_lot_ledger(rows, codes, seed=0):
+    """每檔大致買多賣少，讓未平倉 lots 隨時間累積（FIFO 佇列很長）"""
+    rng = np.random.default_rng(seed)
+    action = np.array(["buy", "reduce", "sell"])[rng.choice(3, rows, p=[0.6, 0.38, 0.02])]
+    return pd.DataFrame({
+        "date": pd.date_range("2010-01-01", periods=rows, freq="min").strftime("%Y-%m-%d"),
+        "code": (1000 + rng.integers(0, codes, rows)).astype(str),
+        "action": action,
+        "price": np.round(rng.uniform(10, 500, rows), 2),
+        "qty": rng.integers(1, 10, rows) * 1000.0,
+        "fee": np.nan,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--codes", type=int, default=50)
+    args = parser.parse_args()
+
+    fees = FeeSchedule()
+    for rows in args.rows:
+        df = make_lot_ledger(rows, args.codes)
+        for method in ["fifo", "average"]:
+            start = time.perf_counter()
+            completed, open_buys = compute_lot_positions(df, set(), method=method, fees=fees)
+            elapsed = time.perf_counter() - start
+            lots = sum(len(b) for b in open_buys.values())
+            print(
+                f"rows={rows:>9,} {method:<7} {elapsed:7.2f}s  {elapsed / rows * 1e6:6.2f} µs/fill"
+                f"  completed={len(completed):,} open lots={lots:,}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+多使用者 nightly job 的 throughput（合成 portfolios + stub providers，全部離線）
+
+    python -m bench.bench_portfolios --portfolios 1000 --rows 200 --price-latency 0.02
+    python -m bench.bench_portfolios --portfolios 1000 --serial   # 逐一處理、各自查價（對照組）
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench.synthetic import StubLinePost, StubNameLookup, install_stub_line, make_ledger
+
+
+def make_portfolios(n, rows, universe, codes, seed=0):
+    """每個 portfolio 從 universe 個代號中取一段連續的 codes 個代號"""
+    rng = np.random.default_rng(seed)
+    ledgers, prices = {}, {}
+    for i in range(n):
+        offset = int(rng.integers(0, max(universe - codes, 1)))
+        df, p = make_ledger(rows, codes, seed=seed + i, code_offset=offset)
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False)
+        ledgers[f"U{i:032x}"] = buffer.getvalue().encode("utf-8")
+        prices.update(p)
+    return ledgers, {code: close for code, (close, _) in prices.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--portfolios", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--universe", type=int, default=2000)
+    parser.add_argument("--codes", type=int, default=20)
+    parser.add_argument("--price-latency", type=float, default=0.0)
+    parser.add_argument("--name-latency", type=float, default=0.0)
+    parser.add_argument("--line-latency", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--serial", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["TRACE_LOG"] = "off"
+    os.environ.setdefault("LINE_CHANNEL_TOKEN", "bench")
+
+    from core import company
+    from core.metrics import set_trace_log
+    from core.portfolios import process_portfolios
+    from core.price import LocalPriceProvider
+    from core.trade_parser import process_trades
+    from notify import push_bot
+    from report.formatter import format_report
+
+    set_trace_log("off")
+    company._lookup_yahoo = StubNameLookup(latency=args.name_latency)
+    company._cache = company.NameCache(tempfile.mkdtemp())
+
+    line = StubLinePost(latency=args.line_latency)
+    install_stub_line(line)
+
+    ledgers, closes = make_portfolios(args.portfolios, args.rows, args.universe, args.codes)
+    provider = LocalPriceProvider(closes, latency=args.price_latency)
+    print(f"{len(ledgers)} portfolios × {args.rows} rows, {len(closes)} distinct codes")
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.serial:
+            results = {u: process_trades(data, provider) for u, data in ledgers.items()}
+        else:
+            results = process_portfolios(ledgers, provider, max_workers=args.workers)
+    replay = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reports = [(u, format_report(*results[u])) for u in ledgers]
+    formatting = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.serial:
+            for user_id, text in reports:
+                push_bot.push_message(text, to=user_id)
+        else:
+            push_bot.push_messages(reports)
+    pushing = time.perf_counter() - start
+
+    total = replay + formatting + pushing
+    mode = "serial" if args.serial else f"pool({args.workers})"
+    print(f"mode={mode}")
+    print(f"  replay   {replay:8.2f}s  price lookups={provider.calls}  name lookups={company._lookup_yahoo.calls}")
+    print(f"  format   {formatting:8.2f}s")
+    print(f"  push     {pushing:8.2f}s  LINE requests={line.calls}")
+    print(f"  total    {total:8.2f}s  → {len(ledgers) / total:,.0f} portfolios/s")
+
+
+if __name__ == "__main__":
+    main()
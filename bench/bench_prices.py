@@ -0,0 +1,41 @@
+"""
+比較逐檔查價 vs 批次查價（離線，用 LocalPriceProvider 模擬網路延遲）
+
+    python -m bench.bench_prices --codes 300 --latency 0.05
+"""
+import argparse
+import time
+
+from core.price import LocalPriceProvider
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    prices = {f"{1000 + i}": 10.0 + i for i in range(args.codes)}
+    provider = LocalPriceProvider(prices, latency=args.latency, max_workers=args.workers)
+    codes = list(prices)
+
+    start = time.perf_counter()
+    serial = {code: provider.get_close_price(code) for code in codes}
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = provider.get_close_prices(codes)
+    batched_time = time.perf_counter() - start
+
+    assert serial == batched
+
+    print(f"codes   : {args.codes}")
+    print(f"latency : {args.latency * 1000:.0f} ms / call")
+    print(f"serial  : {serial_time:.2f} sec")
+    print(f"batched : {batched_time:.2f} sec ({args.workers} workers)")
+    print(f"speedup : {serial_time / batched_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+報表渲染：分別呼叫 print_report + format_report（對照組）vs 一次彙總的 render_all vs 快取命中
+
+    python -m bench.bench_report --rows 200000 --codes 2000
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--codes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["TRACE_LOG"] = "off"
+    os.environ.setdefault("LINE_CHANNEL_TOKEN", "bench")
+    os.environ.setdefault("LINE_USER_ID", "bench")
+
+    from bench.synthetic import StubLinePost, StubNameLookup, install_stub_line, make_ledger
+    from core import company
+    from core.metrics import set_trace_log
+    from core.price import LocalPriceProvider
+    from core.trade_parser import TODAY, build_positions, replay_trades
+    from notify import push_bot
+    from report.formatter import format_report, print_report, render_all
+    from report.model import ReportCache, fingerprint
+
+    set_trace_log("off")
+    company._lookup_yahoo = StubNameLookup()
+    company._cache = company.NameCache(tempfile.mkdtemp())
+
+    df, prices = make_ledger(args.rows, args.codes)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    provider = LocalPriceProvider({c: p[0] for c, p in prices.items()})
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        completed, open_buys, quotes = replay_trades(buffer.getvalue().encode("utf-8"), provider)
+        replayed = (completed, open_buys, quotes)
+        completed, open_positions = build_positions(*replayed)
+    print(f"{len(completed):,} completed / {len(open_positions):,} open")
+
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = fn()
+        return (time.perf_counter() - start) / args.repeat, result
+
+    def separate():
+        text = format_report(completed, open_positions)
+        print_report(completed, open_positions)
+        return text
+
+    cache = ReportCache(tempfile.mkdtemp())
+
+    def cached():
+        key = fingerprint(*replayed, TODAY)
+        outputs = cache.get(key)
+        if outputs is None:
+            outputs = render_all(*build_positions(*replayed), as_of=TODAY)
+            cache.put(key, outputs)
+        return outputs
+
+    baseline, text = timed(separate)
+    shared, outputs = timed(lambda: render_all(completed, open_positions, as_of=TODAY))
+    assert outputs["line"] == text
+    cached()
+    hit, _ = timed(cached)
+
+    print(f"  print + format   {baseline * 1000:8.1f} ms")
+    print(f"  render_all       {shared * 1000:8.1f} ms  (console + LINE + JSON {len(outputs['json']):,} bytes)")
+    print(f"  cache hit        {hit * 1000:8.1f} ms")
+
+    line = StubLinePost()
+    install_stub_line(line)
+    with contextlib.redirect_stdout(io.StringIO()):
+        push_bot.push_message(outputs["line"])
+    chunks = len(push_bot.split_text(outputs["line"]))
+    print(f"  LINE text {len(outputs['line']):,} chars → {chunks} messages in {line.calls} requests")
+
+
+if __name__ == "__main__":
+    main()
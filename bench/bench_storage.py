@@ -0,0 +1,40 @@
+"""
+共用 storage 層：重複讀取沒變動的 ledger（MemoryStore 模擬網路延遲）
+
+    python -m bench.bench_storage --rows 100000 --reads 20 --latency 0.03
+"""
+import argparse
+import time
+
+from storage.gcs import MemoryStore, set_store
+from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--reads", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+
+    store = MemoryStore(latency=args.latency)
+    set_store(store)
+
+    body = "".join(f"2026-01-02,{1000 + i % 300},BUY,{10 + i % 50}\n" for i in range(args.rows))
+    store.write("bench", "trades.csv", "date,code,action,value\n" + body)
+    ledger = AppendOnlyLedger(GCSLedgerBackend("bench", store))
+
+    start = time.perf_counter()
+    for _ in range(args.reads):
+        ledger.read_bytes()
+    elapsed = time.perf_counter() - start
+
+    print(f"reads        : {args.reads}")
+    print(f"elapsed      : {elapsed:.2f} sec ({elapsed / args.reads * 1000:.1f} ms / read)")
+    print(f"store calls  : {store.calls}")
+    print(f"downloads    : {store.calls['read'] - store.calls['not_modified']} full, "
+          f"{store.calls['not_modified']} not-modified")
+
+
+if __name__ == "__main__":
+    main()
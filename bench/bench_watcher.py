@@ -0,0 +1,122 @@
+"""
+盤中停利 / 停損監控：模擬報價（SimulatedQuoteFeed）+ MemoryStore 上的 ledger，全部離線
+
+    python -m bench.bench_watcher --positions 50 500 5000 --polls 50
+
+- scaling：未平倉檔數增加時，每次輪詢的查價呼叫數（應固定為 1）與 CPU 時間
+- debounce：腳本化的價格路徑，在門檻附近來回震盪只提醒一次；
+  回到門檻內 REARM % 以上且過了 COOLDOWN 才再提醒
+結果不符預期時 exit 1
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+
+def build_portfolio(codes, latency=0.0):
+    """每檔 2 筆 BUY（價格 100 / 110 → 均價 105）"""
+    from core.live import LivePortfolio, QuoteCache
+    from core.price import LocalPriceProvider
+    from storage.gcs import MemoryStore
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+
+    store = MemoryStore(latency=latency)
+    body = "".join(
+        f"2024-01-02,{code},BUY,100\n2024-01-03,{code},BUY,110\n" for code in codes
+    )
+    store.write("bench", "trades.csv", "date,code,action,value\n" + body)
+    ledger = AppendOnlyLedger(GCSLedgerBackend("bench", store))
+    return LivePortfolio(ledger, QuoteCache(LocalPriceProvider({})), check_interval=3600), ledger
+
+
+def scaling(sizes, polls):
+    from core.watcher import PositionWatcher, SimulatedQuoteFeed
+
+    rows = []
+    for n in sizes:
+        codes = [str(100000 + i) for i in range(n)]
+        portfolio, _ = build_portfolio(codes)
+        feed = SimulatedQuoteFeed({c: 105.0 for c in codes}, volatility=0.01)
+        fired = []
+        watcher = PositionWatcher(portfolio, feed, thresholds={}, notify=fired.extend, cooldown=0)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            watcher.poll()  # 載入 ledger + 算價位
+
+        feed_time = 0.0
+        inner = feed.get_quotes
+
+        def timed(codes):
+            nonlocal feed_time
+            start = time.process_time()
+            try:
+                return inner(codes)
+            finally:
+                feed_time += time.process_time() - start
+
+        feed.get_quotes = timed
+        calls = feed.calls
+        start = time.process_time()
+        for _ in range(polls):
+            watcher.poll()
+        cpu = (time.process_time() - start - feed_time) / polls
+        rows.append((n, (feed.calls - calls) / polls, cpu * 1000, len(fired)))
+    return rows
+
+
+def debounce():
+    """均價 105：停利 115.5（+10%）、停損 96.6（-8%）；REARM 1%、COOLDOWN 60 秒"""
+    from core.watcher import PositionWatcher, SimulatedQuoteFeed
+
+    portfolio, _ = build_portfolio(["2330"])
+    path = [
+        105, 96.5, 96.0, 96.7, 96.4,   # 觸及停損一次；在門檻附近震盪不重複
+        98.0, 96.0,                    # 回到 97.57 以上 → 重新啟用，但還在 cooldown
+        98.0, 96.0,                    # 過了 cooldown → 再提醒一次
+        116.0, 117.0, 115.0, 116.0,    # 停利一次（115.0 沒回到 114.35 以下，不重新啟用）
+    ]
+    clock = iter(range(0, 1000, 10))
+    feed = SimulatedQuoteFeed({"2330": 105}, moves={"2330": path})
+    fired = []
+    watcher = PositionWatcher(
+        portfolio, feed, thresholds={}, notify=fired.extend,
+        rearm_pct=1, cooldown=60, clock=lambda: next(clock),
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in path:
+            watcher.poll()
+    return [(a["kind"], a["price"]) for a in fired]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--polls", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ["TRACE_LOG"] = "off"
+    from core.metrics import set_trace_log
+
+    set_trace_log("off")
+    failed = False
+
+    print(f"{'positions':>10} {'quote calls/poll':>17} {'cpu ms/poll':>12} {'µs/position':>12} {'alerts':>7}")
+    for n, calls, cpu_ms, alerts in scaling(args.positions, args.polls):
+        print(f"{n:>10} {calls:>17.1f} {cpu_ms:>12.3f} {cpu_ms * 1000 / n:>12.2f} {alerts:>7}")
+        failed = failed or calls != 1
+
+    fired = debounce()
+    expected = [("stop_loss", 96.5), ("stop_loss", 96.0), ("take_profit", 116.0)]
+    print(f"debounce: {fired}")
+    if fired != expected:
+        failed = True
+        print(f"❌ 預期 {expected}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
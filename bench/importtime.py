@@ -0,0 +1,104 @@
+"""
+冷啟動的 import 預算：以 `python -X importtime` 載入各個 entry point，解析每個模組的累計時間
+
+    python -m bench.importtime
+    python -m bench.importtime --budget-scale 2      # 較慢的機器 / CI
+
+- 每個 entry point 的累計 import 時間超過預算 → exit 1
+- 不該在 import 時載入的套件（例如 webhook 的寫入路徑載入 pandas）→ exit 1
+每次量測都是新的 subprocess（不受這個 process 已載入的模組影響），取 --repeat 次的最小值
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# entry point → (預算 ms, import 時不該載入的套件)
+ENTRY_POINTS = {
+    # webhook 寫入路徑：簽章驗證 + append segment + 回覆
+    "webhook.webhook_server": (600, [
+        "pandas", "numpy", "pyarrow", "requests",
+        "linebot.v3.messaging", "linebot.v3.webhooks",
+        "google.cloud", "yfinance", "FinMind",
+    ]),
+    # 每晚的 Job：pandas（連帶 pyarrow）是每條路徑都會用到的；
+    # 資料源 / GCS client / 多使用者 process pool / 權益曲線用到才載入
+    "main": (1500, [
+        "yfinance", "FinMind", "google.cloud",
+        "linebot", "fastapi", "core.portfolios", "core.analytics",
+    ]),
+}
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """→ {模組名稱: (累計 µs, 深度)}（新的 subprocess，stderr 為 importtime 輸出）"""
+    env = dict(os.environ, PYTHONPATH=ROOT, LINE_CHANNEL_SECRET=os.getenv("LINE_CHANNEL_SECRET", "importtime"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=ROOT,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            # 縮排：第一層 1 格，每深一層多 2 格
+            times[match.group(4)] = (int(match.group(2)), (len(match.group(3)) - 1) // 2)
+    return times
+
+
+def loaded(times, package):
+    return [name for name in times if name == package or name.startswith(package + ".")]
+
+
+def fastest(module, repeat=3):
+    """repeat 次量測中 entry point 累計時間最短的一次 → (ms, times)"""
+    times = min((measure(module) for _ in range(repeat)), key=lambda t: t[module][0])
+    return times[module][0] / 1000, times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget-scale", type=float, default=1.0)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        budget, forbidden = ENTRY_POINTS.get(module, (None, []))
+        total, times = fastest(module, args.repeat)
+
+        limit = None if budget is None else budget * args.budget_scale
+        status = "ok" if limit is None or total <= limit else "OVER BUDGET"
+        print(f"{module:<24} {total:8.1f} ms" + (f"  (budget {limit:.0f} ms)  {status}" if limit else ""))
+
+        # entry point 直接 import 的模組，依累計時間排序
+        top = sorted(
+            ((t, name) for name, (t, depth) in times.items() if depth == 1),
+            reverse=True,
+        )[:args.top]
+        for t, name in top:
+            print(f"    {t / 1000:8.1f} ms  {name}")
+
+        for package in forbidden:
+            names = loaded(times, package)
+            if names:
+                failed = True
+                print(f"  ❌ {package} loaded at import time ({', '.join(names[:3])}{' …' if len(names) > 3 else ''})")
+
+        failed = failed or status != "ok"
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
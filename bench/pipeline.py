@@ -0,0 +1,219 @@
+"""
+Nightly job（main.py）各階段的 benchmark：合成 ledger + stub providers，全部離線
+
+    python -m bench.pipeline --rows 100000 --codes 300 --null-ratio 0.1 \\
+        --price-latency 0.05 --name-latency 0.2 --line-latency 0.1 --out bench.json
+
+    python -m bench.pipeline --compare old.json new.json
+
+每個階段記錄 wall time、外部呼叫次數與 peak memory（tracemalloc，另跑一次以免影響計時），
+輸出 JSON 方便跨 commit 比較。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.synthetic import StubLinePost, StubNameLookup, install_stub_line, make_ledger
+
+STAGES = ["load_csv", "process_trades", "prices", "names", "format_report", "print_report", "push_message"]
+
+
+class StageRecorder:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+
+    def _entry(self, name):
+        return self.stages.setdefault(name, {"wall_s": 0.0, "calls": 0, "peak_mb": None})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self._entry(name)
+            entry["wall_s"] += time.perf_counter() - start
+            entry["calls"] += 1
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                entry["peak_mb"] = max(entry["peak_mb"] or 0.0, round(peak, 2))
+
+    def wrap(self, name, fn):
+        """巢狀階段（例如 process_trades 裡的查價）：只計時與計數，不重設 peak"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                entry = self._entry(name)
+                entry["wall_s"] += time.perf_counter() - start
+                entry["calls"] += 1
+        return wrapper
+
+
+def run_pipeline(args, recorder):
+    from core import company, trade_parser
+    from core.price import LocalPriceProvider
+    from notify import push_bot
+    from report.formatter import format_report, print_report
+    from storage.gcs import MemoryStore
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+
+    df, prices = make_ledger(args.rows, args.codes, args.null_ratio, args.seed)
+
+    # ---- stubs ----
+    store = MemoryStore(latency=args.storage_latency)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    store.write("bench", "trades.csv", buffer.getvalue())
+    ledger = AppendOnlyLedger(GCSLedgerBackend("bench", store))
+
+    provider = LocalPriceProvider({c: p[0] for c, p in prices.items()}, latency=args.price_latency)
+    provider.get_close_prices = recorder.wrap("prices", provider.get_close_prices)
+
+    names = StubNameLookup(latency=args.name_latency, miss_ratio=args.name_miss_ratio)
+    company._lookup_yahoo = names
+    company._cache = company.NameCache(tempfile.mkdtemp())
+    original_resolve = company.resolve_company_names
+    trade_parser.resolve_company_names = recorder.wrap("names", original_resolve)
+
+    line = StubLinePost(latency=args.line_latency)
+    install_stub_line(line)
+    os.environ.setdefault("LINE_CHANNEL_TOKEN", "bench")
+    os.environ.setdefault("LINE_USER_ID", "bench")
+
+    # ---- pipeline（與 main.py 相同順序）----
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with recorder.stage("load_csv"):
+                data = ledger.open_stream if args.stream else ledger.read_bytes()
+
+            with recorder.stage("process_trades"):
+                completed, open_positions = trade_parser.process_trades(data, provider)
+
+            with recorder.stage("format_report"):
+                text = format_report(completed, open_positions)
+
+            with recorder.stage("print_report"):
+                print_report(completed, open_positions)
+
+            with recorder.stage("push_message"):
+                push_bot.push_message(text)
+    finally:
+        trade_parser.resolve_company_names = original_resolve
+
+    return {
+        "storage": sum(v for k, v in store.calls.items() if k != "not_modified") - 1,
+        "price_lookups": provider.calls,
+        "name_lookups": names.calls,
+        "line_requests": line.calls,
+        "completed": len(completed),
+        "open_positions": len(open_positions),
+        "report_chars": len(text),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    timing = StageRecorder()
+    counts = run_pipeline(args, timing)
+
+    stages = timing.stages
+    if not args.no_memory:
+        memory = StageRecorder(memory=True)
+        tracemalloc.start()
+        try:
+            run_pipeline(args, memory)
+        finally:
+            tracemalloc.stop()
+        for name, entry in memory.stages.items():
+            stages[name]["peak_mb"] = entry["peak_mb"]
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ["out", "compare", "no_memory"]},
+        "stages": {name: stages[name] for name in STAGES if name in stages},
+        "total_s": sum(stages[name]["wall_s"] for name in STAGES if name not in ["prices", "names"]),
+        "external_calls": counts,
+    }
+
+
+def print_result(result):
+    print(f"commit {result['commit']}  params {result['params']}")
+    print(f"{'stage':<16}{'wall (s)':>10}{'calls':>8}{'peak (MB)':>12}")
+    for name, entry in result["stages"].items():
+        label = f"  {name}" if name in ["prices", "names"] else name
+        peak = "-" if entry["peak_mb"] is None else f"{entry['peak_mb']:.2f}"
+        print(f"{label:<16}{entry['wall_s']:>10.3f}{entry['calls']:>8}{peak:>12}")
+    print(f"{'total':<16}{result['total_s']:>10.3f}")
+    print(f"external calls: {result['external_calls']}")
+
+
+def compare(old_path, new_path):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{'stage':<16}{old['commit'] or 'old':>12}{new['commit'] or 'new':>12}{'delta':>10}")
+    for name in STAGES + ["total"]:
+        if name == "total":
+            a, b = old["total_s"], new["total_s"]
+        elif name in old["stages"] and name in new["stages"]:
+            a, b = old["stages"][name]["wall_s"], new["stages"][name]["wall_s"]
+        else:
+            continue
+        delta = f"{(b - a) / a * 100:+.1f}%" if a else "-"
+        print(f"{name:<16}{a:>12.3f}{b:>12.3f}{delta:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--null-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage-latency", type=float, default=0.0)
+    parser.add_argument("--price-latency", type=float, default=0.0)
+    parser.add_argument("--name-latency", type=float, default=0.0)
+    parser.add_argument("--name-miss-ratio", type=float, default=0.0)
+    parser.add_argument("--line-latency", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="分塊串流讀 ledger（LEDGER_STREAM=true）")
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--out")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run(args)
+    print_result(result)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Saved: {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
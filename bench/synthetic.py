@@ -0,0 +1,103 @@
+"""
+Benchmark 共用的合成資料與 stub provider（全部離線）
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+ACTIONS = np.array(["buy", "keep", "sell", "reduce"])
+
+
+def make_ledger(rows, codes=300, null_ratio=0.1, seed=0, code_offset=0):
+    """合成 ledger：隨機代號 / 動作 / 價格，部分價格為 null"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-01", periods=max(rows // codes, 1) + 1, freq="D")
+
+    df = pd.DataFrame({
+        "date": dates.strftime("%Y-%m-%d")[np.sort(rng.integers(0, len(dates), rows))],
+        "code": (1000 + code_offset + rng.integers(0, codes, rows)).astype(str),
+        "action": ACTIONS[rng.choice(4, rows, p=[0.45, 0.15, 0.1, 0.3])],
+        "value": np.round(rng.uniform(10, 500, rows), 2).astype(str),
+    })
+    df.loc[rng.random(rows) < null_ratio, "value"] = "null"
+
+    prices = {code: (float(i % 400 + 10), f"{code}.TW") for i, code in enumerate(df["code"].unique())}
+    return df, prices
+
+
+class StubNameLookup:
+    """取代 core.company._lookup_yahoo：固定延遲，回傳假名稱"""
+
+    def __init__(self, latency=0.0, miss_ratio=0.0):
+        self.latency = latency
+        self.miss_ratio = miss_ratio
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, code):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if hash(code) % 100 < self.miss_ratio * 100:
+            return None
+        return f"公司{code}"
+
+
+class StubLineResponse:
+    status_code = 200
+    text = "{}"
+
+
+class StubLinePost:
+    """取代 requests.post（LINE push API）：固定延遲，永遠 200"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.bytes_sent = 0
+        self.urls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url, headers=None, data=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.bytes_sent += len(data or b"")
+            self.urls.append(url)
+        if self.latency:
+            time.sleep(self.latency)
+        return StubLineResponse()
+
+    def session(self):
+        """取代 requests.Session()（push_messages 用）"""
+        return StubLineSession(self)
+
+
+class StubLineSession:
+    def __init__(self, post):
+        self.post = post
+        self.headers = {}
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def install_stub_line(line):
+    """push_bot → StubLinePost：LineClient 的 Session 換成 stub，不讀寫 outbox"""
+    from notify import line_client
+
+    line_client.requests.Session = line.session
+    line_client.OUTBOX = False
+    line_client.reset_clients()
+    return line
@@ -0,0 +1,265 @@
+import io
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .engine import BUY_ACTIONS, SELL_ACTIONS, NULL_VALUES, mark_segments
+from .lots import compute_lot_positions, has_lots
+from .metrics import stage
+from .price import get_close_prices, get_price_provider
+from .trade_parser import load_ledger
+
+
+# ============================================================
+# 歷史權益曲線：逐日 mark-to-market（日期 × 代號）
+#
+# 持倉規則與報表相同：
+# - 舊的 4 欄 ledger：每筆有效買進 = 1 單位，有效賣出一次結清該段所有單位
+#   （直接由 engine.mark_segments 向量化算出）
+# - 有股數的 ledger：lots.compute_lot_positions 逐筆記錄的股數 / 成本（含手續費）變化
+#
+# 每個代號只查一次整段歷史收盤價（provider.get_daily_closes），
+# 之後全部是 NumPy 矩陣運算：
+#   H（持有單位）、C（持倉成本）、R（已實現）= 事件 delta 的 cumsum
+#   V = H × P（P 為 forward-fill 的收盤價；還沒有收盤價時以成本計）
+#   權益 = R + (V − C)
+# ============================================================
+
+
+def load_events(source):
+    """ledger（CSV 路徑 / bytes / typed DataFrame / 串流 opener）→ date, code, action, value"""
+    if callable(source):
+        with source() as stream:
+            return load_ledger(stream)
+    if isinstance(source, pd.DataFrame):
+        return source.copy()
+    if isinstance(source, bytes):
+        return load_ledger(io.BytesIO(source))
+    return load_ledger(source)
+
+
+def resolve_historical_prices(df, history, latest=None):
+    """
+    value=null 的買賣以「當天（或之前最近一個交易日）的收盤價」計價；
+    歷史價查不到才退回最新收盤價 latest = {code: (close, symbol)}
+    """
+    if pd.api.types.is_float_dtype(df["value"]):
+        is_null = df["value"].isna()
+        numeric = df["value"]
+    else:
+        value = df["value"].astype(str).str.strip()
+        is_null = value.str.lower().isin(NULL_VALUES)
+        numeric = pd.to_numeric(value.where(~is_null), errors="coerce")
+
+    price = numeric.astype(float)
+    if not is_null.any():
+        return price
+
+    nulls = pd.DataFrame({
+        "row": np.flatnonzero(is_null.values),
+        "date": pd.to_datetime(df.loc[is_null, "date"]).values,
+        "code": df.loc[is_null, "code"].values,
+    }).sort_values("date")
+
+    if len(history.columns):
+        closes = (
+            history.rename_axis("date").rename_axis("code", axis=1)
+            .stack().rename("close").reset_index().sort_values("date")
+        )
+        nulls = pd.merge_asof(nulls, closes, on="date", by="code")
+    else:
+        nulls["close"] = np.nan
+
+    if latest:
+        fallback = nulls["code"].map({code: p[0] for code, p in latest.items()})
+        nulls["close"] = nulls["close"].fillna(fallback)
+
+    values = price.values.copy()
+    values[nulls["row"].values] = nulls["close"].values
+    return pd.Series(values, index=df.index)
+
+
+def equity_curve(source, price_provider=None, end=None):
+    """
+    → DataFrame（index = 日期）：
+      realized, unrealized, equity, market_value, cost, positions, nav, drawdown, drawdown_pct
+    """
+    provider = price_provider or get_price_provider()
+    end = pd.Timestamp(end or datetime.today().strftime("%Y-%m-%d"))
+
+    with stage("analytics_load"):
+        df = load_events(source)
+        df = df[df["action"].isin(BUY_ACTIONS + SELL_ACTIONS)].reset_index(drop=True)
+        if df.empty:
+            return _empty_curve()
+        # ledger 裡 2025/12/27 與 2025-12-27 兩種寫法都有
+        df["date"] = pd.to_datetime(df["date"].astype(str).str.strip().str.replace("/", "-"))
+        dates = df["date"]
+        codes = list(dict.fromkeys(df["code"]))
+
+    with stage("analytics_history"):
+        history = provider.get_daily_closes(codes, dates.min(), end)
+
+        # 歷史價整段查不到的代號，null 價格才用最新收盤價補
+        missing = [
+            c for c in pd.unique(df.loc[df["value"].astype(str).str.lower().isin(NULL_VALUES), "code"])
+            if c not in history.columns or history[c].isna().all()
+        ]
+        latest = get_close_prices(missing, provider=provider) if missing else {}
+
+    with stage("analytics_matrix"):
+        df["price"] = resolve_historical_prices(df, history, latest)
+        fills = lot_fills(df) if has_lots(df) else segment_fills(mark_segments(df))
+        return build_curve(fills, history, codes, end)
+
+
+FILL_COLUMNS = ["date", "code", "units", "cost", "realized"]
+
+
+def segment_fills(events):
+    """mark_segments 的結果 → 每筆有效買賣的 (date, code, units, cost, realized)"""
+    price = events["price"].to_numpy(dtype=float)
+    is_buy = events["is_buy"].to_numpy()
+
+    # 每筆賣出結清的段落：單位數 / 成本
+    buys = events[is_buy]
+    seg_units = buys.groupby(["code", "seg"], sort=False).size()
+    seg_cost = buys.groupby(["code", "seg"], sort=False)["price"].sum()
+    sells = events[~is_buy]
+    keys = pd.MultiIndex.from_arrays([sells["code"], sells["seg"]])
+    sell_units = seg_units.reindex(keys).to_numpy(dtype=float)
+    sell_cost = seg_cost.reindex(keys).to_numpy(dtype=float)
+
+    units = np.ones(len(events))
+    cost = price.copy()
+    units[~is_buy] = -sell_units
+    cost[~is_buy] = -sell_cost
+
+    realized = np.zeros(len(events))
+    realized[~is_buy] = sell_units * price[~is_buy] - sell_cost
+
+    return pd.DataFrame({
+        "date": events["date"].values, "code": events["code"].values,
+        "units": units, "cost": cost, "realized": realized,
+    })
+
+
+def lot_fills(df):
+    """有股數的 ledger → lot 引擎逐筆記錄的 fills（FIFO / 平均成本依 COST_METHOD）"""
+    fills = []
+    compute_lot_positions(df, set(), fills=fills)
+    return pd.DataFrame(fills, columns=FILL_COLUMNS)
+
+
+def build_curve(fills, history, codes, end):
+    """fills = (date, code, units, cost, realized)；history = 日期 × 代號收盤價"""
+    if fills.empty:
+        return _empty_curve()
+
+    event_dates = pd.to_datetime(fills["date"])
+    # 交易日 + 事件日 + 結束日（沒有歷史價時曲線也會延伸到今天）
+    calendar = history.index.union(pd.DatetimeIndex(event_dates.unique())).union([end])
+    calendar = calendar[(calendar >= event_dates.min()) & (calendar <= max(end, event_dates.max()))]
+
+    T, N = len(calendar), len(codes)
+    rows = calendar.get_indexer(event_dates)
+    cols = pd.Index(codes).get_indexer(fills["code"])
+
+    dH = np.zeros((T, N))
+    dC = np.zeros((T, N))
+    dR = np.zeros(T)
+    np.add.at(dH, (rows, cols), fills["units"].to_numpy(dtype=float))
+    np.add.at(dC, (rows, cols), fills["cost"].to_numpy(dtype=float))
+    np.add.at(dR, rows, fills["realized"].to_numpy(dtype=float))
+
+    H = np.cumsum(dH, axis=0)
+    C = np.cumsum(dC, axis=0)
+    R = np.cumsum(dR)
+    # 浮點累加誤差：已結清的持倉歸零
+    flat = H < 1e-6
+    H[flat] = 0.0
+    C[flat] = 0.0
+
+    P = history.reindex(index=calendar, columns=codes).ffill().to_numpy(dtype=float)
+    V = np.where(np.isnan(P), C, H * P)
+
+    market_value = V.sum(axis=1)
+    cost_basis = C.sum(axis=1)
+    unrealized = market_value - cost_basis
+    equity = R + unrealized
+
+    # NAV：以曾經投入過的最大成本當作本金
+    nav = np.maximum.accumulate(cost_basis) + equity
+    peak = np.maximum.accumulate(equity)
+    nav_peak = np.maximum.accumulate(nav)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown_pct = np.where(nav_peak > 0, nav / nav_peak - 1, 0.0) * 100
+
+    return pd.DataFrame({
+        "realized": R,
+        "unrealized": unrealized,
+        "equity": equity,
+        "market_value": market_value,
+        "cost": cost_basis,
+        "positions": (H > 0).sum(axis=1),
+        "nav": nav,
+        "drawdown": equity - peak,
+        "drawdown_pct": drawdown_pct,
+    }, index=calendar.rename("date"))
+
+
+def _empty_curve():
+    columns = ["realized", "unrealized", "equity", "market_value", "cost",
+               "positions", "nav", "drawdown", "drawdown_pct"]
+    return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name="date"), dtype=float)
+
+
+def summarize(curve):
+    """權益曲線 → 摘要 dict（報表 / log 用）"""
+    if curve.empty:
+        return {"days": 0}
+
+    last = curve.iloc[-1]
+    trough = curve["drawdown"].idxmin()
+    return {
+        "start": curve.index[0].strftime("%Y-%m-%d"),
+        "end": curve.index[-1].strftime("%Y-%m-%d"),
+        "days": len(curve),
+        "equity": round(float(last["equity"]), 2),
+        "realized": round(float(last["realized"]), 2),
+        "unrealized": round(float(last["unrealized"]), 2),
+        "max_drawdown": round(float(curve["drawdown"].min()), 2),
+        "max_drawdown_pct": round(float(curve["drawdown_pct"].min()), 2),
+        "max_drawdown_date": trough.strftime("%Y-%m-%d"),
+        "peak_exposure": round(float(curve["market_value"].max()), 2),
+        "exposure": round(float(last["market_value"]), 2),
+        "positions": int(last["positions"]),
+    }
+
+
+def format_summary(summary):
+    if not summary.get("days"):
+        return "📈 權益曲線：沒有交易紀錄"
+    return "\n".join([
+        f"📈 權益曲線 {summary['start']} ~ {summary['end']}（{summary['days']} 天）",
+        f"  總損益 {summary['equity']:,.2f}（已實現 {summary['realized']:,.2f} / 未實現 {summary['unrealized']:,.2f}）",
+        f"  最大回撤 {summary['max_drawdown']:,.2f}（{summary['max_drawdown_pct']:.2f}%，{summary['max_drawdown_date']}）",
+        f"  市值 {summary['exposure']:,.2f}（最高 {summary['peak_exposure']:,.2f}），持有 {summary['positions']} 檔",
+    ])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ledger → 逐日權益曲線")
+    parser.add_argument("ledger", nargs="?", default="data/trades.csv")
+    parser.add_argument("--end")
+    parser.add_argument("--out", help="輸出權益曲線 CSV")
+    args = parser.parse_args()
+
+    curve = equity_curve(args.ledger, end=args.end)
+    print(format_summary(summarize(curve)))
+    if args.out:
+        curve.to_csv(args.out, float_format="%.4f")
+        print(f"[Analytics] Saved {args.out}")
@@ -0,0 +1,313 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .analytics import load_events, resolve_historical_prices
+from .engine import BUY_ACTIONS, SELL_ACTIONS, NULL_VALUES, mark_segments
+from .metrics import set_trace_log, stage
+from .price import get_close_prices, get_price_provider
+
+# process pool 大小（預設 = CPU 數）；參數組合太少時不開 pool
+MAX_WORKERS = int(os.getenv("BACKTEST_WORKERS", "0")) or os.cpu_count() or 1
+MIN_PARALLEL = 64
+
+
+# ============================================================
+# 回測：同一份 ledger 的進出場，換一套出場 / 部位規則會怎樣
+#
+# ledger 的每一段 round-trip（engine.mark_segments：BUY / KEEP 建倉，SELL / REDUCE 結清）
+# 視為一筆交易：第一筆買進的那天進場，成本 = 段內買進均價，
+# 原本的出場 = 賣出那天的實際賣價；尚未賣出的以最後一天收盤價計
+#
+# 每筆交易的逐日價格路徑先算成 M 筆 × L 天的矩陣（X = 收盤價 / 成本，float64，出場後補出場值），
+# 與規則無關的部分只算一次：
+#   XMIN = X 的累計最小值          → 固定停損 s：第一個 XMIN ≤ 1 − s 的天數
+#   DMIN = (X / X 的累計最大值) 的累計最小值 → 移動停損 t：第一個 DMIN ≤ 1 − t 的天數
+# 累計最小值單調遞減，「第一次觸及」= 大於門檻的天數，一次向量化比較就能算出整批交易；
+# 出場天數 = min(原本出場, 停損, 移動停損, 持有上限)
+#
+# 參數組合分給 ProcessPoolExecutor，矩陣放在 shared memory，worker 直接掛上去，不必 pickle
+# ============================================================
+class Trades:
+    """M 筆交易的路徑矩陣與各自的屬性（全部 numpy）"""
+
+    def __init__(self, codes, entry_dates, exit_dates, closed, units, cost, length, X):
+        self.codes = codes
+        self.entry_dates = entry_dates
+        self.exit_dates = exit_dates
+        self.closed = closed
+        self.units = units
+        self.cost = cost
+        self.length = length
+        # 損益用的 X 維持 float64（與 ledger / 權益曲線的損益一致）；
+        # 只用來找「第一次觸及門檻」的 XMIN / DMIN 用 float32，shared memory 少一半
+        self.X = np.asarray(X, dtype=np.float64)
+        self.XMIN = np.minimum.accumulate(self.X, axis=1).astype(np.float32)
+        self.DMIN = np.minimum.accumulate(self.X / np.maximum.accumulate(self.X, axis=1), axis=1).astype(np.float32)
+
+    def __len__(self):
+        return len(self.cost)
+
+    def arrays(self):
+        """worker 需要的陣列（放進 shared memory）"""
+        return {
+            "X": self.X, "XMIN": self.XMIN, "DMIN": self.DMIN,
+            "exit": (self.length - 1).astype(np.int64), "units": self.units, "cost": self.cost,
+        }
+
+
+def build_trades(df, history, end):
+    """df 需有 date（Timestamp）, code, action, price；history = 日期 × 代號收盤價"""
+    df = df.assign(units=_units(df))
+    events = mark_segments(df)
+    buys = events[events["is_buy"]]
+    sells = events[events["is_sell"]].set_index(["code", "seg"])
+
+    segments = buys.assign(amount=buys["price"] * buys["units"]).groupby(["code", "seg"], sort=False).agg(
+        entry=("date", "min"), units=("units", "sum"), amount=("amount", "sum"),
+    )
+    segments["cost"] = segments["amount"] / segments["units"]
+    segments = segments.join(sells[["date", "price"]].rename(columns={"date": "exit", "price": "sell"}))
+    closed = segments["exit"].notna().to_numpy()
+
+    calendar = history.index.union(pd.DatetimeIndex(df["date"].unique())).union([end])
+    calendar = calendar[calendar <= max(end, df["date"].max())]
+    codes = segments.index.get_level_values("code")
+
+    P = history.reindex(index=calendar, columns=pd.unique(codes)).ffill().to_numpy(dtype=float)
+    col = pd.Index(pd.unique(codes)).get_indexer(codes)
+    entry = calendar.get_indexer(segments["entry"])
+    exit_ = np.where(closed, calendar.get_indexer(segments["exit"].fillna(calendar[-1])), len(calendar) - 1)
+
+    # 逐日路徑：entry ~ exit，出場之後重複出場當天的值（累計最小 / 最大值不受影響）
+    length = exit_ - entry + 1
+    L = int(length.max()) if len(length) else 0
+    day = np.minimum(entry[:, None] + np.arange(L)[None, :], exit_[:, None])
+    cost = segments["cost"].to_numpy(dtype=float)
+    X = P[day, col[:, None]] / cost[:, None] if len(cost) else np.zeros((0, 0))
+
+    # 已賣出的交易：出場那天用實際賣價
+    sell_ratio = segments["sell"].to_numpy(dtype=float) / cost
+    X = np.where((day == exit_[:, None]) & closed[:, None], sell_ratio[:, None], X)
+    # 沒有歷史價的日子 → 以成本計（與權益曲線相同）
+    X = np.nan_to_num(X, nan=1.0)
+
+    return Trades(
+        list(codes), calendar[entry], calendar[exit_], closed,
+        segments["units"].to_numpy(dtype=float), cost, length, X,
+    )
+
+
+def _units(df):
+    """有股數的列以股數計，其他（舊的 4 欄 ledger）每筆買進 1 單位"""
+    if "qty" not in df.columns:
+        return np.ones(len(df))
+    return pd.to_numeric(df["qty"], errors="coerce").fillna(1.0).to_numpy(dtype=float)
+
+
+# ------------------------------------------------------------
+# 規則評估（單一參數組合 → 一列結果，整批交易向量化）
+# ------------------------------------------------------------
+def parameter_grid(stops=(0,), trails=(0,), caps=(0,), sizing=("ledger",)):
+    """stop / trail 為 %（0 = 不用），cap 為持有交易日數上限（0 = 不限）"""
+    return list(itertools.product(stops, trails, caps, sizing))
+
+
+class Evaluator:
+    def __init__(self, arrays):
+        self.a = arrays
+        self.rows = np.arange(len(arrays["cost"]))
+        # 同一個門檻在不同組合裡重複出現 → 觸及的天數只算一次
+        self._hits = {}
+        cost, units = arrays["cost"], arrays["units"]
+        self.notional = float((cost * units).mean()) if len(cost) else 0.0
+
+    def _first_hit(self, name, pct):
+        key = (name, pct)
+        if key not in self._hits:
+            self._hits[key] = (self.a[name] > np.float32(1 - pct / 100)).sum(axis=1)
+        return self._hits[key]
+
+    def evaluate(self, params):
+        stop, trail, cap, sizing = params
+        exit_ = self.a["exit"]
+        if stop:
+            exit_ = np.minimum(exit_, self._first_hit("XMIN", stop))
+        if trail:
+            exit_ = np.minimum(exit_, self._first_hit("DMIN", trail))
+        if cap:
+            exit_ = np.minimum(exit_, cap - 1)
+
+        ratio = self.a["X"][self.rows, exit_]
+        cost = self.a["cost"]
+        size = self.a["units"] if sizing == "ledger" else self.notional / cost
+        capital = size * cost
+        pnl = capital * (ratio - 1)
+
+        total = float(pnl.sum())
+        invested = float(capital.sum())
+        return {
+            "stop": stop, "trail": trail, "cap": cap, "sizing": sizing,
+            "pnl": total,
+            "return_pct": total / invested * 100 if invested else 0.0,
+            "win_rate": float((ratio > 1).mean() * 100) if len(ratio) else 0.0,
+            "avg_hold": float(exit_.mean() + 1) if len(exit_) else 0.0,
+            "early_exits": int((exit_ < self.a["exit"]).sum()),
+        }
+
+    def evaluate_many(self, grid):
+        return [self.evaluate(params) for params in grid]
+
+
+# ------------------------------------------------------------
+# Shared memory：主程序建立，worker 在 initializer 掛上
+# ------------------------------------------------------------
+def share_arrays(arrays):
+    """→ (specs, handles)；specs 可 pickle 給 worker，handles 由主程序 close + unlink"""
+    specs, handles = {}, []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        specs[name] = (shm.name, array.shape, array.dtype.str)
+        handles.append(shm)
+    return specs, handles
+
+
+def attach_arrays(specs):
+    arrays, handles = {}, []
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        handles.append(shm)
+    return arrays, handles
+
+
+_worker = None
+
+
+def _init_worker(specs):
+    global _worker
+    set_trace_log("off")
+    arrays, handles = attach_arrays(specs)
+    # handles 要一直留著（被回收時 buffer 會失效）
+    _worker = (Evaluator(arrays), handles)
+
+
+def _evaluate_chunk(grid):
+    return _worker[0].evaluate_many(grid)
+
+
+def run_grid(trades, grid, max_workers=MAX_WORKERS):
+    """→ DataFrame（每個參數組合一列），依 pnl 由高到低"""
+    workers = max(1, min(max_workers, len(grid) // MIN_PARALLEL or 1))
+    if workers == 1:
+        results = Evaluator(trades.arrays()).evaluate_many(grid)
+    else:
+        specs, handles = share_arrays(trades.arrays())
+        try:
+            chunks = [grid[i::workers * 4] for i in range(workers * 4)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs,)) as pool:
+                results = [r for chunk in pool.map(_evaluate_chunk, chunks) for r in chunk]
+        finally:
+            for shm in handles:
+                shm.close()
+                shm.unlink()
+
+    # 損益相同時依參數排序（與 worker 數、分塊方式無關）
+    return pd.DataFrame(results).sort_values(
+        ["pnl", "stop", "trail", "cap", "sizing"], ascending=[False, True, True, True, True], kind="stable",
+    ).reset_index(drop=True)
+
+
+# ------------------------------------------------------------
+# 入口
+# ------------------------------------------------------------
+def load_trades(source, price_provider=None, end=None):
+    """ledger → Trades（歷史價每檔一次整段查詢，走 provider 的快取）"""
+    provider = price_provider or get_price_provider()
+    end = pd.Timestamp(end or datetime.today().strftime("%Y-%m-%d"))
+
+    with stage("backtest_load"):
+        df = load_events(source)
+        df = df[df["action"].isin(BUY_ACTIONS + SELL_ACTIONS)].reset_index(drop=True)
+        df["date"] = pd.to_datetime(df["date"].astype(str).str.strip().str.replace("/", "-"))
+        codes = list(dict.fromkeys(df["code"]))
+
+    with stage("backtest_history"):
+        history = provider.get_daily_closes(codes, df["date"].min(), end) if codes else pd.DataFrame()
+        missing = [
+            c for c in pd.unique(df.loc[df["value"].astype(str).str.lower().isin(NULL_VALUES), "code"])
+            if c not in history.columns or history[c].isna().all()
+        ]
+        latest = get_close_prices(missing, provider=provider) if missing else {}
+
+    with stage("backtest_matrix"):
+        df["price"] = resolve_historical_prices(df, history, latest)
+        return build_trades(df, history, end)
+
+
+def backtest(source, grid, price_provider=None, end=None, max_workers=MAX_WORKERS):
+    trades = load_trades(source, price_provider, end)
+    with stage("backtest_grid"):
+        return trades, run_grid(trades, grid, max_workers)
+
+
+def format_results(results, top=10):
+    def label(row):
+        rules = [
+            f"停損 {row.stop:g}%" if row.stop else None,
+            f"移動停損 {row.trail:g}%" if row.trail else None,
+            f"持有 ≤ {row.cap} 天" if row.cap else None,
+            "等額部位" if row.sizing == "equal" else None,
+        ]
+        return "、".join(r for r in rules if r) or "原始進出場"
+
+    lines = [f"🧪 回測 {len(results)} 組參數（前 {min(top, len(results))} 名）"]
+    for i, row in enumerate(results.head(top).itertuples(), 1):
+        lines.append(
+            f"{i:>2}. {label(row)}：損益 {row.pnl:,.2f}（{row.return_pct:+.2f}%），"
+            f"勝率 {row.win_rate:.1f}%，平均持有 {row.avg_hold:.1f} 天，提前出場 {row.early_exits} 筆"
+        )
+    return "\n".join(lines)
+
+
+def _floats(text):
+    return [float(v) for v in text.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="ledger → 不同出場 / 部位規則的回測")
+    parser.add_argument("ledger", nargs="?", default="data/trades.csv")
+    parser.add_argument("--end")
+    parser.add_argument("--stops", default="0,5,8,10,15", help="固定停損 %（0 = 不用）")
+    parser.add_argument("--trails", default="0,5,10,15,20", help="移動停損 %（0 = 不用）")
+    parser.add_argument("--caps", default="0,20,60,120", help="持有交易日數上限（0 = 不限）")
+    parser.add_argument("--sizing", default="ledger,equal")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--out", help="輸出全部結果 CSV")
+    args = parser.parse_args()
+
+    grid = parameter_grid(
+        _floats(args.stops), _floats(args.trails), [int(v) for v in _floats(args.caps)], args.sizing.split(","),
+    )
+    trades = load_trades(args.ledger, end=args.end)
+    start = time.perf_counter()
+    results = run_grid(trades, grid, args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(format_results(results, args.top))
+    print(f"[Backtest] {len(trades)} trades × {len(grid)} rule sets in {elapsed:.2f}s "
+          f"→ {len(grid) / elapsed:,.0f} rule sets/s ({len(trades) * len(grid) / elapsed:,.0f} trade evaluations/s)")
+    if args.out:
+        results.to_csv(args.out, index=False, float_format="%.4f")
+        print(f"[Backtest] Saved {args.out}")
@@ -1,31 +1,205 @@
-import yfinance as yf
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-DATA_PATH = os.path.join("data", "company_names.json")
+from .metrics import cache_lookup, external
+from .price import default_policy
+from .ratelimit import ProviderError
+from .stock_index import get_stock_index
 
-# load 台股列表
-with open(DATA_PATH, "r", encoding="utf-8") as f:
-    COMPANY_NAMES = json.load(f)
+# Yahoo 查詢結果的持久化快取（與價格快取放在同一個目錄 / GCS prefix）
+CACHE_DIR = os.getenv("PRICE_CACHE_DIR", ".cache")
+CACHE_FILE = "company_names.cache.json"
 
+# 查不到的代號多久後才再問一次 Yahoo（秒）
+MISS_TTL = int(os.getenv("COMPANY_MISS_TTL", str(7 * 24 * 3600)))
 
-def get_company_name(code):
+MAX_WORKERS = 8
+
+_lock = threading.Lock()
+_cache = None
+
+
+# --------------------------------------------------------
+# Yahoo 結果快取：查到的名稱永久保存，查不到的記 MISS_TTL
+# --------------------------------------------------------
+class NameCache:
+    def __init__(self, cache_dir=CACHE_DIR, gcs_uri=None):
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self.gcs_uri = gcs_uri
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+        if self.gcs_uri:
+            self._download()
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def get(self, code):
+        """→ (found, name)；miss 過期或沒有紀錄時 found=False"""
+        entry = self.entries.get(code)
+        if entry is None:
+            return False, None
+        if entry["name"] is None and time.time() - entry["ts"] > MISS_TTL:
+            return False, None
+        return True, entry["name"]
+
+    def put(self, code, name):
+        with self._lock:
+            self.entries[code] = {"name": name, "ts": time.time()}
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+        if self.gcs_uri:
+            self._upload()
+
+    # ---- GCS sync ----
+    def _remote(self):
+        bucket, _, prefix = self.gcs_uri.removeprefix("gs://").partition("/")
+        name = f"{prefix.rstrip('/')}/{CACHE_FILE}" if prefix else CACHE_FILE
+        return bucket, name
+
+    def _download(self):
+        from storage.gcs import read_object
+
+        try:
+            obj = read_object(*self._remote())
+            if obj is not None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "wb") as f:
+                    f.write(obj.data)
+        except Exception as e:
+            print(f"[Company] No remote name cache: {e}")
+
+    def _upload(self):
+        from storage.gcs import get_store
+
+        try:
+            with open(self.path, "rb") as f:
+                get_store().write(*self._remote(), f.read(), content_type="application/json")
+        except Exception as e:
+            print(f"[Company ERROR] {e}")
+
+
+def get_name_cache():
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = NameCache(CACHE_DIR, os.getenv("PRICE_CACHE_GCS"))
+    return _cache
+
+
+def flush_company_cache():
+    if _cache is not None:
+        _cache.save()
+
+
+# --------------------------------------------------------
+# Lookup
+# --------------------------------------------------------
+_yahoo_policy = None
+
+
+def _get_info(symbol):
+    import yfinance as yf
+
+    with external("yfinance", "get_info"):
+        return yf.Ticker(symbol).get_info()
+
+
+def _lookup_yahoo(code):
     """
-    先從本地 JSON 讀中文名稱，沒有再 fallback 到 Yahoo。
+    → 名稱；確定查不到回傳 None
+    Yahoo 失敗（throttle / timeout）時丟 ProviderError，這次的結果不寫入快取
     """
-    if code in COMPANY_NAMES:
-        return COMPANY_NAMES[code]
+    global _yahoo_policy
+    if _yahoo_policy is None:
+        # 與 YFinancePriceProvider 共用同一個 yfinance rate limit
+        _yahoo_policy = default_policy("yfinance")
 
-    # fallback from Yahoo
+    error = None
     for market in ["TW", "TWO"]:
         try:
-            info = yf.Ticker(f"{code}.{market}").get_info()
-            name = info.get("longName")
-            if name:
-                for remove in ["股份有限公司", "有限公司", "股份有限", "有線公司"]:
-                    name = name.replace(remove, "")
-                return name.strip()
-        except:
+            info = _yahoo_policy.call(_get_info, f"{code}.{market}")
+        except ProviderError as e:
+            error = e
             continue
 
-    return None
\ No newline at end of file
+        name = (info or {}).get("longName")
+        if name:
+            for remove in ["股份有限公司", "有限公司", "股份有限", "有線公司"]:
+                name = name.replace(remove, "")
+            return name.strip()
+
+    if error is not None:
+        raise error
+    return None
+
+
+def _safe_lookup(code):
+    """→ (name, 是否可寫入快取)"""
+    try:
+        return _lookup_yahoo(code), True
+    except ProviderError as e:
+        print(f"[Company] Yahoo 查詢失敗 {code}: {e}")
+        return None, False
+
+
+def get_company_name(code):
+    """
+    先從本地台股索引讀中文名稱，沒有再查快取，最後才 fallback 到 Yahoo。
+    """
+    return resolve_company_names([code])[code]
+
+
+def resolve_company_names(codes):
+    """
+    批次解析公司名稱 → {code: name}
+    本地索引與快取都沒有的代號，一次併發查 Yahoo
+    """
+    codes = list(dict.fromkeys(codes))
+    names = get_stock_index().names(codes)
+    cache = get_name_cache()
+
+    result = {}
+    unknown = []
+    for code in codes:
+        if code in names:
+            result[code] = names[code]
+            continue
+
+        found, name = cache.get(code)
+        cache_lookup("company_name", found)
+        if found:
+            result[code] = name
+        else:
+            unknown.append(code)
+
+    if unknown:
+        workers = max(1, min(MAX_WORKERS, len(unknown)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for code, (name, cacheable) in zip(unknown, pool.map(_safe_lookup, unknown)):
+                if cacheable:
+                    cache.put(code, name)
+                result[code] = name
+
+    return result
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+from .utils import calc_avg_cost
+
+BUY_ACTIONS = ["buy", "keep"]
+SELL_ACTIONS = ["sell", "reduce"]
+NULL_VALUES = ["null", "", "none", "nan"]
+
+
+# --------------------------------------------------------
+# 欄位式持倉計算（取代逐列 iterrows）
+# --------------------------------------------------------
+def resolve_prices(df, prices):
+    """
+    向量化版 resolve_price：
+    value=null → prices[code] 的收盤價；其他 → float(value)，無法解析為 NaN
+    typed ledger（value 已是 float）則以 NaN 代表 null
+    """
+    close = df["code"].map({code: p[0] for code, p in prices.items()})
+
+    if pd.api.types.is_float_dtype(df["value"]):
+        return df["value"].where(df["value"].notna(), close).astype(float)
+
+    value = df["value"].astype(str).str.strip()
+    is_null = value.str.lower().isin(NULL_VALUES)
+    numeric = pd.to_numeric(value.where(~is_null), errors="coerce")
+
+    return numeric.where(~is_null, close).astype(float)
+
+
+def mark_segments(df):
+    """
+    把每個 code 的有效買賣切成一段一段的 round-trip。
+
+    規則與逐列版本相同：
+    - BUY / KEEP 有價格才算買進
+    - SELL / REDUCE 有價格、且前面還有持倉才算有效賣出
+      （等價於：同 code 的上一筆有效事件是買進）
+    - 有效賣出後清空，下一筆買進開始新的一段
+
+    回傳只含有效事件的 DataFrame，多了 is_buy / seg 兩欄。
+    """
+    events = df[df["action"].isin(BUY_ACTIONS + SELL_ACTIONS) & df["price"].notna()]
+    is_buy = events["action"].isin(BUY_ACTIONS)
+
+    prev_is_buy = is_buy.groupby(events["code"], sort=False).shift(1, fill_value=False)
+    is_sell = ~is_buy & prev_is_buy.astype(bool)
+
+    events = events[is_buy | is_sell].assign(is_buy=is_buy, is_sell=is_sell)
+    sells_so_far = events["is_sell"].astype(np.int64).groupby(events["code"], sort=False).cumsum()
+    events["seg"] = sells_so_far - events["is_sell"].astype(np.int64)
+
+    return events
+
+
+def compute_positions(df, valid_sell_dates):
+    """
+    df 需有 date, code, action（小寫）, price（已解析）欄位
+
+    回傳：
+    - completed：要列入報表的已實現交易（SELL 限 valid_sell_dates，REDUCE 全部）
+    - open_buys：{code: [buy, ...]} 尚未平倉的買進明細（依 code 首次出現順序）
+    """
+    events = mark_segments(df)
+
+    buys = events[events["is_buy"]]
+    sells = events[events["is_sell"]]
+
+    # 每個 code 的最後一段若沒被賣出 → 未平倉
+    last_seg = events.groupby("code", sort=False)["seg"].max()
+    sold_segs = sells.groupby("code", sort=False)["seg"].max()
+    open_codes = last_seg[last_seg.gt(sold_segs.reindex(last_seg.index, fill_value=-1))]
+
+    # 只替報表會用到的段落組出 buy_detail
+    reported = sells[sells["date"].isin(valid_sell_dates) | (sells["action"] == "reduce")]
+    wanted = set(zip(reported["code"], reported["seg"])) | set(zip(open_codes.index, open_codes))
+
+    dates = buys["date"].values
+    prices = buys["price"].values
+
+    details = {}
+    for key, idx in buys.groupby(["code", "seg"], sort=False).indices.items():
+        if key not in wanted:
+            continue
+        details[key] = [{"date": d, "price": float(p)} for d, p in zip(dates[idx], prices[idx])]
+
+    # 平均成本沿用 calc_avg_cost（由左到右加總），確保與逐列版本逐位元相同
+    completed = []
+    for code, seg, date, action, price in zip(
+        reported["code"], reported["seg"], reported["date"], reported["action"], reported["price"]
+    ):
+        buy_detail = details[(code, seg)]
+        avg_cost = calc_avg_cost(buy_detail)
+        price = float(price)
+
+        completed.append({
+            "code": code,
+            "buy_detail": buy_detail,
+            "sell_date": date,
+            "action": action,
+            "avg_cost": avg_cost,
+            "sell_price": price,
+            "pct": ((price - avg_cost) / avg_cost) * 100
+        })
+
+    order = pd.unique(df["code"])
+    open_buys = {
+        code: details[(code, open_codes[code])]
+        for code in order if code in open_codes.index
+    }
+
+    return completed, open_buys
@@ -0,0 +1,180 @@
+import io
+import os
+import threading
+import time
+
+import pandas as pd
+
+from .engine import resolve_prices
+from .lots import compute_ledger_positions
+from .metrics import cache_lookup, stage
+from .price import PriceProvider, get_close_prices, get_price_provider
+from .trade_parser import (
+    LEDGER_FIELDS, build_positions, concat_rows, load_ledger, normalize_ledger, null_price_codes, seed_frame,
+    valid_sell_dates,
+)
+
+# webhook 查詢用的報價最多沿用幾秒
+QUOTE_TTL = float(os.getenv("LIVE_QUOTE_TTL", "60"))
+
+# 最多每幾秒向 storage 確認一次 ledger 版本（stat + list，不下載）
+CHECK_INTERVAL = float(os.getenv("LIVE_CHECK_INTERVAL", "15"))
+
+
+# ============================================================
+# 短 TTL 報價快取
+# ============================================================
+class QuoteCache(PriceProvider):
+    """
+    包在任一 provider 外面：TTL 內重複查詢不打資料源，
+    過期 / 沒查過的代號一次批次補查（查不到的也快取，避免每則訊息都重查）
+    """
+
+    name = "ttl"
+
+    def __init__(self, inner=None, ttl=QUOTE_TTL, clock=time.monotonic):
+        self.inner = inner
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def provider(self):
+        return self.inner or get_price_provider()
+
+    def get_close_price(self, code, as_of=None):
+        return self.get_close_prices([code], as_of)[str(code)]
+
+    def get_close_prices(self, codes, as_of=None):
+        codes = [str(c) for c in dict.fromkeys(codes)]
+        if as_of is not None:
+            return get_close_prices(codes, as_of, provider=self.provider)
+
+        now = self.clock()
+        result, expired = {}, []
+        with self._lock:
+            for code in codes:
+                entry = self.entries.get(code)
+                if entry is not None and now - entry[0] < self.ttl:
+                    result[code] = entry[1]
+                else:
+                    expired.append(code)
+
+        for code in codes:
+            cache_lookup("quote_ttl", code in result)
+
+        if expired:
+            fetched = get_close_prices(expired, provider=self.provider)
+            with self._lock:
+                for code in expired:
+                    self.entries[code] = (now, fetched.get(code, (None, None)))
+                    result[code] = self.entries[code][1]
+
+        return result
+
+
+# ============================================================
+# 常駐記憶體的持倉狀態（webhook 查詢用）
+#
+# - 第一次查詢 / ledger 版本變了（其他 instance 寫入、每晚 compaction）/ 跨日
+#   → 從 storage 完整重播一次
+# - webhook 自己寫入的列 → apply() 直接接在目前狀態後面（與串流 chunk 接續相同），
+#   不重新下載；寫入的 segment 名稱併進 version，下次比對時不會誤判成有變動
+# ============================================================
+class LivePortfolio:
+    def __init__(self, ledger, quotes=None, check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        self.ledger = ledger
+        self.quotes = quotes or QuoteCache()
+        self.check_interval = check_interval
+        self.clock = clock
+        self.version = None
+        self.sell_dates = None
+        self.checked_at = None
+        self.codes = {}
+        self.open_buys = {}
+        self.completed = []
+        self.loads = 0
+        self.applied = 0
+        self._lock = threading.RLock()
+
+    # ---- refresh ----
+    def refresh(self, force=False):
+        """→ 這次是否重新載入；距離上次確認不到 check_interval 秒時不碰 storage"""
+        with self._lock:
+            now = self.clock()
+            dates = valid_sell_dates()
+            if self.version is not None and dates == self.sell_dates and not force:
+                if now - self.checked_at < self.check_interval:
+                    return False
+                self.checked_at = now
+                if self.ledger.version() == self.version:
+                    cache_lookup("live_portfolio", True)
+                    return False
+
+            cache_lookup("live_portfolio", False)
+            self._load(dates)
+            self.checked_at = now
+            return True
+
+    def _load(self, dates):
+        with stage("live_load"):
+            data, version = self.ledger.read_versioned()
+            df = data.copy() if isinstance(data, pd.DataFrame) else load_ledger(io.BytesIO(data))
+
+            self.codes, self.open_buys, self.completed = {}, {}, []
+            self.sell_dates = dates
+            self._advance(df)
+            self.version = version
+            self.loads += 1
+
+        print(f"[Live] Loaded {len(df):,} rows（open={len(self.open_buys)}, completed={len(self.completed)}）")
+
+    # ---- incremental ----
+    def apply(self, rows, segment):
+        """
+        webhook 剛寫入 segment 的列（parse_trade_message 的 row）→ 接在目前狀態後面
+        尚未載入過、或這個 segment 已包含在載入的內容裡 → 不用動
+        """
+        with self._lock:
+            if self.version is None or segment in self.version[1]:
+                return False
+
+            df = normalize_ledger(pd.DataFrame(
+                [[row.get(k) for k in LEDGER_FIELDS] for row in rows], columns=LEDGER_FIELDS,
+            ))
+            self._advance(df)
+            generation, pending = self.version
+            self.version = (generation, tuple(sorted(pending + (segment,))))
+            self.applied += len(rows)
+            return True
+
+    def _advance(self, df):
+        """與 stream.replay_trades_stream 的每個 chunk 相同：未平倉當作 seed，接著算新的列"""
+        prices = self.quotes.get_close_prices(null_price_codes(df))
+        df["price"] = resolve_prices(df, prices)
+        done, open_buys = compute_ledger_positions(concat_rows(seed_frame(self.open_buys), df), self.sell_dates)
+        self.completed += done
+        self.codes.update(dict.fromkeys(df["code"].unique()))
+        # 未平倉依 code 在 ledger 中首次出現的順序
+        self.open_buys = {code: open_buys[code] for code in self.codes if code in open_buys}
+
+    def holdings(self):
+        """→ (version, {code: buys})：目前載入的未平倉（盤中監控用，不查價）"""
+        self.refresh()
+        with self._lock:
+            return self.version, dict(self.open_buys)
+
+    # ---- query ----
+    def positions(self, code=None):
+        """
+        → build_positions 的 (completed, open_positions)；code 指定時只含該代號
+        未平倉的現價走 QuoteCache（TTL 內不重查）
+        """
+        self.refresh()
+        with self._lock:
+            completed = [t for t in self.completed if code is None or t["code"] == code]
+            open_buys = {c: b for c, b in self.open_buys.items() if code is None or c == code}
+
+        prices = self.quotes.get_close_prices(open_buys)
+        return build_positions(completed, open_buys, prices)
@@ -0,0 +1,297 @@
+import os
+from array import array
+from math import floor
+
+import pandas as pd
+
+from .engine import BUY_ACTIONS, SELL_ACTIONS, compute_positions
+
+# ledger 的選填欄位：股數 / 這筆交易實付的手續費（+ 證交稅）
+LOT_COLUMNS = ["qty", "fee"]
+
+# fifo / average（加權平均成本）
+COST_METHOD = os.getenv("COST_METHOD", "fifo").lower()
+
+# 剩餘股數小於這個值視為已平倉（浮點誤差）
+EPS = 1e-9
+
+# head 之前已出場的 lot 超過一半（且至少這麼多筆）時才搬移陣列
+COMPACT_MIN = 64
+
+
+# --------------------------------------------------------
+# 台股交易成本
+# --------------------------------------------------------
+class FeeSchedule:
+    """
+    - 手續費：成交金額 × 0.1425% × 折扣，不足 20 元以 20 元計
+    - 證交稅：賣出成交金額 × 0.3%（ETF 0.1%、當沖 0.15% → TW_TAX_RATE）
+    皆無條件捨去到元；ledger 的 fee 欄有值時以實付金額為準
+    """
+
+    def __init__(self, fee_rate=0.001425, discount=1.0, min_fee=20.0, tax_rate=0.003):
+        self.fee_rate = fee_rate
+        self.discount = discount
+        self.min_fee = min_fee
+        self.tax_rate = tax_rate
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            fee_rate=float(os.getenv("TW_FEE_RATE", "0.001425")),
+            discount=float(os.getenv("TW_FEE_DISCOUNT", "1")),
+            min_fee=float(os.getenv("TW_MIN_FEE", "20")),
+            tax_rate=float(os.getenv("TW_TAX_RATE", "0.003")),
+        )
+
+    def commission(self, amount):
+        if amount <= 0:
+            return 0.0
+        return float(max(self.min_fee, floor(amount * self.fee_rate * self.discount + EPS)))
+
+    def tax(self, amount):
+        return float(floor(amount * self.tax_rate + EPS))
+
+
+# --------------------------------------------------------
+# 單一代號的未平倉 lots
+# --------------------------------------------------------
+class LotQueue:
+    """
+    array-backed：各欄位是 array('d')，head 之前的 lot 已出場
+
+    - push：append，攤銷 O(1)
+    - FIFO 賣出：從 head 依序扣，每個 lot 只會被完全扣掉一次 → 攤銷 O(1)
+    - 平均成本賣出：個別 lot 不動，只把剩餘比例乘進 scale → O(1)
+      （lot 實際股數 = qty × scale；部分出場的明細合併成一筆加權平均價）
+
+    舊的 4 欄資料（沒有股數）每筆買進視為 1 單位、explicit = 0，
+    輸出明細時不帶 qty / fee，與原本的 buy_detail 相同
+    """
+
+    __slots__ = ("dates", "price", "qty", "fee", "explicit", "shares", "head", "scale", "held", "cost", "fees")
+
+    def __init__(self):
+        self.dates = []
+        self.price = array("d")
+        self.qty = array("d")
+        self.fee = array("d")
+        self.explicit = array("b")
+        # 有任何一筆是實際股數 → 沒填股數的賣出（全部出場）也要算手續費 / 證交稅
+        self.shares = False
+        self.head = 0
+        self.scale = 1.0
+        self.held = 0.0
+        # cost 含買進手續費，fees 是其中的手續費部分
+        self.cost = 0.0
+        self.fees = 0.0
+
+    def push(self, date, price, qty, fee, explicit):
+        self.dates.append(date)
+        self.price.append(price)
+        self.qty.append(qty / self.scale)
+        self.fee.append(fee / self.scale)
+        self.explicit.append(explicit)
+        self.shares = self.shares or explicit
+        self.held += qty
+        self.cost += price * qty + fee
+        self.fees += fee
+
+    def take(self, qty, detail=None, average=False):
+        """賣出 qty 股 → 這些股數的成本（含買進手續費）；detail 不是 None 時附上出場的 lot 明細"""
+        if qty >= self.held - EPS:
+            cost = self.cost if average else self._take_fifo(qty, detail)[0]
+            if average and detail is not None:
+                detail.extend(self.lots())
+            self._clear()
+            return cost
+
+        if average:
+            return self._take_average(qty, detail)
+
+        cost, fees = self._take_fifo(qty, detail)
+        self.held -= qty
+        self.cost -= cost
+        self.fees -= fees
+        self._compact()
+        return cost
+
+    def _take_fifo(self, qty, detail):
+        """→ (成本, 其中的手續費)"""
+        cost = fees = 0.0
+        i = self.head
+        while qty > EPS and i < len(self.qty):
+            lot_qty = self.qty[i]
+            take = min(qty, lot_qty)
+            fee = self.fee[i] * (take / lot_qty)
+            cost += self.price[i] * take + fee
+            fees += fee
+
+            if detail is not None:
+                detail.append(self._lot(i, take, fee))
+
+            if take >= lot_qty - EPS:
+                i += 1
+            else:
+                self.qty[i] = lot_qty - take
+                self.fee[i] -= fee
+            qty -= take
+
+        self.head = i
+        return cost, fees
+
+    def _take_average(self, qty, detail):
+        ratio = qty / self.held
+        cost = self.cost * ratio
+        fees = self.fees * ratio
+
+        if detail is not None:
+            first, last = self.dates[self.head], self.dates[-1]
+            detail.append({
+                "date": first if first == last else f"{first}~{last}",
+                "price": (cost - fees) / qty,
+                "qty": qty,
+                "fee": fees,
+            })
+
+        self.held -= qty
+        self.cost -= cost
+        self.fees -= fees
+        self.scale *= 1 - ratio
+        return cost
+
+    def lots(self):
+        """未平倉明細（snapshot / 下一個 chunk 以 seed_frame 接續）"""
+        return [
+            self._lot(i, self.qty[i] * self.scale, self.fee[i] * self.scale)
+            for i in range(self.head, len(self.qty))
+        ]
+
+    def _lot(self, i, qty, fee):
+        lot = {"date": self.dates[i], "price": self.price[i]}
+        if self.explicit[i] or abs(qty - 1.0) > EPS:
+            lot["qty"] = qty
+        if fee or "qty" in lot:
+            lot["fee"] = fee
+        return lot
+
+    def _clear(self):
+        self.__init__()
+
+    def _compact(self):
+        if self.head < COMPACT_MIN or self.head * 2 < len(self.qty):
+            return
+        for column in (self.dates, self.price, self.qty, self.fee, self.explicit):
+            del column[:self.head]
+        self.head = 0
+
+
+# --------------------------------------------------------
+# Lot 引擎
+# --------------------------------------------------------
+def has_lots(df):
+    """ledger 中有任何一列填了股數 / 手續費"""
+    return any(c in df.columns and df[c].notna().any() for c in LOT_COLUMNS)
+
+
+def compute_ledger_positions(df, valid_sell_dates):
+    """有股數的 ledger 走 lot 引擎；舊的 4 欄 ledger 沿用向量化的 compute_positions"""
+    if has_lots(df):
+        return compute_lot_positions(df, valid_sell_dates)
+    return compute_positions(df, valid_sell_dates)
+
+
+def _numeric(df, column):
+    if column not in df.columns:
+        return [float("nan")] * len(df)
+    return pd.to_numeric(df[column], errors="coerce").astype(float).tolist()
+
+
+def compute_lot_positions(df, valid_sell_dates, method=None, fees=None, fills=None):
+    """
+    df 需有 date, code, action（小寫）, price（已解析）；qty / fee 選填
+
+    規則：
+    - BUY / KEEP 有價格才算買進；沒有 qty 視為 1 單位、不計手續費
+    - SELL / REDUCE 有價格、且有持倉才算賣出；
+      有 qty → 部分出場（超過持有則全出），剩下的 lots 仍未平倉
+      沒有 qty → 全部出場（與原本的規則相同）
+    - fee 欄為空且有股數時，依 FeeSchedule 計算手續費（賣出另加證交稅）；
+      舊的 4 欄資料（單位不是股數）不計費用
+
+    回傳與 compute_positions 相同：(completed, open_buys)
+    fills（list）不是 None 時，逐筆附加 (date, code, 股數變化, 成本變化, 已實現損益)
+    """
+    average = (method or COST_METHOD) == "average"
+    fees = fees or FeeSchedule.from_env()
+
+    store = {}
+    completed = []
+
+    rows = zip(
+        df["date"].tolist(), df["code"].tolist(), df["action"].tolist(),
+        df["price"].astype(float).tolist(), _numeric(df, "qty"), _numeric(df, "fee"),
+    )
+    for date, code, action, price, qty, fee in rows:
+        if price != price:
+            continue
+        explicit = qty == qty
+
+        if action in BUY_ACTIONS:
+            if explicit and qty <= 0:
+                continue
+            if not explicit:
+                qty = 1.0
+            if fee != fee:
+                fee = fees.commission(price * qty) if explicit else 0.0
+
+            queue = store.get(code)
+            if queue is None:
+                queue = store[code] = LotQueue()
+            queue.push(date, price, qty, fee, explicit)
+
+            if fills is not None:
+                fills.append((date, code, qty, price * qty + fee, 0.0))
+
+        elif action in SELL_ACTIONS:
+            queue = store.get(code)
+            if queue is None or queue.held <= EPS or (explicit and qty <= 0):
+                continue
+
+            qty = min(qty, queue.held) if explicit else queue.held
+            if fee != fee:
+                amount = price * qty
+                fee = fees.commission(amount) + fees.tax(amount) if explicit or queue.shares else 0.0
+
+            reported = action == "reduce" or date in valid_sell_dates
+            detail = [] if reported else None
+            cost = queue.take(qty, detail, average)
+            pnl = price * qty - fee - cost
+
+            if fills is not None:
+                fills.append((date, code, -qty, -cost, pnl))
+            if not reported:
+                continue
+
+            avg_cost = cost / qty
+            sell_net = price - fee / qty
+            trade = {
+                "code": code,
+                "buy_detail": detail,
+                "sell_date": date,
+                "action": action,
+                "avg_cost": avg_cost,
+                "sell_price": price,
+                "pct": ((sell_net - avg_cost) / avg_cost) * 100,
+            }
+            if explicit or fee or any("fee" in b for b in detail):
+                trade.update(qty=qty, fee=fee, pnl=pnl)
+            completed.append(trade)
+
+    order = pd.unique(df["code"])
+    open_buys = {
+        code: store[code].lots()
+        for code in order if code in store and store[code].held > EPS
+    }
+
+    return completed, open_buys
@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# ============================================================
+# 輕量 instrumentation：計時 span、counter、p50/p99
+#
+# - span / stage / external：context manager（也可當 decorator 用 traced）
+# - 結構化 JSON log（一行一筆），TRACE_LOG 控制：
+#     stage（預設）只記 job / parser 階段、all 連每個外部呼叫都記、off 全關
+# - render_prometheus()：給 webhook 的 /metrics 用
+#
+# 每次記錄只有一次 perf_counter + 一個 lock 內的 deque append，
+# production 可以常駐開著。
+# ============================================================
+
+TRACE_LOG = os.getenv("TRACE_LOG", "stage").lower()
+
+# 每個 summary 保留最近 N 筆用來算分位數
+WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+
+PREFIX = "tracking_"
+
+
+class Summary:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.summaries = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                summary = self.summaries[key] = Summary()
+            summary.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.summaries.clear()
+
+    def snapshot(self):
+        """→ {"counters": [...], "summaries": [...]}（JSON 可序列化）"""
+        with self._lock:
+            counters = [
+                {"name": name, **dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            summaries = [
+                {
+                    "name": name, **dict(labels),
+                    "count": s.count,
+                    "sum": round(s.total, 6),
+                    "p50": _round(s.quantile(0.50)),
+                    "p99": _round(s.quantile(0.99)),
+                }
+                for (name, labels), s in sorted(self.summaries.items())
+            ]
+        return {"counters": counters, "summaries": summaries}
+
+    def render_prometheus(self):
+        """Prometheus text exposition format（0.0.4）"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+            for (name, labels), s in sorted(self.summaries.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} summary")
+                    typed.add(name)
+                for q in [0.5, 0.99]:
+                    lines.append(f"{PREFIX}{name}{_labels(labels + (('quantile', str(q)),))} {s.quantile(q)}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {s.total}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {s.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _round(value):
+    return None if value is None else round(value, 6)
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+render_prometheus = registry.render_prometheus
+
+
+# --------------------------------------------------------
+# Structured log
+# --------------------------------------------------------
+def log_event(event, **fields):
+    if TRACE_LOG == "off":
+        return
+    print(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False), flush=True)
+
+
+# --------------------------------------------------------
+# Spans
+# --------------------------------------------------------
+@contextmanager
+def span(name, log=False, **labels):
+    """
+    記錄 {name}_seconds（summary），例外時另外記 {name}_errors_total；
+    log=True 或 TRACE_LOG=all 時輸出一行 JSON
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe(f"{name}_seconds", duration, **labels)
+        if error is not None:
+            registry.inc(f"{name}_errors_total", **labels)
+        if log or TRACE_LOG == "all":
+            log_event("span", name=name, duration_ms=round(duration * 1000, 3), error=error, **labels)
+
+
+def stage(name):
+    """job / parser 的一個階段（預設會寫 JSON log）"""
+    return span("stage", log=True, stage=name)
+
+
+@contextmanager
+def external(service, op):
+    """對外部服務（gcs / finmind / yfinance / line）的一次呼叫"""
+    registry.inc("external_calls_total", service=service, op=op)
+    with span("external_call", service=service, op=op):
+        yield
+
+
+def traced(name, **labels):
+    """decorator 版的 span"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_lookup(cache, hit):
+    registry.inc("cache_hits_total" if hit else "cache_misses_total", cache=cache)
+
+
+def retry(service, op):
+    registry.inc("retries_total", service=service, op=op)
+
+
+def set_trace_log(level):
+    """stage / all / off（例如 process pool 的 worker 關掉 log）"""
+    global TRACE_LOG
+    TRACE_LOG = level
+
+
+@contextmanager
+def quiet():
+    """暫時不輸出 JSON log（metrics 照常記錄）"""
+    previous = TRACE_LOG
+    set_trace_log("off")
+    try:
+        yield
+    finally:
+        set_trace_log(previous)
+
+
+def log_summary():
+    """Job 結束時輸出一行彙總（external calls / cache / 各階段 p50、p99）"""
+    log_event("metrics", **registry.snapshot())
@@ -0,0 +1,78 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .company import resolve_company_names
+from .metrics import quiet, set_trace_log, stage
+from .price import PrefetchedPriceProvider, get_close_prices
+from .trade_parser import build_positions, collect_price_codes, load_ledger, replay_trades
+
+# process pool 大小（預設 = CPU 數）
+MAX_WORKERS = int(os.getenv("PORTFOLIO_WORKERS", "0")) or os.cpu_count() or 1
+
+
+# ============================================================
+# 多使用者：每個 portfolio 各自重播，收盤價 / 公司名稱只查一次
+#
+# 1. worker：解析各 ledger，找出需要收盤價的代號
+# 2. 主程序：所有代號的聯集一次批次查價
+# 3. worker：用查好的價格重播（PrefetchedPriceProvider，不再對外查詢）
+# 4. 主程序：所有報表會用到的公司名稱一次解析，再組出各自的持倉
+# ============================================================
+def _init_worker():
+    # 每個 portfolio 的 stage log 太多，worker 裡只記 metrics 不輸出
+    set_trace_log("off")
+
+
+def _price_codes(source):
+    df = source if isinstance(source, pd.DataFrame) else load_ledger(io.BytesIO(source))
+    return collect_price_codes(df)
+
+
+def _replay(job):
+    source, prices = job
+    completed, open_buys, _ = replay_trades(source, PrefetchedPriceProvider(prices))
+    return completed, open_buys
+
+
+def process_portfolios(ledgers, price_provider=None, max_workers=MAX_WORKERS):
+    """
+    ledgers：{user_id: ledger 內容（bytes）或 typed DataFrame}
+    → {user_id: (completed, open_positions)}
+    """
+    user_ids = list(ledgers)
+    if not user_ids:
+        return {}
+
+    sources = [ledgers[u] for u in user_ids]
+    workers = max(1, min(max_workers, len(user_ids)))
+    chunksize = max(1, len(user_ids) // (workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        with stage("portfolio_codes"):
+            codes = list(pool.map(_price_codes, sources, chunksize=chunksize))
+
+        with stage("prices"):
+            union = list(dict.fromkeys(c for cs in codes for c in cs))
+            prices = get_close_prices(union, provider=price_provider)
+
+        # 每個 worker 只拿自己需要的價格（減少 pickle 的量）
+        with stage("portfolio_replay"):
+            jobs = [(s, {c: prices[c] for c in cs}) for s, cs in zip(sources, codes)]
+            replayed = list(pool.map(_replay, jobs, chunksize=chunksize))
+
+    with stage("names"):
+        needed = []
+        for completed, open_buys in replayed:
+            needed += [t["code"] for t in completed]
+            needed += list(open_buys)
+        resolve_company_names(needed)
+
+    # 名稱都已在快取裡，build_positions 不會再對外查詢
+    with stage("portfolio_positions"), quiet():
+        return {
+            user_id: build_positions(completed, open_buys, prices)
+            for user_id, (completed, open_buys) in zip(user_ids, replayed)
+        }
@@ -1,22 +1,152 @@
-from FinMind.data import DataLoader
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import csv
+import os
+import threading
+import time
 
-loader = DataLoader()
+from .metrics import external, inc
+from .ratelimit import CallPolicy, ProviderError
 
-def get_close_price(code):
+# 同時對 FinMind 發出的請求上限（避免被 throttle）
+MAX_WORKERS = 8
+
+# 依序嘗試的資料源：PRICE_PROVIDERS=finmind,yfinance,file
+DEFAULT_PROVIDERS = "finmind,yfinance"
+
+# 每次外部呼叫的 timeout / 重試次數
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "10"))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", "3"))
+
+
+# --------------------------------------------------------
+# Quote
+# --------------------------------------------------------
+class Quote(tuple):
+    """
+    仍是 (close, symbol) 的 tuple（既有的解包方式不變），
+    另外記錄 trade_date / source / fallback（是否由備援資料源取得）
+    """
+
+    def __new__(cls, close, symbol, trade_date=None, source=None, fallback=False):
+        quote = super().__new__(cls, (close, symbol))
+        quote.trade_date = trade_date
+        quote.source = source
+        quote.fallback = fallback
+        return quote
+
+    def __getnewargs__(self):
+        return self[0], self[1], self.trade_date, self.source, self.fallback
+
+
+# --------------------------------------------------------
+# Price providers
+# --------------------------------------------------------
+class PriceProvider:
+    """
+    Provider 介面：
+    - get_latest_close(code, as_of)  → (close, trade_date)
+    - get_quote(code, as_of)         → Quote | None
+    - get_close_price(code, as_of)   → (close, symbol)
+    - get_close_prices(codes, as_of) → {code: (close, symbol)}
+    - get_history(code, start, end)  → pd.Series（日期 → 收盤價）
+    - get_daily_closes(codes, start, end) → DataFrame（日期 × 代號）
+
+    資料源失敗（throttle / timeout）時 get_latest_close 丟 ProviderError，
+    查不到資料則回傳 (None, None)。
+
+    預設的批次查詢是有上限的併發 fan-out；
+    支援多檔一次查詢的 provider 可以覆寫 get_close_prices。
     """
-    使用 FinMind 取得最新收盤價
+
+    name = "base"
+    max_workers = MAX_WORKERS
+
+    def get_latest_close(self, code, as_of=None):
+        """as_of 當天（含）以前最近一筆收盤價與其交易日"""
+        raise NotImplementedError
+
+    def get_quote(self, code, as_of=None):
+        close_price, trade_date = self.get_latest_close(code, as_of)
+        if close_price is None:
+            return None
+        return Quote(close_price, f"{code}.TW", trade_date, self.name)
+
+    def get_close_price(self, code, as_of=None):
+        quote = self.get_quote(code, as_of)
+        if quote is None:
+            return None, None
+        return quote
+
+    def get_close_prices(self, codes, as_of=None):
+        codes = list(dict.fromkeys(codes))
+        if not codes:
+            return {}
+
+        workers = max(1, min(self.max_workers, len(codes)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda c: self.get_close_price(c, as_of), codes)
+            return dict(zip(codes, results))
+
+    def get_history(self, code, start, end):
+        """start ~ end（含）每個交易日的收盤價；沒有資料回傳空的 Series"""
+        raise NotImplementedError
+
+    def get_daily_closes(self, codes, start, end):
+        """每檔一次整段查詢（有上限的併發）→ 日期 × 代號的收盤價矩陣"""
+        import pandas as pd
+
+        codes = list(dict.fromkeys(codes))
+        if not codes:
+            return pd.DataFrame()
+
+        start, end = _to_date(start), _to_date(end)
+        workers = max(1, min(self.max_workers, len(codes)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            series = list(pool.map(lambda c: self.get_history(c, start, end), codes))
+
+        frame = pd.concat(
+            {code: s for code, s in zip(codes, series) if len(s)}, axis=1
+        ) if any(len(s) for s in series) else pd.DataFrame(index=pd.DatetimeIndex([]))
+        return frame.reindex(columns=codes).sort_index()
+
+
+class FinMindPriceProvider(PriceProvider):
+    """
+    使用 FinMind 取得收盤價
     支援：台股上市 + 上櫃
+
+    FinMind 的 taiwan_stock_daily 一次只能查一檔，
+    因此批次查詢用有上限的 thread pool 併發送出。
+    FINMIND_TOKEN 有設定時登入（額度較高）。
     """
 
-    today = datetime.today().strftime("%Y-%m-%d")
-    start = (datetime.today() - timedelta(days=5)).strftime("%Y-%m-%d")
+    name = "finmind"
+
+    def __init__(self, max_workers=MAX_WORKERS, policy=None):
+        from FinMind.data import DataLoader
 
-    try:
-        df = loader.taiwan_stock_daily(
-            stock_id=str(code),
-            start_date=start,
-        )
+        self.loader = DataLoader()
+        token = os.getenv("FINMIND_TOKEN")
+        if token:
+            self.loader.login_by_token(api_token=token)
+
+        self.max_workers = max_workers
+        self.policy = policy or default_policy("finmind")
+
+    def get_latest_close(self, code, as_of=None):
+        as_of = _to_date(as_of)
+        start = (as_of - timedelta(days=5)).strftime("%Y-%m-%d")
+
+        def fetch():
+            with external("finmind", "taiwan_stock_daily"):
+                return self.loader.taiwan_stock_daily(
+                    stock_id=str(code),
+                    start_date=start,
+                    end_date=as_of.strftime("%Y-%m-%d"),
+                )
+
+        df = self.policy.call(fetch)
 
         if df.empty:
             print(f"[FinMind empty] {code}")
@@ -24,10 +154,319 @@ def get_close_price(code):
 
         # 取最近一筆有效收盤價
         last_row = df.iloc[-1]
-        close_price = float(last_row["close"])
+        return float(last_row["close"]), str(last_row["date"])[:10]
+
+    def get_history(self, code, start, end):
+        import pandas as pd
+
+        def fetch():
+            with external("finmind", "taiwan_stock_daily"):
+                return self.loader.taiwan_stock_daily(
+                    stock_id=str(code),
+                    start_date=start.strftime("%Y-%m-%d"),
+                    end_date=end.strftime("%Y-%m-%d"),
+                )
+
+        df = self.policy.call(fetch)
+        if df.empty:
+            return pd.Series(dtype=float)
+        return pd.Series(df["close"].astype(float).values, index=pd.to_datetime(df["date"]))
+
+
+class YFinancePriceProvider(PriceProvider):
+    """
+    Yahoo Finance（yfinance）；先查上市 .TW，沒有再查上櫃 .TWO
+    與公司名稱查詢共用同一個 yfinance rate limit
+    """
+
+    name = "yfinance"
+
+    def __init__(self, max_workers=MAX_WORKERS, policy=None):
+        self.max_workers = max_workers
+        self.policy = policy or default_policy("yfinance")
+
+    def _history(self, symbol, as_of):
+        import yfinance as yf
+
+        start = (as_of - timedelta(days=7)).strftime("%Y-%m-%d")
+        end = (as_of + timedelta(days=1)).strftime("%Y-%m-%d")
+
+        with external("yfinance", "history"):
+            return yf.Ticker(symbol).history(start=start, end=end, auto_adjust=False, timeout=PROVIDER_TIMEOUT)
+
+    def get_quote(self, code, as_of=None):
+        as_of = _to_date(as_of)
+        for market in ["TW", "TWO"]:
+            symbol = f"{code}.{market}"
+            df = self.policy.call(self._history, symbol, as_of)
+            if df is not None and not df.empty:
+                last = df.iloc[-1]
+                return Quote(float(last["Close"]), symbol, df.index[-1].strftime("%Y-%m-%d"), self.name)
+        return None
+
+    def get_latest_close(self, code, as_of=None):
+        quote = self.get_quote(code, as_of)
+        if quote is None:
+            return None, None
+        return quote[0], quote.trade_date
+
+    def get_history(self, code, start, end):
+        import pandas as pd
+        import yfinance as yf
+
+        for market in ["TW", "TWO"]:
+            def fetch():
+                with external("yfinance", "history"):
+                    return yf.Ticker(f"{code}.{market}").history(
+                        start=start.strftime("%Y-%m-%d"),
+                        end=(end + timedelta(days=1)).strftime("%Y-%m-%d"),
+                        auto_adjust=False,
+                        timeout=PROVIDER_TIMEOUT,
+                    )
+
+            df = self.policy.call(fetch)
+            if df is not None and not df.empty:
+                return pd.Series(df["Close"].astype(float).values, index=df.index.tz_localize(None).normalize())
+        return pd.Series(dtype=float)
+
+
+class LocalPriceProvider(PriceProvider):
+    """
+    離線用的假 provider：價格來自 dict，可設定每次查詢的延遲，
+    用來在沒有網路的情況下 benchmark 批次查詢。
+    """
+
+    name = "local"
+
+    def __init__(self, prices, latency=0.0, max_workers=MAX_WORKERS, history=None):
+        self.prices = {str(k): float(v) for k, v in prices.items()}
+        # history：日期 × 代號的 DataFrame（analytics benchmark 用）
+        self.history = history
+        self.latency = latency
+        self.max_workers = max_workers
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_latest_close(self, code, as_of=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        code = str(code)
+        if code not in self.prices:
+            return None, None
+        return self.prices[code], _to_date(as_of).strftime("%Y-%m-%d")
+
+    def get_history(self, code, start, end):
+        import pandas as pd
+
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.history is None or str(code) not in self.history:
+            return pd.Series(dtype=float)
+        return self.history[str(code)].loc[start:end].dropna()
+
+
+class FilePriceProvider(PriceProvider):
+    """
+    本地收盤價檔（CSV：code,date,close），例如手動匯出的備援資料；
+    取 as_of 當天（含）以前最近的一筆
+    """
+
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+        self._closes = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._closes is None:
+            with self._lock:
+                if self._closes is None:
+                    closes = {}
+                    with open(self.path, "r", encoding="utf-8", newline="") as f:
+                        for row in csv.DictReader(f):
+                            date = row["date"].strip().replace("/", "-")
+                            closes.setdefault(row["code"].strip(), []).append((date, float(row["close"])))
+                    self._closes = {code: sorted(rows) for code, rows in closes.items()}
+        return self._closes
+
+    def get_latest_close(self, code, as_of=None):
+        as_of = _to_date(as_of).strftime("%Y-%m-%d")
+        rows = [r for r in self._load().get(str(code), []) if r[0] <= as_of]
+        if not rows:
+            return None, None
+        trade_date, close_price = rows[-1]
+        return close_price, trade_date
+
+    def get_history(self, code, start, end):
+        import pandas as pd
+
+        start, end = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+        rows = [r for r in self._load().get(str(code), []) if start <= r[0] <= end]
+        return pd.Series([c for _, c in rows], index=pd.to_datetime([d for d, _ in rows]), dtype=float)
+
+
+class PrefetchedPriceProvider(PriceProvider):
+    """
+    已經批次查好的 {code: (close, symbol)}；
+    多個 portfolio 共用同一次查詢（可 pickle，給 process pool 的 worker 用）
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+
+    def get_close_price(self, code, as_of=None):
+        return self.prices.get(str(code), (None, None))
+
+    def get_close_prices(self, codes, as_of=None):
+        return {code: self.get_close_price(code) for code in dict.fromkeys(codes)}
+
+
+class FallbackPriceProvider(PriceProvider):
+    """
+    依序嘗試多個資料源：前一個失敗（ProviderError）或查不到時換下一個
+    由第一個以外的資料源取得的報價標記 fallback=True
+    """
+
+    name = "fallback"
+
+    def __init__(self, providers):
+        self.providers = providers
+        self.max_workers = max(p.max_workers for p in providers)
+
+    def get_quote(self, code, as_of=None):
+        for i, provider in enumerate(self.providers):
+            try:
+                quote = provider.get_quote(code, as_of)
+            except ProviderError as e:
+                print(f"[Price] {provider.name} 失敗 {code}: {e}")
+                inc("provider_failures_total", service=provider.name)
+                continue
+
+            if quote is not None:
+                if i > 0:
+                    inc("provider_fallbacks_total", service=provider.name)
+                    quote.fallback = True
+                return quote
+
+        return None
+
+    def get_latest_close(self, code, as_of=None):
+        quote = self.get_quote(code, as_of)
+        if quote is None:
+            return None, None
+        return quote[0], quote.trade_date
+
+    def get_history(self, code, start, end):
+        import pandas as pd
+
+        for provider in self.providers:
+            try:
+                history = provider.get_history(code, start, end)
+            except ProviderError as e:
+                print(f"[Price] {provider.name} 歷史價失敗 {code}: {e}")
+                inc("provider_failures_total", service=provider.name)
+                continue
+            if len(history):
+                return history
+        return pd.Series(dtype=float)
+
+
+# --------------------------------------------------------
+# 設定（env）
+# --------------------------------------------------------
+def default_policy(service):
+    """
+    {SERVICE}_RATE / {SERVICE}_BURST：token bucket（每秒次數 / 可累積的次數）
+    {SERVICE}_CONCURRENCY：同時進行中的呼叫上限
+    預設值大致對應 FinMind 登入後每小時 6000 次的額度
+    """
+    prefix = service.upper()
+    return CallPolicy(
+        service,
+        rate=float(os.getenv(f"{prefix}_RATE", "1.6")),
+        burst=float(os.getenv(f"{prefix}_BURST", "300")),
+        max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(MAX_WORKERS))),
+        timeout=PROVIDER_TIMEOUT,
+        retries=PROVIDER_RETRIES,
+    )
+
+
+def build_provider(name):
+    if name == "finmind":
+        return FinMindPriceProvider()
+    if name == "yfinance":
+        return YFinancePriceProvider()
+    if name == "file":
+        return FilePriceProvider(os.getenv("PRICE_FILE", os.path.join("data", "prices.csv")))
+    raise ValueError(f"Unknown price provider: {name}")
+
+
+def build_providers(names=None):
+    names = names or os.getenv("PRICE_PROVIDERS", DEFAULT_PROVIDERS)
+    # 只有一個資料源也包一層：失敗時回傳查不到，而不是讓整批查詢丟例外
+    return FallbackPriceProvider([build_provider(n.strip()) for n in names.split(",") if n.strip()])
+
+
+# --------------------------------------------------------
+# Module-level provider（可替換）
+# --------------------------------------------------------
+_provider = None
+
+
+def get_price_provider():
+    global _provider
+    if _provider is None:
+        from .price_cache import PriceCache, CachedPriceProvider
+
+        _provider = build_providers()
+        cache = PriceCache.from_env()
+        if cache is not None:
+            _provider = CachedPriceProvider(_provider, cache)
+    return _provider
+
+
+def set_price_provider(provider):
+    """替換全域 price provider（測試 / benchmark 用）"""
+    global _provider
+    _provider = provider
+
+
+def get_close_price(code):
+    """
+    取得最新收盤價 → (close, symbol)
+    """
+    return get_price_provider().get_close_price(code)
+
+
+def get_close_prices(codes, as_of=None, provider=None):
+    """
+    批次取得收盤價 → {code: (close, symbol)}
+    as_of 為 None 時取今天為止的最新收盤價
+    """
+    provider = provider or get_price_provider()
+    return provider.get_close_prices([str(c) for c in codes], as_of)
+
+
+def flush_price_cache():
+    """寫回持久化快取並印出 hit / miss 統計（Job 結束時呼叫）"""
+    cache = getattr(_provider, "cache", None)
+    if cache is None:
+        return
+
+    cache.save()
+    print(f"[PriceCache] hits={cache.hits} misses={cache.misses}")
 
-        return close_price, f"{code}.TW"
 
-    except Exception as e:
-        print(f"[FinMind Error] {code}: {e}")
-        return None, None
\ No newline at end of file
+def _to_date(as_of):
+    if as_of is None:
+        return datetime.today()
+    if isinstance(as_of, str):
+        return datetime.strptime(as_of.replace("/", "-"), "%Y-%m-%d")
+    return as_of
@@ -0,0 +1,334 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from .metrics import cache_lookup
+from .price import PriceProvider, Quote, _to_date
+
+TAIPEI = ZoneInfo("Asia/Taipei")
+MARKET_CLOSE = (13, 30)
+
+# 收盤後資料還沒出來時，多久後重查（秒）
+STALE_RETRY_SECONDS = 30 * 60
+
+DEFAULT_CACHE_DIR = os.getenv("PRICE_CACHE_DIR", ".cache")
+CACHE_FILE = "prices.sqlite"
+
+
+# --------------------------------------------------------
+# TWSE 交易日曆
+# --------------------------------------------------------
+def _load_holidays():
+    """休市日：TWSE_HOLIDAYS=2026-01-01,2026-02-16,..."""
+    raw = os.getenv("TWSE_HOLIDAYS", "")
+    return {d.strip().replace("/", "-") for d in raw.split(",") if d.strip()}
+
+
+HOLIDAYS = _load_holidays()
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day.strftime("%Y-%m-%d") not in HOLIDAYS
+
+
+def market_close_at(day):
+    return datetime(day.year, day.month, day.day, *MARKET_CLOSE, tzinfo=TAIPEI)
+
+
+def next_market_close(now):
+    """now 之後（不含）最近一次的 TWSE 收盤時間"""
+    now = now.astimezone(TAIPEI)
+    day = now.date()
+    while True:
+        if is_trading_day(day) and market_close_at(day) > now:
+            return market_close_at(day)
+        day += timedelta(days=1)
+
+
+def latest_close_expiry(as_of, trade_date, now):
+    """
+    「as_of 為止最新收盤價」這筆查詢結果的有效期限（epoch 秒）
+    None = 永遠有效（as_of 那天已收盤，答案不會再變）
+    """
+    now = now.astimezone(TAIPEI)
+    as_of_day = _to_date(as_of).date()
+
+    if now < market_close_at(as_of_day):
+        # as_of 當天還沒收盤 → 下次收盤後失效
+        return next_market_close(now).timestamp()
+
+    if is_trading_day(as_of_day) and trade_date != as_of_day.strftime("%Y-%m-%d"):
+        # 已收盤但資料源還沒更新 → 稍後重查
+        return now.timestamp() + STALE_RETRY_SECONDS
+
+    return None
+
+
+def _has_trading_day(start, end):
+    day = start.date()
+    while day <= end.date():
+        if is_trading_day(day):
+            return True
+        day += timedelta(days=1)
+    return False
+
+
+def last_close_date(now=None):
+    """now 時點已經收盤的最近一個交易日（YYYY-MM-DD）"""
+    now = (now or datetime.now(TAIPEI)).astimezone(TAIPEI)
+    day = now.date()
+    while not (is_trading_day(day) and market_close_at(day) <= now):
+        day -= timedelta(days=1)
+    return day.strftime("%Y-%m-%d")
+
+
+def price_flag(quote, now=None):
+    """
+    報表用的報價標記：
+    - "missing"：所有資料源都查不到
+    - "stale"：不是最近一個交易日的收盤價
+    - "fallback"：由備援資料源取得
+    - None：正常
+    """
+    if quote is None or quote[0] is None:
+        return "missing"
+    trade_date = getattr(quote, "trade_date", None)
+    if trade_date is not None and trade_date < last_close_date(now):
+        return "stale"
+    if getattr(quote, "fallback", False):
+        return "fallback"
+    return None
+
+
+# --------------------------------------------------------
+# SQLite cache
+# --------------------------------------------------------
+class PriceCache:
+    """
+    持久化收盤價快取（SQLite）
+
+    - closes：(code, trade_date) → close，過去的收盤價永久保存
+    - latest：(code, as_of) → trade_date，只有「最新收盤價」查詢會過期
+    - history_ranges：code → 已完整抓過歷史價的區間 [first, last]（analytics 用）
+
+    設定 PRICE_CACHE_GCS=gs://bucket/prefix 時，
+    開啟時先從 GCS 下載、save() 時再上傳，讓 Cloud Run 每次都能沿用。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, gcs_uri=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self.gcs_uri = gcs_uri
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.gcs_uri:
+            self._download()
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS closes (
+                code TEXT NOT NULL,
+                trade_date TEXT NOT NULL,
+                close REAL NOT NULL,
+                PRIMARY KEY (code, trade_date)
+            );
+            CREATE TABLE IF NOT EXISTS latest (
+                code TEXT NOT NULL,
+                as_of TEXT NOT NULL,
+                trade_date TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (code, as_of)
+            );
+            CREATE TABLE IF NOT EXISTS history_ranges (
+                code TEXT PRIMARY KEY,
+                first TEXT NOT NULL,
+                last TEXT NOT NULL
+            );
+        """)
+
+        # 舊版快取沒有報價來源欄位 → 補上
+        for column in ["symbol TEXT", "source TEXT", "fallback INTEGER NOT NULL DEFAULT 0"]:
+            try:
+                self.conn.execute(f"ALTER TABLE latest ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+
+    @classmethod
+    def from_env(cls):
+        """PRICE_CACHE=false 可關閉快取"""
+        if os.getenv("PRICE_CACHE", "true").lower() != "true":
+            return None
+        return cls(DEFAULT_CACHE_DIR, os.getenv("PRICE_CACHE_GCS"))
+
+    def get_latest(self, code, as_of, now=None):
+        """→ Quote；沒有或過期時回傳 None"""
+        now = now or datetime.now(TAIPEI)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT c.close, l.trade_date, l.expires_at, l.symbol, l.source, l.fallback FROM latest l "
+                "JOIN closes c ON c.code = l.code AND c.trade_date = l.trade_date "
+                "WHERE l.code = ? AND l.as_of = ?",
+                (code, as_of),
+            ).fetchone()
+
+            if row is None or (row[2] is not None and row[2] <= now.timestamp()):
+                self.misses += 1
+                cache_lookup("price", False)
+                return None
+
+            self.hits += 1
+            cache_lookup("price", True)
+            close, trade_date, _, symbol, source, fallback = row
+            return Quote(close, symbol or f"{code}.TW", trade_date, source, bool(fallback))
+
+    def put_latest(self, code, as_of, quote, now=None):
+        now = now or datetime.now(TAIPEI)
+        close, symbol = quote
+        trade_date = quote.trade_date
+        expires_at = latest_close_expiry(as_of, trade_date, now)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO closes VALUES (?, ?, ?)",
+                (code, trade_date, close),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO latest (code, as_of, trade_date, expires_at, symbol, source, fallback) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (code, as_of, trade_date, expires_at, symbol, quote.source, int(quote.fallback)),
+            )
+            self.conn.commit()
+
+    def get_history_range(self, code):
+        """→ (first, last)；沒抓過歷史價時回傳 None"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT first, last FROM history_ranges WHERE code = ?", (code,)
+            ).fetchone()
+
+    def put_history(self, code, series, first, last):
+        """寫入一段歷史收盤價，並把已涵蓋區間更新成 [first, last]"""
+        rows = [(code, d.strftime("%Y-%m-%d"), float(c)) for d, c in series.items()]
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO closes VALUES (?, ?, ?)", rows)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO history_ranges VALUES (?, ?, ?)", (code, first, last)
+            )
+            self.conn.commit()
+
+    def get_closes(self, code, start, end):
+        """→ [(trade_date, close), ...]（start ~ end，含）"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT trade_date, close FROM closes WHERE code = ? AND trade_date BETWEEN ? AND ? "
+                "ORDER BY trade_date",
+                (code, start, end),
+            ).fetchall()
+
+    def save(self):
+        with self._lock:
+            self.conn.commit()
+        if self.gcs_uri:
+            self._upload()
+
+    # ---- GCS sync ----
+    def _remote(self):
+        bucket, _, prefix = self.gcs_uri.removeprefix("gs://").partition("/")
+        name = f"{prefix.rstrip('/')}/{CACHE_FILE}" if prefix else CACHE_FILE
+        return bucket, name
+
+    def _download(self):
+        from storage.gcs import read_object
+
+        start = time.time()
+        try:
+            obj = read_object(*self._remote())
+            if obj is None:
+                print("[PriceCache] No remote cache, start empty")
+                return
+            with open(self.path, "wb") as f:
+                f.write(obj.data)
+            print(f"[PriceCache] Loaded {self.gcs_uri} ({time.time() - start:.2f} sec)")
+        except Exception as e:
+            print(f"[PriceCache] No remote cache, start empty: {e}")
+
+    def _upload(self):
+        from storage.gcs import get_store
+
+        try:
+            with open(self.path, "rb") as f:
+                get_store().write(*self._remote(), f.read())
+            print(f"[PriceCache] Saved to {self.gcs_uri}")
+        except Exception as e:
+            print(f"[PriceCache ERROR] {e}")
+
+
+class CachedPriceProvider(PriceProvider):
+    """在任一 provider 外包一層 PriceCache；只有 cache miss 才會打到 inner"""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+        self.max_workers = inner.max_workers
+
+    def get_quote(self, code, as_of=None):
+        as_of = _to_date(as_of or datetime.now(TAIPEI)).strftime("%Y-%m-%d")
+
+        cached = self.cache.get_latest(code, as_of)
+        if cached is not None:
+            return cached
+
+        quote = self.inner.get_quote(code, as_of)
+        if quote is not None:
+            self.cache.put_latest(code, as_of, quote)
+        return quote
+
+    def get_latest_close(self, code, as_of=None):
+        quote = self.get_quote(code, as_of)
+        if quote is None:
+            return None, None
+        return quote[0], quote.trade_date
+
+    def get_history(self, code, start, end):
+        """
+        過去的收盤價不會變 → 只向 inner 抓快取區間以外的部分：
+        第二次以後的 Job 通常只需要補上次之後的幾天。
+        已涵蓋區間的結尾以資料源實際回傳的最後交易日為準（資料源還沒更新時下次會再補）
+        """
+        import pandas as pd
+
+        start_s, end_s = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+        covered = self.cache.get_history_range(code)
+
+        if covered is None:
+            gaps = [(start, end)]
+        else:
+            first, last = covered
+            gaps = []
+            if start_s < first:
+                gaps.append((start, _to_date(first) - timedelta(days=1)))
+            if end_s > last and _has_trading_day(_to_date(last) + timedelta(days=1), end):
+                gaps.append((_to_date(last) + timedelta(days=1), end))
+
+        cache_lookup("price_history", not gaps)
+        for gap_start, gap_end in gaps:
+            fetched = self.inner.get_history(code, gap_start, gap_end)
+            if not len(fetched):
+                continue
+
+            # 缺口一定緊鄰既有區間（前段或後段）→ 合併後仍是連續區間
+            first = gap_start.strftime("%Y-%m-%d")
+            last = fetched.index.max().strftime("%Y-%m-%d")
+            if covered is not None:
+                first, last = min(first, covered[0]), max(last, covered[1])
+            covered = (first, last)
+            self.cache.put_history(code, fetched, *covered)
+
+        rows = self.cache.get_closes(code, start_s, end_s)
+        if not rows:
+            return pd.Series(dtype=float)
+        return pd.Series([c for _, c in rows], index=pd.to_datetime([d for d, _ in rows]), dtype=float)
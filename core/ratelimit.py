@@ -0,0 +1,148 @@
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from .metrics import inc, retry
+
+
+class ProviderError(Exception):
+    """外部資料源呼叫失敗（throttle / timeout / 網路），重試用完後才往外丟"""
+
+
+# --------------------------------------------------------
+# Token bucket：平均每秒 rate 次，最多累積 burst 次
+# --------------------------------------------------------
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """拿到一個 token 才回傳（必要時 sleep，不佔著 lock）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 同一個資料源（例如 yfinance 同時用來查價與查公司名稱）共用同一個 bucket
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(name, rate, burst=None):
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = _buckets[name] = TokenBucket(rate, burst)
+        return bucket
+
+
+# --------------------------------------------------------
+# 哪些失敗值得重試：timeout / 連線錯誤 / HTTP 429、5xx / 資料源的 rate limit
+# 其他（4xx、查無代號、ValueError …）重試也不會成功 → 直接往外丟
+# --------------------------------------------------------
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_transient(error):
+    if isinstance(error, (TimeoutError, ConnectionError, FutureTimeout)):
+        return True
+
+    # requests 只在用到的 provider 裡才 import（webhook 的 import 預算），這裡不主動載入
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+
+    # requests.HTTPError 等帶 response 的例外 → 看 status code
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUS
+
+    # yfinance 的 YFRateLimitError 等
+    return "RateLimit" in type(error).__name__
+
+
+# --------------------------------------------------------
+# 呼叫策略：rate limit + 併發上限 + timeout + 指數 backoff
+# --------------------------------------------------------
+# 用來實作 per-call timeout；逾時的呼叫會在背景跑完，但不再等它
+_timeout_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="provider-call")
+
+
+class CallPolicy:
+    def __init__(self, service, rate=None, burst=None, max_concurrency=8, timeout=None, retries=3, backoff=0.5,
+                 transient=is_transient):
+        self.service = service
+        self.bucket = get_bucket(service, rate, burst) if rate else None
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.transient = transient
+
+    def _run(self, fn, args, kwargs):
+        """
+        拿到併發名額才呼叫；名額在呼叫真正結束時才歸還：
+        逾時的呼叫還在背景跑的話仍佔著名額，重試不會疊在它上面超過上限
+        """
+        if not self.semaphore.acquire(timeout=self.timeout):
+            raise TimeoutError(f"{self.service}: no free slot within {self.timeout}s")
+
+        if not self.timeout:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.semaphore.release()
+
+        def call():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.semaphore.release()
+
+        try:
+            future = _timeout_pool.submit(call)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return future.result(self.timeout)
+
+    def call(self, fn, *args, **kwargs):
+        """暫時性的失敗（is_transient）才重試，用完重試次數後丟 ProviderError；其他失敗不重試、立即丟 ProviderError"""
+        for attempt in range(self.retries + 1):
+            if self.bucket is not None:
+                self.bucket.acquire()
+
+            try:
+                return self._run(fn, args, kwargs)
+            except FutureTimeout:
+                inc("provider_timeouts_total", service=self.service)
+                error = ProviderError(f"{self.service}: timeout after {self.timeout}s")
+            except Exception as e:
+                if not self.transient(e):
+                    # 永久性的失敗：不重試，直接往外丟（呼叫端照樣以 ProviderError 處理 / fallback）
+                    if isinstance(e, ProviderError):
+                        raise
+                    raise ProviderError(f"{self.service}: {e}") from e
+                error = e
+
+            if attempt == self.retries:
+                if isinstance(error, ProviderError):
+                    raise error
+                raise ProviderError(f"{self.service}: {error}") from error
+
+            # 指數 backoff + jitter
+            retry(self.service, "call")
+            time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+SNAPSHOT_VERSION = 3
+
+
+# --------------------------------------------------------
+# 持倉快照
+#
+# 記錄 ledger 處理到哪個 byte offset、該段內容的 sha256，
+# 以及當時每個 code 的未平倉買進與仍需列入報表的已實現交易。
+# 下次只要前段內容沒被改過，就只需處理 offset 之後的新資料。
+#
+# null 價格的列用的是「當下」的收盤價，算好的結果會隨收盤價變：
+# 這類列仍影響未平倉 / 報表的代號（tracked）只存原始列，
+# 已實現交易只留占位，接續時用這次的收盤價重播（trade_parser.resume_tracked）。
+# --------------------------------------------------------
+def ledger_checkpoint(data: bytes):
+    """→ (offset, sha256)，offset 取到最後一個換行為止"""
+    offset = data.rfind(b"\n") + 1
+    return offset, hashlib.sha256(data[:offset]).hexdigest()
+
+
+def read_snapshot(path):
+    """只讀檔與檢查版本（ledger 前段由呼叫端比對）"""
+    if not path or not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except Exception as e:
+        print(f"[Snapshot] 無法讀取 {path}：{e}")
+        return None
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        print("[Snapshot] 版本不同，完整重算")
+        return None
+
+    return snapshot
+
+
+def load_snapshot(path, data: bytes):
+    """
+    讀取快照並檢查 ledger 前段是否與快照一致
+    不存在 / 版本不同 / ledger 前段被修改過 → None（改為完整重算）
+    """
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return None
+
+    offset = snapshot["offset"]
+    if len(data) < offset or hashlib.sha256(data[:offset]).hexdigest() != snapshot["sha256"]:
+        print("[Snapshot] ledger 在快照位置之前被修改過，完整重算")
+        return None
+
+    print(f"[Snapshot] 從 byte {offset} 接續（{len(data) - offset} bytes 新資料）")
+    return snapshot
+
+
+def save_snapshot(path, data: bytes, codes, open_buys, completed, tracked):
+    if data and not data.endswith(b"\n"):
+        # 最後一行沒有換行，快照狀態對不上 offset → 這次不存
+        print("[Snapshot] ledger 結尾沒有換行，略過快照")
+        return
+
+    offset, digest = ledger_checkpoint(data)
+    write_snapshot(path, offset, digest, codes, open_buys, completed, tracked)
+
+
+def write_snapshot(path, offset, digest, codes, open_buys, completed, tracked):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "offset": offset,
+        "sha256": digest,
+        "codes": codes,
+        "open_buys": open_buys,
+        "completed": completed,
+        "tracked": tracked,
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+    print(f"[Snapshot] Saved {path}（offset={offset}, open={len(open_buys)}, tracked={len(tracked)}）")
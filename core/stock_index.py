@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import unicodedata
+
+# 台股代號：上市 / 上櫃股票（2330）、特別股（2881A）、ETF（0050、00878、00632R）、權證（030001、03001P）
+CODE_PATTERN = re.compile(r"\d{4}[0-9A-Z]{0,2}")
+
+# 索引的來源（get_stock_list 由證交所 / 櫃買中心的 CSV 產生）
+SOURCE_PATH = os.path.join("data", "company_names.json")
+
+# 索引檔：第一次用到時由 SOURCE_PATH 建立，來源內容變了才重建
+INDEX_PATH = os.getenv("STOCK_INDEX_PATH", os.path.join(os.getenv("PRICE_CACHE_DIR", ".cache"), "company_names.sqlite"))
+
+INDEX_VERSION = 1
+
+# 唯讀、memory-mapped（整個索引只有幾百 KB）
+MMAP_SIZE = 16 * 1024 * 1024
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize_name(name):
+    """搜尋用的 key：全形轉半形、英文不分大小寫、去掉空白"""
+    return "".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+# ============================================================
+# 建立索引
+#
+# stocks(code → name)：WITHOUT ROWID，依代號排序的 B-tree → O(log n) 查代號
+# names(key, code)  ：依正規化名稱排序的 B-tree，名稱前綴搜尋是一段 range scan
+#                     （等同 trie 的前綴走訪：O(log n + 結果數)）
+# meta：索引版本 + 來源檔的 sha256（沒變就不重建）
+# ============================================================
+def sources_fingerprint(sources):
+    digest = hashlib.sha256(f"v{INDEX_VERSION}".encode("utf-8"))
+    for path in sources:
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        try:
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def read_json_names(path):
+    """{code: name} 的 JSON（company_names.json）"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_index(sources=None, path=None, parse=read_json_names, force=False):
+    """
+    sources 依序讀入（後面的覆蓋前面的），寫成 path 的 SQLite 索引
+    → 是否重建；來源檔內容與上次相同時不動
+    """
+    sources = sources or [SOURCE_PATH]
+    path = path or INDEX_PATH
+    fingerprint = sources_fingerprint(sources)
+    if not force and _stored_fingerprint(path) == fingerprint:
+        return False
+
+    names = {}
+    for source in sources:
+        if os.path.exists(source):
+            names.update(parse(source))
+        else:
+            print(f"[StockIndex] 找不到來源：{source}")
+
+    write_index(path, names, fingerprint)
+    return True
+
+
+def write_index(path, names, fingerprint=""):
+    """寫到暫存檔再 rename：已開啟舊索引的 process 不受影響"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    rows = sorted((str(code), name) for code, name in names.items() if name)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript("""
+            PRAGMA journal_mode = OFF;
+            CREATE TABLE stocks (code TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID;
+            CREATE TABLE names (key TEXT NOT NULL, code TEXT NOT NULL, PRIMARY KEY (key, code)) WITHOUT ROWID;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+        """)
+        conn.executemany("INSERT INTO stocks VALUES (?, ?)", rows)
+        conn.executemany(
+            "INSERT OR IGNORE INTO names VALUES (?, ?)",
+            sorted((normalize_name(name), code) for code, name in rows),
+        )
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("version", str(INDEX_VERSION)), ("sources", fingerprint), ("count", str(len(rows))),
+        ])
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    print(f"[StockIndex] Saved {path}（{len(rows)} 檔）")
+
+
+def _stored_fingerprint(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    if meta.get("version") != str(INDEX_VERSION):
+        return None
+    return meta.get("sources")
+
+
+# ============================================================
+# 查詢
+# ============================================================
+class StockIndex:
+    def __init__(self, path=None):
+        self.path = path or INDEX_PATH
+        self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self._lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM stocks")[0][0]
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def get(self, code):
+        """代號 → 名稱；沒有回傳 None"""
+        rows = self._query("SELECT name FROM stocks WHERE code = ?", (str(code),))
+        return rows[0][0] if rows else None
+
+    def names(self, codes):
+        """批次查代號 → {code: name}（只含有的）"""
+        codes = [str(c) for c in dict.fromkeys(codes)]
+        result = {}
+        # SQLite 的參數上限（舊版 999）
+        for i in range(0, len(codes), 500):
+            chunk = codes[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            result.update(self._query(f"SELECT code, name FROM stocks WHERE code IN ({placeholders})", chunk))
+        return result
+
+    def search(self, text, limit=10):
+        """
+        名稱前綴搜尋 → [(code, name), ...]，完全相同的名稱排最前面
+        輸入本身是代號時直接查代號
+        """
+        text = text.strip()
+        if CODE_PATTERN.fullmatch(text.upper()):
+            name = self.get(text.upper())
+            return [(text.upper(), name)] if name else []
+
+        key = normalize_name(text)
+        if not key:
+            return []
+        return self._query(
+            """
+            SELECT n.code, s.name FROM names n JOIN stocks s ON s.code = n.code
+            WHERE n.key >= ? AND n.key < ?
+            ORDER BY n.key != ?, length(n.key), n.key, n.code
+            LIMIT ?
+            """,
+            (key, key + "\U0010ffff", key, limit),
+        )
+
+    def resolve(self, text):
+        """
+        使用者輸入的代號或名稱 → (code, 候選清單)
+        代號、完全相同的名稱、或前綴只對到一檔 → code；否則 code 為 None，附上候選
+        """
+        matches = self.search(text, limit=6)
+        if len(matches) == 1 or (matches and normalize_name(matches[0][1]) == normalize_name(text)):
+            return matches[0][0], matches
+        return None, matches
+
+    def close(self):
+        self.conn.close()
+
+
+def get_stock_index():
+    """process 共用的索引；第一次用到時確認來源有沒有變（有變才重建）"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                path = INDEX_PATH
+                try:
+                    build_index(path=path)
+                except (OSError, sqlite3.Error) as e:
+                    # 唯讀的檔案系統 → 建在暫存目錄
+                    print(f"[StockIndex ERROR] {e}")
+                    path = os.path.join(tempfile.gettempdir(), os.path.basename(INDEX_PATH))
+                    build_index(path=path)
+                _index = StockIndex(path)
+    return _index
@@ -0,0 +1,184 @@
+import hashlib
+import io
+import os
+
+from .metrics import observe, stage
+from .price import get_close_prices
+from .snapshot import read_snapshot, write_snapshot
+from .engine import resolve_prices
+from .lots import compute_ledger_positions
+from .trade_parser import (
+    VALID_SELL_DATES, build_positions, concat_rows, empty_snapshot, maybe_open_flags, normalize_ledger, null_price_codes,
+    read_ledger_csv, resume_tracked, seed_frame, snapshot_state, track_rows, tracked_frame,
+)
+
+try:
+    import resource
+except ImportError:  # Windows 本地開發
+    resource = None
+
+# 每次讀進記憶體的列數
+CHUNK_ROWS = int(os.getenv("LEDGER_CHUNK_ROWS", "100000"))
+
+HASH_BLOCK = 1024 * 1024
+
+
+# --------------------------------------------------------
+# 邊讀邊算 sha256（快照的 offset / sha256 不必整份 ledger 在記憶體裡）
+# --------------------------------------------------------
+class HashingReader(io.RawIOBase):
+    def __init__(self, raw, hasher, offset=0, prefix=b""):
+        self.raw = raw
+        self.hasher = hasher
+        self.offset = offset
+        self.last = b"\n" if offset else b""
+        # prefix（接續快照時補回的 header）只給 pandas 看，不算進 hash / offset
+        self.prefix = io.BytesIO(prefix)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.prefix.readinto(buffer)
+        if n:
+            return n
+
+        data = self.raw.read(len(buffer))
+        if not data:
+            return 0
+        buffer[:len(data)] = data
+        self.hasher.update(data)
+        self.offset += len(data)
+        self.last = data[-1:]
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def _resume(open_stream, snapshot_path):
+    """
+    → (snapshot | None, HashingReader)
+    快照的 ledger 前段一致 → reader 停在 offset 之後（前面補 header）；
+    否則重新開一次 stream 從頭讀
+    """
+    snapshot = read_snapshot(snapshot_path)
+    stream = open_stream()
+
+    if snapshot is not None:
+        hasher = hashlib.sha256()
+        header = b""
+        remaining = snapshot["offset"]
+        while remaining > 0:
+            block = stream.read(min(HASH_BLOCK, remaining))
+            if not block:
+                break
+            if not header:
+                header = block
+            hasher.update(block)
+            remaining -= len(block)
+
+        if remaining == 0 and hasher.hexdigest() == snapshot["sha256"]:
+            header = header[:header.find(b"\n") + 1]
+            print(f"[Snapshot] 從 byte {snapshot['offset']} 接續（串流）")
+            return snapshot, HashingReader(stream, hasher, snapshot["offset"], header)
+
+        print("[Snapshot] ledger 在快照位置之前被修改過，完整重算")
+        stream.close()
+        stream = open_stream()
+
+    return None, HashingReader(stream, hashlib.sha256())
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Linux 的 ru_maxrss 單位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --------------------------------------------------------
+# 串流版 process_trades
+# --------------------------------------------------------
+def process_trades_stream(open_stream, price_provider=None, snapshot_path=None, chunk_rows=CHUNK_ROWS):
+    return build_positions(*replay_trades_stream(open_stream, price_provider, snapshot_path, chunk_rows))
+
+
+def replay_trades_stream(open_stream, price_provider=None, snapshot_path=None, chunk_rows=CHUNK_ROWS):
+    """
+    open_stream()：回傳 ledger 的 binary stream（本地檔案或 GCS 串流下載）
+
+    每次只讀 chunk_rows 列，跨 chunk 只保留每個 code 的狀態：
+    - 未平倉買進（下一個 chunk 以 seed_frame 接續，與快照接續相同）
+    - 最後一筆有效買賣之後是否可能仍有持倉（決定結尾要不要查收盤價，與 collect_price_codes 相同）
+    收盤價在遇到 null 價格時才以 chunk 為單位批次查詢。
+    結果與 replay_trades 相同。
+    """
+    snapshot, reader = _resume(open_stream, snapshot_path)
+    prices = {}
+    resumed = None
+    if snapshot is not None:
+        # 追蹤代號（null 價格仍影響結果）用這次的收盤價重播
+        frame = tracked_frame(snapshot["tracked"])
+        with stage("prices"):
+            prices = get_close_prices(null_price_codes(frame), provider=price_provider)
+        resumed = resume_tracked(snapshot, frame, prices)
+        if resumed is None:
+            print("[Snapshot] 追蹤代號的已實現交易對不上，完整重算")
+            reader.close()
+            reader = HashingReader(open_stream(), hashlib.sha256())
+
+    if resumed is None:
+        snapshot = empty_snapshot()
+        resumed = [], {}, set()
+
+    completed, open_buys, replayed = resumed
+    tracked = snapshot["tracked"]
+    codes = dict.fromkeys(snapshot["codes"])
+    maybe_open = dict.fromkeys(open_buys, True)
+    rows = chunks = 0
+
+    with reader, stage("stream_positions"):
+        for chunk in read_ledger_csv(io.BufferedReader(reader, HASH_BLOCK), chunksize=chunk_rows):
+            df = normalize_ledger(chunk)
+            rows += len(df)
+            chunks += 1
+
+            needed = [c for c in null_price_codes(df) if c not in prices]
+            if needed:
+                prices.update(get_close_prices(needed, provider=price_provider))
+
+            if snapshot_path:
+                track_rows(tracked, df, open_buys)
+            df["price"] = resolve_prices(df, prices)
+            done, open_buys = compute_ledger_positions(concat_rows(seed_frame(open_buys), df), VALID_SELL_DATES)
+            replayed |= {id(t) for t in done if t["code"] in tracked}
+            completed += done
+
+            codes.update(dict.fromkeys(df["code"].unique()))
+            maybe_open.update(maybe_open_flags(df))
+
+    # 可能未平倉的代號 → 補查收盤價
+    with stage("prices"):
+        needed = [c for c, is_open in maybe_open.items() if is_open and c not in prices]
+        prices.update(get_close_prices(needed, provider=price_provider))
+
+    # 未平倉依 code 在 ledger 中首次出現的順序
+    codes = list(codes)
+    open_buys = {code: open_buys[code] for code in codes if code in open_buys}
+
+    if snapshot_path:
+        if reader.offset and reader.last != b"\n":
+            print("[Snapshot] ledger 結尾沒有換行，略過快照")
+        else:
+            with stage("save_snapshot"):
+                state = snapshot_state(tracked, completed, open_buys, replayed, prices)
+                write_snapshot(snapshot_path, reader.offset, reader.hasher.hexdigest(), codes, *state)
+
+    peak = peak_rss_mb()
+    if peak is not None:
+        observe("stream_peak_rss_mb", peak)
+    print(f"[Stream] {rows:,} rows in {chunks} chunks, peak RSS {peak or 0:.1f} MB")
+
+    return completed, open_buys, prices
@@ -1,25 +1,42 @@
+import io
 import pandas as pd
 from datetime import datetime, timedelta
 from .utils import calc_avg_cost
-from .price import get_close_price
-from .company import get_company_name
+from .metrics import stage
+from .price import get_close_prices
+from .price_cache import price_flag
+from .company import resolve_company_names
+from .snapshot import load_snapshot, save_snapshot
+from .engine import BUY_ACTIONS, SELL_ACTIONS, NULL_VALUES, resolve_prices
+from .lots import LOT_COLUMNS, compute_ledger_positions
 
 TODAY = datetime.today().strftime("%Y-%m-%d")
 YESTERDAY = (datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
 VALID_SELL_DATES = {TODAY, YESTERDAY}
 
+
+def valid_sell_dates(now=None):
+    """今天 / 昨天；常駐的 process（webhook）跨日後要重新算，不能用 import 時的 VALID_SELL_DATES"""
+    now = now or datetime.today()
+    return {now.strftime("%Y-%m-%d"), (now - timedelta(days=1)).strftime("%Y-%m-%d")}
+
+# 欄位依位置讀：舊 ledger 的 header 只有前 4 欄，之後 append 的列可能多了 qty, fee
+LEDGER_FIELDS = ["date", "code", "action", "value", *LOT_COLUMNS]
+
 # --------------------------------------------------------
 # 統一處理價格的函式
 # --------------------------------------------------------
-def resolve_price(code, value):
+def is_null_value(value):
+    return str(value).strip().lower() in NULL_VALUES
+
+
+def resolve_price(code, value, prices):
     """
-    若 value=null → 用收盤價
+    若 value=null → 用收盤價（由 prices 預先批次查好）
     若 value 有數字 → 用該數字
     """
-    v = str(value).strip().lower()
-
-    if v in ["null", "", "none"]:
-        close_price, _ = get_close_price(code)
+    if is_null_value(value):
+        close_price, _ = prices.get(code, (None, None))
         return close_price
 
     try:
@@ -27,96 +44,375 @@ def resolve_price(code, value):
     except:
         return None
 
-def process_trades(csv_path):
-    df = pd.read_csv(csv_path)
+
+def collect_price_codes(df):
+    """
+    在跑 ledger 之前先找出這次需要收盤價的代號：
+    - 有 null 價格的 BUY / KEEP / SELL / REDUCE
+    - 跑完之後可能仍有持倉的代號（見 maybe_open_flags）
+    """
+    maybe_open = [code for code, is_open in maybe_open_flags(df).items() if is_open]
+    return list(dict.fromkeys([*null_price_codes(df), *maybe_open]))
+
+
+def maybe_open_flags(df):
+    """
+    → {code: 最後一筆有效買賣之後是否可能仍有持倉}
+
+    「有效」與引擎相同：價格可解析或為 null、股數不是 0 / 負數；
+    引擎會略過的列（例如價格打錯的 SELL）不能當成出場，改看再前一筆。
+    最後一筆是買進、或是有股數的 SELL / REDUCE（部分出場）→ True
+    只檢查每個代號的最後一筆（被略過才往前找），不必解析整份 ledger 的價格
+    """
+    events = df[df["action"].isin(BUY_ACTIONS + SELL_ACTIONS)]
+    flags = {}
+    while len(events):
+        last = events[~events["code"].duplicated(keep="last")]
+        qtys = last["qty"].tolist() if "qty" in last.columns else [None] * len(last)
+
+        skipped = []
+        rows = zip(last.index, last["code"].tolist(), last["action"].tolist(), last["value"].tolist(), qtys)
+        for index, code, action, value, qty in rows:
+            qty = _to_float(qty)
+            if not _is_priced(value) or qty <= 0:
+                skipped.append(index)
+                continue
+            flags[code] = action in BUY_ACTIONS or qty == qty
+
+        if not skipped:
+            break
+        events = events[events["code"].isin(last.loc[skipped, "code"]) & ~events.index.isin(skipped)]
+    return flags
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _is_priced(value):
+    """null（用收盤價；typed ledger 為 NaN）或可解析為數字 → 引擎不會因為價格略過"""
+    if isinstance(value, float) or is_null_value(value):
+        return True
+    return _to_float(value) == _to_float(value)
+
+
+def null_price_codes(df):
+    """價格欄為 null（要用收盤價）的買賣代號"""
+    events = df[df["action"].isin(BUY_ACTIONS + SELL_ACTIONS)]
+    if pd.api.types.is_float_dtype(events["value"]):
+        is_null = events["value"].isna()
+    else:
+        is_null = events["value"].str.lower().isin(NULL_VALUES)
+    return list(dict.fromkeys(events.loc[is_null, "code"]))
+
+
+def read_ledger_csv(csv_path, **kwargs):
+    """跳過 header、以 LEDGER_FIELDS 命名；只有 4 欄的列 qty / fee 為 NaN"""
+    return pd.read_csv(csv_path, dtype=str, header=None, skiprows=1, names=LEDGER_FIELDS, **kwargs)
+
+
+def load_ledger(csv_path):
+    return normalize_ledger(read_ledger_csv(csv_path))
+
+
+def normalize_dates(dates):
+    """
+    ledger 的日期 → YYYY-MM-DD（與 Parquet ledger、VALID_SELL_DATES 相同）
+    webhook 寫入的是 YYYY/MM/DD，手動輸入的月日可能沒補零；無法解析的原樣保留
+    """
+    dates = dates.astype(str).str.strip().str.replace("/", "-", regex=False)
+    irregular = dates.str.len() != 10
+    if irregular.any():
+        parsed = pd.to_datetime(dates[irregular], format="%Y-%m-%d", errors="coerce").dt.strftime("%Y-%m-%d")
+        dates[irregular] = parsed.fillna(dates[irregular])
+    return dates
+
+
+def normalize_ledger(df):
     df.columns = df.columns.str.strip().str.lower()
+    df["date"] = normalize_dates(df["date"])
+    df["code"] = df["code"].astype(str).str.strip()
+    df["action"] = df["action"].astype(str).str.strip().str.lower()
+    df["value"] = df["value"].astype(str).str.strip()
+    for column in LOT_COLUMNS:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = df[column].str.strip()
+    return df
 
-    positions = {}
-    completed = []
 
-    for _, row in df.iterrows():
-        date = row["date"]
-        code = str(row["code"]).strip()
-        action = str(row["action"]).strip().lower()
-        value = str(row["value"]).strip()
+def concat_rows(*frames):
+    """
+    pd.concat，但略過空的 DataFrame、以及各自全是缺值的欄（避免 pandas 的 dtype FutureWarning）
+    例如沒有手續費的 seed 列接上舊的 4 欄 ledger
+    """
+    non_empty = [f for f in frames if len(f)]
+    if len(non_empty) <= 1:
+        return non_empty[0] if non_empty else frames[-1]
+    columns = list(dict.fromkeys(c for f in non_empty for c in f.columns))
+    trimmed = [f.dropna(axis=1, how="all") for f in non_empty]
+    return pd.concat(trimmed, ignore_index=True).reindex(columns=columns)
 
-        if code not in positions:
-            positions[code] = {"buys": []}
 
-        pos = positions[code]
+def seed_frame(open_buys):
+    """把快照中的未平倉買進還原成 ledger 列（price 已解析；lot 的股數 / 手續費原樣帶入）"""
+    rows = [
+        {
+            "date": b["date"], "code": code, "action": "buy", "value": repr(b["price"]), "price": b["price"],
+            "qty": b.get("qty"), "fee": b.get("fee"),
+        }
+        for code, buys in open_buys.items() for b in buys
+    ]
+    return pd.DataFrame(rows, columns=["date", "code", "action", "value", "price", *LOT_COLUMNS])
 
-        # --------------------------------------------------------
-        # BUY
-        # --------------------------------------------------------
-        if action == "buy":
-            price = resolve_price(code, value)
-            if price is not None:
-                pos["buys"].append({"date": date, "price": price})
-            continue
 
-        # --------------------------------------------------------
-        # KEEP → 用收盤價買進
-        # --------------------------------------------------------
-        if action == "keep":
-            price = resolve_price(code, value)
-            if price is not None:
-                pos["buys"].append({"date": date, "price": price})
-            continue
-        
-        # --------------------------------------------------------
-        # SELL / REDUCE（含 null → 用收盤價）
-        # --------------------------------------------------------
-        if action in ["sell", "reduce"]:
-            if len(pos["buys"]) == 0:
-                continue
-            
-            price = resolve_price(code, value)
-            if price is not None:
-                continue
+# --------------------------------------------------------
+# 快照的追蹤代號（tracked）
+#
+# null 價格用「當下」的收盤價，算好的未平倉 / 已實現交易每天都可能不同。
+# 這類列仍影響結果的代號只存原始列（與開始追蹤時的未平倉），
+# 報表上的已實現交易存成占位；接續時用這次的收盤價重播，結果與完整重播相同。
+# --------------------------------------------------------
+TRACKED_FIELDS = ["date", "action", "value", *LOT_COLUMNS]
+
+
+def empty_snapshot():
+    return {"codes": [], "open_buys": {}, "completed": [], "tracked": {}}
+
+
+def track_rows(tracked, df, open_buys):
+    """
+    tracked：{code: {"seed": 開始追蹤時的未平倉, "rows": [[date, action, value, qty, fee], ...]}}（就地更新）
+    df：這次要處理的列（價格尚未解析）；open_buys：處理 df 之前的未平倉
+    df 中有 null 價格的代號開始追蹤；追蹤中的代號接上 df 的列
+    """
+    for code in null_price_codes(df):
+        if code not in tracked:
+            tracked[code] = {"seed": open_buys.get(code, []), "rows": []}
+    if not tracked:
+        return
 
-            avg_cost = calc_avg_cost(pos["buys"])
-            pct = ((price - avg_cost) / avg_cost) * 100
+    part = df.loc[df["code"].isin(list(tracked)), ["code", *TRACKED_FIELDS]]
+    part = part.astype(object).where(part.notna(), None)
+    for code, *row in part.values.tolist():
+        tracked[code]["rows"].append(row)
 
-            # SELL 僅在合法日期記錄；REDUCE 全記錄
-            if date in VALID_SELL_DATES or action == "reduce":
-                completed.append({
-                    "code": code,
-                    "company": get_company_name(code),
-                    "buy_detail": pos["buys"].copy(),
-                    "sell_date": date,
-                    "avg_cost": avg_cost,
-                    "sell_price": price,
-                    "pct": pct
-                })
 
-            # 賣出後清空，重新計算新的持倉
-            positions[code]["buys"] = []
+def tracked_frame(tracked):
+    """追蹤代號的 ledger 列（開始追蹤時的未平倉在前，價格尚未解析）"""
+    seed = seed_frame({code: t["seed"] for code, t in tracked.items()}).drop(columns="price")
+    rows = pd.DataFrame(
+        [[r[0], code, *r[1:]] for code, t in tracked.items() for r in t["rows"]],
+        columns=LEDGER_FIELDS,
+    )
+    return concat_rows(seed, rows)
 
+
+def resume_tracked(snapshot, frame, prices):
+    """
+    追蹤代號用這次的收盤價重播，填回快照中已實現交易的占位
+    → (completed, open_buys, 重播出的已實現交易 id)
+    占位與重播出的筆數對不上（例如收盤價從查不到變成查得到）→ None
+    """
+    replayed, tracked_open = [], {}
+    if len(frame):
+        frame["price"] = resolve_prices(frame, prices)
+        replayed, tracked_open = compute_ledger_positions(frame, VALID_SELL_DATES)
+
+    by_code = {}
+    for t in reversed(replayed):
+        by_code.setdefault(t["code"], []).append(t)
+
+    # 快照中的已實現交易：REDUCE 全保留，SELL 只留仍在合法日期內的
+    completed = []
+    for t in snapshot["completed"]:
+        if t["action"] != "reduce" and t["sell_date"] not in VALID_SELL_DATES:
             continue
+        if t.get("replay"):
+            queue = by_code.get(t["code"])
+            if not queue:
+                return None
+            t = queue.pop()
+        completed.append(t)
+
+    if any(by_code.values()):
+        return None
+    return completed, {**snapshot["open_buys"], **tracked_open}, {id(t) for t in replayed}
+
+
+def snapshot_state(tracked, completed, open_buys, replayed, prices):
+    """
+    → 存進快照的 (open_buys, completed, tracked)
+    追蹤代號中 null 價格的列已不影響結果（已平倉、且不再列入報表）→ 停止追蹤，存算好的結果；
+    仍會影響的代號：未平倉不存，重播出的已實現交易只存占位（code / action / sell_date）
+    """
+    dates = {}
+    for code, lots in open_buys.items():
+        if code in tracked:
+            dates.setdefault(code, []).extend(lot["date"] for lot in lots)
+    for t in completed:
+        if id(t) in replayed:
+            dates.setdefault(t["code"], []).extend([t["sell_date"], *(b["date"] for b in t["buy_detail"])])
+
+    keep = {
+        code for code, t in tracked.items()
+        if _uses_close(t, dates.get(code, []), prices.get(code, (None, None))[0])
+    }
+
+    completed = [
+        {"code": t["code"], "action": t["action"], "sell_date": t["sell_date"], "replay": True}
+        if t["code"] in keep and id(t) in replayed else t
+        for t in completed
+    ]
+    open_buys = {code: lots for code, lots in open_buys.items() if code not in keep}
+    return open_buys, completed, {code: tracked[code] for code in keep}
+
+
+def _uses_close(tracked, dates, close):
+    """追蹤的 null 價格列是否仍影響結果（日期出現在未平倉 / 報表的交易中；平均成本的明細是日期區間）"""
+    null_dates = {r[0] for r in tracked["rows"] if is_null_value(r[2])}
+    if not null_dates:
+        return False
+    if close is None:
+        # 查不到收盤價的列被略過；之後查得到就會改變結果
+        return True
+    for date in dates:
+        first, _, last = date.partition("~")
+        if any(first <= d <= (last or first) for d in null_dates):
+            return True
+    return False
+
+
+def process_trades(source, price_provider=None, snapshot_path=None):
+    """→ (completed, open_positions)；source 見 replay_trades"""
+    return build_positions(*replay_trades(source, price_provider, snapshot_path))
+
+
+def replay_trades(source, price_provider=None, snapshot_path=None):
+    """
+    重播 ledger → (completed, open_buys, prices)，尚未補公司名稱 / 現價損益
+
+    source：
+    - CSV 路徑，或 ledger 內容（bytes，例如 AppendOnlyLedger.read_bytes()）
+    - typed ledger DataFrame（ParquetLedger.read_frame()），一律完整重算
+    - 回傳 binary stream 的 callable（例如 AppendOnlyLedger.open_stream）→ 串流模式
+
+    snapshot_path：接續快照，只處理快照之後的新資料與追蹤代號（null 價格仍影響結果的代號）的列，
+    結果與完整重播相同。收盤價從有變成查不到（例如下市）時，已不影響結果的 null 列不會重算
+    """
+    if callable(source):
+        from .stream import replay_trades_stream
+
+        return replay_trades_stream(source, price_provider, snapshot_path)
+
+    if isinstance(source, pd.DataFrame):
+        data, snapshot_path = None, None
+    elif isinstance(source, bytes):
+        data = source
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+
+    # --------------------------------------------------------
+    # 有可用快照 → 只處理快照之後的新資料
+    # --------------------------------------------------------
+    with stage("load_ledger"):
+        snapshot = load_snapshot(snapshot_path, data)
+        if snapshot is not None:
+            header = data[:data.find(b"\n") + 1]
+            df = load_ledger(io.BytesIO(header + data[snapshot["offset"]:]))
+
+    result = None
+    if snapshot is not None:
+        result = _replay(snapshot, df, price_provider, bool(snapshot_path))
+        if result is None:
+            print("[Snapshot] 追蹤代號的已實現交易對不上，完整重算")
+
+    if result is None:
+        with stage("load_ledger"):
+            df = source.copy() if data is None else load_ledger(io.BytesIO(data))
+        snapshot = empty_snapshot()
+        result = _replay(snapshot, df, price_provider, bool(snapshot_path))
+
+    completed, open_buys, prices, replayed = result
+
+    # 未平倉依 code 在 ledger 中首次出現的順序
+    codes = list(dict.fromkeys(snapshot["codes"] + list(df["code"].unique())))
+    open_buys = {code: open_buys[code] for code in codes if code in open_buys}
+
+    if snapshot_path:
+        with stage("save_snapshot"):
+            state = snapshot_state(snapshot["tracked"], completed, open_buys, replayed, prices)
+            save_snapshot(snapshot_path, data, codes, *state)
+
+    return completed, open_buys, prices
+
+
+def _replay(snapshot, df, price_provider, track):
+    """
+    快照狀態 + 新的列 df → (completed, open_buys, prices, 追蹤代號的已實現交易 id)
+    追蹤代號的占位對不上 → None；track=True 時就地更新 snapshot["tracked"]
+    """
+    tracked = snapshot["tracked"]
+    frame = tracked_frame(tracked)
+
+    # 先收集所有需要的代號，一次批次查收盤價
+    with stage("prices"):
+        stable = seed_frame(snapshot["open_buys"]).drop(columns="price")
+        codes_needed = collect_price_codes(concat_rows(stable, frame, df))
+        prices = get_close_prices(codes_needed, provider=price_provider)
+
+    with stage("positions"):
+        resumed = resume_tracked(snapshot, frame, prices)
+        if resumed is None:
+            return None
+        completed, open_buys, replayed = resumed
+
+        if track:
+            track_rows(tracked, df, open_buys)
+        df["price"] = resolve_prices(df, prices)
+        done, open_buys = compute_ledger_positions(concat_rows(seed_frame(open_buys), df), VALID_SELL_DATES)
+
+    replayed |= {id(t) for t in done if t["code"] in tracked}
+    return completed + done, open_buys, prices, replayed
+
+
+def build_positions(completed, open_buys, prices):
+    """已實現交易補上公司名稱、未平倉算出現價損益 → (completed, open_positions)"""
+    # 這次報表會用到的公司名稱一次解析（未知代號併發查 Yahoo）
+    with stage("names"):
+        names = resolve_company_names([t["code"] for t in completed] + list(open_buys))
+
+    completed = [
+        {"code": t["code"], "company": names[t["code"]], **t}
+        for t in completed
+    ]
 
     # --------------------------------------------------------
     # Open positions
     # --------------------------------------------------------
+    # 查不到現價的未平倉不再默默略過：列出來並標記 missing
     open_positions = []
-    for code, pos in positions.items():
-        if len(pos["buys"]) == 0:
-            continue
-
-        close_price, symbol = get_close_price(code)
-        if close_price is None:
-            continue
+    for code, buys in open_buys.items():
+        quote = prices.get(code, (None, None))
+        close_price, symbol = quote
 
-        avg_cost = calc_avg_cost(pos["buys"])
-        pct = ((close_price - avg_cost) / avg_cost) * 100
+        avg_cost = calc_avg_cost(buys)
+        pct = None if close_price is None else ((close_price - avg_cost) / avg_cost) * 100
 
         open_positions.append({
             "code": code,
-            "company": get_company_name(code),
+            "company": names[code],
             "symbol": symbol,
-            "buy_detail": pos["buys"],
+            "buy_detail": buys,
             "avg_cost": avg_cost,
             "close_price": close_price,
-            "pct": pct
+            "pct": pct,
+            "price_date": getattr(quote, "trade_date", None),
+            "price_source": getattr(quote, "source", None),
+            "price_flag": price_flag(quote),
         })
 
-    return completed, open_positions
\ No newline at end of file
+    return completed, open_positions
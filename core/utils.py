@@ -1,2 +1,8 @@
 def calc_avg_cost(buys):
-    return sum(b["price"] for b in buys) / len(buys)
\ No newline at end of file
+    # 舊的 buy_detail 沒有股數 / 手續費：每筆 1 單位（維持原本的算法，結果逐位元相同）
+    if not any("fee" in b for b in buys):
+        return sum(b["price"] for b in buys) / len(buys)
+
+    qty = sum(b.get("qty", 1.0) for b in buys)
+    cost = sum(b["price"] * b.get("qty", 1.0) + b.get("fee", 0.0) for b in buys)
+    return cost / qty
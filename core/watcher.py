@@ -0,0 +1,337 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .metrics import external, inc, observe, stage
+from .price import default_policy
+from .price_cache import TAIPEI, is_trading_day
+from .utils import calc_avg_cost
+
+# 盤中輪詢間隔（秒）：每個間隔所有未平倉代號只查一次
+POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "30"))
+
+# 預設停利 / 停損（相對均價的 %），個別代號可在 WATCH_THRESHOLDS 的 JSON 覆寫
+TAKE_PROFIT = float(os.getenv("WATCH_TAKE_PROFIT", "10"))
+STOP_LOSS = float(os.getenv("WATCH_STOP_LOSS", "-8"))
+THRESHOLDS_PATH = os.getenv("WATCH_THRESHOLDS", os.path.join("data", "watch_thresholds.json"))
+
+# 同一代號同一種提醒：價格回到門檻內 REARM % 以上、且距離上次提醒 COOLDOWN 秒以上，才會再提醒
+REARM_PCT = float(os.getenv("WATCH_REARM_PCT", "1"))
+COOLDOWN = float(os.getenv("WATCH_COOLDOWN", "1800"))
+
+# TWSE 盤中時段
+MARKET_OPEN = (9, 0)
+MARKET_CLOSE = (13, 30)
+
+# MIS 即時報價一次 request 查幾檔（URL 長度）
+MIS_URL = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+MIS_BATCH = int(os.getenv("TWSE_MIS_BATCH", "50"))
+
+TAKE, STOP = "take_profit", "stop_loss"
+
+
+# --------------------------------------------------------
+# 盤中時段
+# --------------------------------------------------------
+def _at(day, hm):
+    return datetime(day.year, day.month, day.day, *hm, tzinfo=TAIPEI)
+
+
+def is_market_open(now=None):
+    now = (now or datetime.now(TAIPEI)).astimezone(TAIPEI)
+    return is_trading_day(now.date()) and _at(now, MARKET_OPEN) <= now < _at(now, MARKET_CLOSE)
+
+
+def next_market_open(now=None):
+    """now 之後（含）最近一次開盤；盤中回傳 now"""
+    now = (now or datetime.now(TAIPEI)).astimezone(TAIPEI)
+    if is_market_open(now):
+        return now
+    day = now.date()
+    while True:
+        if is_trading_day(day) and _at(day, MARKET_OPEN) >= now:
+            return _at(day, MARKET_OPEN)
+        day += timedelta(days=1)
+
+
+# --------------------------------------------------------
+# 即時報價來源
+#
+# 介面：get_quotes(codes) → {code: 最新成交價 | None}
+# 一次呼叫就是這個間隔的整批輪詢
+# --------------------------------------------------------
+class TWSEQuoteFeed:
+    """
+    證交所 MIS 即時報價：一次 request 查多檔（上市 tse_ / 上櫃 otc_ 都帶，查不到的不會回傳）
+    沒有成交價（z 為 "-"）時用最佳買價，再沒有用昨收
+    所有 request 共用一個 Session 與 twse_mis 的 rate limit
+    """
+
+    def __init__(self, policy=None, batch=MIS_BATCH):
+        import requests
+
+        self.session = requests.Session()
+        self.policy = policy or default_policy("twse_mis")
+        self.batch = batch
+
+    def get_quotes(self, codes):
+        codes = [str(c) for c in dict.fromkeys(codes)]
+        quotes = dict.fromkeys(codes)
+        for i in range(0, len(codes), self.batch):
+            chunk = codes[i:i + self.batch]
+            channels = "|".join(f"{market}_{code}.tw" for code in chunk for market in ("tse", "otc"))
+            for row in self.policy.call(self._fetch, channels):
+                if row.get("c") in quotes:
+                    quotes[row["c"]] = _mis_price(row)
+        return quotes
+
+    def _fetch(self, channels):
+        with external("twse", "mis_quotes"):
+            response = self.session.get(MIS_URL, params={"ex_ch": channels, "json": 1, "delay": 0}, timeout=10)
+        response.raise_for_status()
+        return response.json().get("msgArray", [])
+
+
+def _mis_price(row):
+    for value in (row.get("z"), (row.get("b") or "").split("_")[0], row.get("y")):
+        try:
+            price = float(value)
+        except (TypeError, ValueError):
+            continue
+        if price > 0:
+            return price
+    return None
+
+
+class SimulatedQuoteFeed:
+    """
+    離線的模擬報價（測試 / benchmark）：每次輪詢各代號做一步隨機漫步
+    moves={code: [價格, ...]} 指定時依序回傳（腳本化的情境）
+    """
+
+    def __init__(self, prices, volatility=0.01, moves=None, seed=0, latency=0.0):
+        self.prices = {str(k): float(v) for k, v in prices.items()}
+        self.volatility = volatility
+        self.moves = {str(k): list(v) for k, v in (moves or {}).items()}
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.calls = 0
+
+    def get_quotes(self, codes):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        quotes = {}
+        for code in map(str, codes):
+            if self.moves.get(code):
+                self.prices[code] = float(self.moves[code].pop(0))
+            elif code in self.prices:
+                self.prices[code] *= 1 + self.random.gauss(0, self.volatility)
+            quotes[code] = self.prices.get(code)
+        return quotes
+
+
+# --------------------------------------------------------
+# 門檻設定
+# --------------------------------------------------------
+def load_thresholds(path=THRESHOLDS_PATH):
+    """
+    {"2330": {"take_profit": 15, "stop_loss": -5}, ...}（%；只寫一個也可以）
+    檔案不存在 → 全部用預設值
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {str(k): v for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+# ============================================================
+# 盤中停利 / 停損監控
+#
+# - 持倉來自 LivePortfolio（與 process_trades 相同的重播；ledger 有新寫入才重新載入）
+# - 均價與停利 / 停損價位在持倉變動時算一次，存成依代號排列的 numpy 陣列
+# - 每個間隔：一次批次查價（MIS 每 MIS_BATCH 檔一個 request）→ 陣列比較，找出觸及門檻的代號
+#   每檔每次輪詢只有組價格陣列的一次 dict 查找，比較與 debounce 都是向量化的
+# - debounce：觸發後停用該提醒，價格回到門檻內 REARM_PCT % 以上才重新啟用，
+#   且同一提醒 COOLDOWN 秒內不重複
+# ============================================================
+class PositionWatcher:
+    def __init__(self, portfolio, feed, thresholds=None, notify=None,
+                 interval=POLL_INTERVAL, rearm_pct=REARM_PCT, cooldown=COOLDOWN, clock=time.time):
+        self.portfolio = portfolio
+        self.feed = feed
+        self.thresholds = load_thresholds() if thresholds is None else thresholds
+        self.notify = notify or _push_alerts
+        self.interval = interval
+        self.rearm = rearm_pct / 100
+        self.cooldown = cooldown
+        self.clock = clock
+
+        self.version = None
+        self.codes = []
+        self.avg_cost = self.take = self.stop = np.empty(0)
+        # [代號, 提醒種類]：可以提醒 / 上次提醒的時間
+        self.armed = np.ones((0, 2), dtype=bool)
+        self.alerted_at = np.full((0, 2), -np.inf)
+        self.polls = 0
+        self.alerts = 0
+
+    # ---- 持倉 → 價位 ----
+    def update_levels(self):
+        """ledger 有變動才重算均價 / 門檻價位；已存在的代號保留 debounce 狀態"""
+        version, open_buys = self.portfolio.holdings()
+        if version == self.version:
+            return False
+
+        codes = list(open_buys)
+        avg_cost = np.array([calc_avg_cost(open_buys[c]) for c in codes], dtype=float)
+        take_pct = np.array([self.thresholds.get(c, {}).get(TAKE, TAKE_PROFIT) for c in codes], dtype=float)
+        stop_pct = np.array([self.thresholds.get(c, {}).get(STOP, STOP_LOSS) for c in codes], dtype=float)
+
+        previous = {code: i for i, code in enumerate(self.codes)}
+        keep = np.array([previous.get(c, -1) for c in codes], dtype=int)
+        armed = np.ones((len(codes), 2), dtype=bool)
+        alerted_at = np.full((len(codes), 2), -np.inf)
+        if len(keep) and len(self.codes):
+            known = keep >= 0
+            armed[known] = self.armed[keep[known]]
+            alerted_at[known] = self.alerted_at[keep[known]]
+
+        self.codes = codes
+        self.avg_cost = avg_cost
+        self.take = avg_cost * (1 + take_pct / 100)
+        self.stop = avg_cost * (1 + stop_pct / 100)
+        self.armed, self.alerted_at = armed, alerted_at
+        self.version = version
+        print(f"[Watch] {len(codes)} open positions")
+        return True
+
+    # ---- 一次輪詢 ----
+    def poll(self):
+        """→ 這次觸發的提醒 [{code, kind, price, avg_cost, pct, level}, ...]"""
+        self.update_levels()
+        if not self.codes:
+            return []
+
+        with stage("watch_quotes"):
+            quotes = self.feed.get_quotes(self.codes)
+        self.polls += 1
+
+        start = time.perf_counter()
+        prices = np.array([quotes.get(c) for c in self.codes], dtype=float)
+        alerts = self.evaluate(prices, self.clock())
+        observe("watch_evaluate_seconds", time.perf_counter() - start)
+
+        if alerts:
+            self.alerts += len(alerts)
+            inc("watch_alerts_total", len(alerts))
+            self.notify(alerts)
+        return alerts
+
+    def evaluate(self, prices, now):
+        """prices 與 self.codes 同順序（查不到為 nan）→ 觸發的提醒，並更新 debounce 狀態"""
+        with np.errstate(invalid="ignore"):
+            hit = np.stack([prices >= self.take, prices <= self.stop], axis=1)
+            # 回到門檻內一段距離 → 重新啟用
+            back = np.stack([prices < self.take * (1 - self.rearm), prices > self.stop * (1 + self.rearm)], axis=1)
+
+        self.armed |= back
+        fire = hit & self.armed & (now - self.alerted_at >= self.cooldown)
+        self.armed &= ~fire
+        self.alerted_at[fire] = now
+
+        alerts = []
+        for i, k in zip(*np.nonzero(fire)):
+            alerts.append({
+                "code": self.codes[i],
+                "kind": (TAKE, STOP)[k],
+                "price": float(prices[i]),
+                "avg_cost": float(self.avg_cost[i]),
+                "pct": float((prices[i] - self.avg_cost[i]) / self.avg_cost[i] * 100),
+                "level": float((self.take, self.stop)[k][i]),
+            })
+        return alerts
+
+    # ---- 常駐 ----
+    def run(self, stop=None, now=None):
+        """
+        盤中每 interval 秒輪詢一次（對齊間隔，輪詢本身的時間不會累積誤差）；
+        收盤後睡到下一次開盤。stop（threading.Event）被設定時結束
+        """
+        stop = stop or threading.Event()
+        now = now or (lambda: datetime.now(TAIPEI))
+
+        while not stop.is_set():
+            current = now()
+            if not is_market_open(current):
+                wait = (next_market_open(current) - current).total_seconds()
+                print(f"[Watch] Market closed, sleeping {wait / 3600:.1f} h")
+                stop.wait(wait)
+                continue
+
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                # 資料源暫時失敗：下一個間隔再試
+                print(f"[Watch ERROR] {e}")
+            stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+# --------------------------------------------------------
+# 提醒訊息
+# --------------------------------------------------------
+def format_alerts(alerts):
+    from .company import resolve_company_names
+
+    names = resolve_company_names([a["code"] for a in alerts])
+    lines = ["🔔 盤中提醒"]
+    for a in alerts:
+        label = "觸及停利" if a["kind"] == TAKE else "觸及停損"
+        lines.append(
+            f"{a['code']} {names[a['code']]} {label} {a['pct']:+.2f}%"
+            f"（現價 {a['price']:.2f} / 均價 {a['avg_cost']:.2f} / 門檻 {a['level']:.2f}）"
+        )
+    return "\n".join(lines)
+
+
+def _push_alerts(alerts):
+    """同一次輪詢的提醒合併成一則 push"""
+    from notify.push_bot import push_message
+
+    push_message(format_alerts(alerts))
+
+
+# ============================================================
+# CLI：python -m core.watcher [gcs|local] [--simulate]
+# ============================================================
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    from storage.ledger import open_ledger
+
+    from .live import LivePortfolio
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    portfolio = LivePortfolio(open_ledger(args[0] if args else None))
+
+    if "--simulate" in sys.argv:
+        # 模擬報價：從目前持倉的均價開始隨機漫步，不看盤中時段
+        _, open_buys = portfolio.holdings()
+        feed = SimulatedQuoteFeed({c: calc_avg_cost(b) for c, b in open_buys.items()}, volatility=0.02)
+        watcher = PositionWatcher(portfolio, feed, notify=lambda alerts: print(format_alerts(alerts)), interval=1)
+        while True:
+            watcher.poll()
+            time.sleep(watcher.interval)
+
+    PositionWatcher(portfolio, TWSEQuoteFeed()).run()
@@ -1,11 +1,25 @@
+"""
+證交所 / 櫃買中心匯出的股票清單 CSV → data/company_names.json + 台股代號索引（core.stock_index）
+
+    python -m data.get_stock_list StockList1.csv StockList.csv
+
+CSV 依序讀入，後面的覆蓋前面的；CSV 內容都沒變時不重寫 JSON、不重建索引
+"""
+import argparse
 import csv
 import json
-import re
+import os
+
+from core.stock_index import CODE_PATTERN, INDEX_PATH, SOURCE_PATH, build_index, sources_fingerprint
 
 FILES = ["StockList1.csv", "StockList.csv"]
-OUTPUT = "company_names.json"
+OUTPUT = SOURCE_PATH
+
+# 代號 / 名稱欄位可能的名稱（上市、上櫃、ISIN 清單的匯出格式不同）
+CODE_COLUMNS = ["代號", "證券代號", "股票代號"]
+NAME_COLUMNS = ["名稱", "證券名稱", "股票名稱"]
+COMBINED_COLUMN = "有價證券代號及名稱"
 
-company_dict = {}
 
 def normalize(col: str):
     """移除 BOM、空白、雙引號"""
@@ -21,60 +35,115 @@ def clean_code(raw_code: str):
     if raw_code.startswith("=\"") and raw_code.endswith("\""):
         raw_code = raw_code[2:-1]
 
-    return normalize(raw_code)
+    return normalize(raw_code).upper()
 
 
 def is_valid_stock_code(code: str):
-    """只接受4位數字股票代號"""
-    return bool(re.fullmatch(r"\d{4}", code))
+    """股票 / 特別股 / ETF / 權證：4 碼數字 + 最多 2 碼數字或英文（2330、00878、00632R、030001、03001P）"""
+    return bool(CODE_PATTERN.fullmatch(code))
+
+
+def _column(header, candidates):
+    for name in candidates:
+        if name in header:
+            return header.index(name)
+    return None
 
 
-def process_csv(file):
+def read_stock_csv(file):
+    """→ {code: name}；找不到檔案 / 欄位時回傳空 dict"""
     print(f"Parsing {file} ...")
+    names = {}
 
     try:
-        with open(file, "r", encoding="utf-8") as f:
+        with open(file, "r", encoding="utf-8-sig") as f:
             reader = csv.reader(f)
 
             header = next(reader, None)
             if not header:
                 print("⚠ 無法讀取 header")
-                return
+                return names
 
             # 正規化欄位名稱（移除 BOM + 雙引號）
             header = [normalize(h) for h in header]
 
-            # 尋找欄位 index
-            try:
-                code_idx = header.index("代號")
-                name_idx = header.index("名稱")
-            except ValueError:
+            code_idx = _column(header, CODE_COLUMNS)
+            name_idx = _column(header, NAME_COLUMNS)
+            combined_idx = _column(header, [COMBINED_COLUMN])
+            if (code_idx is None or name_idx is None) and combined_idx is None:
                 print("⚠ 找不到欄位：代號 / 名稱")
                 print("header =", header)
-                return
+                return names
 
-            # 處理每一列
             for row in reader:
-                if len(row) <= max(code_idx, name_idx):
-                    continue
-
-                raw_code = clean_code(row[code_idx])
-                name = normalize(row[name_idx])
-
-                if is_valid_stock_code(raw_code):
-                    company_dict[raw_code] = name
+                if code_idx is not None and name_idx is not None:
+                    if len(row) <= max(code_idx, name_idx):
+                        continue
+                    code, name = clean_code(row[code_idx]), normalize(row[name_idx])
+                else:
+                    # ISIN 清單：「2330　台積電」（全形空白分隔）
+                    if len(row) <= combined_idx:
+                        continue
+                    code, _, name = normalize(row[combined_idx]).replace("　", " ").partition(" ")
+                    code, name = clean_code(code), name.strip()
+
+                if name and is_valid_stock_code(code):
+                    names[code] = name
 
     except FileNotFoundError:
         print(f"⚠ 找不到檔案：{file}")
 
+    return names
+
+
+def build_stock_list(files=FILES, output=OUTPUT, index_path=INDEX_PATH, force=False):
+    """
+    CSV → JSON（排序、compact）→ 索引
+    → 是否重新產生；CSV 指紋與上次相同時不動
+    """
+    fingerprint = sources_fingerprint(files)
+    stamp = f"{output}.sources"
+    if not force and os.path.exists(output) and _read_stamp(stamp) == fingerprint:
+        print("CSV 沒有變動，略過")
+        return False
+
+    company_dict = {}
+    for f in files:
+        company_dict.update(read_stock_csv(f))
+
+    if not company_dict:
+        print("⚠ 沒有讀到任何代號，保留原本的清單")
+        return False
+
+    tmp_path = f"{output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as outfile:
+        json.dump(dict(sorted(company_dict.items())), outfile, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, output)
+    # 記錄這次的 CSV 指紋，下次沒變就略過
+    with open(stamp, "w", encoding="utf-8") as f:
+        f.write(fingerprint)
+
+    print("\nSaved:", output)
+    print("Total companies:", len(company_dict))
+
+    build_index([output], index_path)
+    return True
+
+
+def _read_stamp(stamp):
+    try:
+        with open(stamp, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
 
-# 主流程
-for f in FILES:
-    process_csv(f)
 
-# 輸出
-with open(OUTPUT, "w", encoding="utf-8") as outfile:
-    json.dump(company_dict, outfile, ensure_ascii=False, indent=2)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="股票清單 CSV → company_names.json + 代號索引")
+    parser.add_argument("files", nargs="*", default=FILES)
+    parser.add_argument("--output", default=OUTPUT)
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
 
-print("\nSaved:", OUTPUT)
-print("Total companies:", len(company_dict))
\ No newline at end of file
+    build_stock_list(args.files, args.output, args.index, args.force)
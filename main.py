@@ -2,42 +2,186 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from core.trade_parser import process_trades
-from report.formatter import print_report, format_report
-from notify.push_bot import push_message
+from concurrent.futures import ThreadPoolExecutor
+from core.trade_parser import TODAY, replay_trades, build_positions
+from core.price_cache import last_close_date
+from core.price import flush_price_cache
+from core.company import flush_company_cache
+from core.metrics import stage, log_summary
+from report.formatter import format_report, render_all
+from report.model import ReportCache, fingerprint
+from notify.push_bot import push_message, push_messages
+from storage.ledger import open_backend, open_ledger, list_portfolios
 
 # 新增：如果在 GCP，會使用 gcs_csv 讀取雲端檔案
 USE_GCS = os.getenv("USE_GCS", "false").lower() == "true"
 
 if USE_GCS:
-    from storage.gcs_csv import download_csv_from_gcs
-    CSV_PATH = "/tmp/trades.csv"   # Cloud Run Job 寫入位置
+    from storage.gcs_csv import download_csv_from_gcs, upload_file_to_gcs
+    SNAPSHOT_PATH = "/tmp/positions.snapshot.json"   # Cloud Run Job 寫入位置
 else:
-    CSV_PATH = "data/trades.csv"   # 本地環境使用
+    SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", ".cache/positions.snapshot.json")
+
+SNAPSHOT_BLOB = os.getenv("GCS_SNAPSHOT_PATH", "positions.snapshot.json")
+
+# LEDGER_STREAM=true → 分塊串流讀 ledger（大 ledger / 小記憶體的 Cloud Run instance）
+LEDGER_STREAM = os.getenv("LEDGER_STREAM", "false").lower() == "true"
+
+# MULTI_PORTFOLIO=true → 每個 LINE 使用者各自的 ledger（portfolios/<user_id>/），報表推給各自的使用者
+MULTI_PORTFOLIO = os.getenv("MULTI_PORTFOLIO", "false").lower() == "true"
+
+# ENABLE_ANALYTICS=true → 另外算逐日權益曲線（摘要印在 log，曲線存成 CSV）
+ENABLE_ANALYTICS = os.getenv("ENABLE_ANALYTICS", "false").lower() == "true"
+ANALYTICS_PATH = os.getenv("ANALYTICS_PATH", "/tmp/equity_curve.csv" if USE_GCS else ".cache/equity_curve.csv")
+ANALYTICS_BLOB = os.getenv("GCS_ANALYTICS_PATH", "equity_curve.csv")
+
+# 報表的 compact JSON 版本（其他服務讀這份，不必重跑）
+REPORT_JSON_PATH = os.getenv("REPORT_JSON_PATH", "/tmp/report.json" if USE_GCS else ".cache/report.json")
+REPORT_JSON_BLOB = os.getenv("GCS_REPORT_JSON_PATH", "report.json")
 
 
 def load_csv():
+    """
+    每晚的 Job 同時負責 compaction：先把 webhook 寫入的 pending segments
+    合併進 base，再讀 base + 剩下（compaction 之後才進來）的 segments
+    """
+    ledger = open_ledger("gcs" if USE_GCS else "local")
+
     if USE_GCS:
         bucket = os.getenv("GCS_BUCKET")
-        blob = os.getenv("GCS_CSV_PATH", "trades.csv")
+        print(f"[INFO] Loading ledger from gs://{bucket}/{ledger.base}")
+        # 快照不存在也沒關係 → 完整重算
+        download_csv_from_gcs(bucket, SNAPSHOT_BLOB, SNAPSHOT_PATH)
+    else:
+        print(f"[INFO] Using local ledger: data/{ledger.base}")
 
-        print(f"[INFO] Downloading csv from gs://{bucket}/{blob}")
+    return read_ledger(ledger)
 
-        try:
-            download_csv_from_gcs(bucket, blob, CSV_PATH)
-        except Exception as e:
-            print(f"[ERROR] 無法從 GCS 讀取 CSV：{e}")
-            # 不讓 Job 卡住
-            return
-    else:
-        print(f"[INFO] Using local CSV: {CSV_PATH}")
 
+def read_ledger(ledger, stream=LEDGER_STREAM):
+    try:
+        ledger.compact()
+    except Exception as e:
+        # 不讓 Job 卡住，未合併的 segments 一樣會被讀進來
+        print(f"[ERROR] Ledger compaction 失敗：{e}")
 
-if __name__ == "__main__":
-    load_csv()  # 先確保 CSV 正確讀取
+    # LEDGER_FORMAT=parquet → typed DataFrame（不需要再逐欄 parse）
+    if hasattr(ledger, "read_frame"):
+        return ledger.read_frame()
+    # 串流模式回傳 open_stream，process_trades 會邊讀邊算
+    if stream:
+        return ledger.open_stream
+    return ledger.read_bytes()
+
+
+def load_portfolios():
+    """→ {user_id: ledger 內容}；各 portfolio 的 compaction + 下載以 thread 併發"""
+    backend = open_backend("gcs" if USE_GCS else "local")
+    user_ids = list_portfolios(backend)
+    print(f"[INFO] {len(user_ids)} portfolios")
+
+    ledgers = [open_ledger(backend, user_id=user_id) for user_id in user_ids]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        # portfolio 要送進 process pool → 一律讀成 bytes（不用串流）
+        return dict(zip(user_ids, pool.map(lambda l: read_ledger(l, stream=False), ledgers)))
+
+
+def run_portfolios():
+    # process pool 版的重播只有 MULTI_PORTFOLIO 才用到
+    from core.portfolios import process_portfolios
+
+    with stage("load_csv"):
+        ledgers = load_portfolios()
+
+    with stage("process_trades"):
+        results = process_portfolios(ledgers)
+
+    with stage("format_report"):
+        reports = [(user_id, format_report(*results[user_id])) for user_id in ledgers]
+
+    with stage("push_message"):
+        push_messages(reports)
+
+
+def upload_snapshot():
+    if USE_GCS and os.path.exists(SNAPSHOT_PATH):
+        upload_file_to_gcs(os.getenv("GCS_BUCKET"), SNAPSHOT_BLOB, SNAPSHOT_PATH)
+
+
+def run_analytics(data):
+    from core.analytics import equity_curve, summarize, format_summary
 
-    completed, open_positions = process_trades(CSV_PATH)
-    text = format_report(completed, open_positions)
+    try:
+        curve = equity_curve(data)
+    except Exception as e:
+        # 權益曲線只是附加資訊，不影響每日報表
+        print(f"[ERROR] Analytics 失敗：{e}")
+        return
+
+    print(format_summary(summarize(curve)))
+    os.makedirs(os.path.dirname(ANALYTICS_PATH) or ".", exist_ok=True)
+    curve.to_csv(ANALYTICS_PATH, float_format="%.4f")
+    if USE_GCS:
+        upload_file_to_gcs(os.getenv("GCS_BUCKET"), ANALYTICS_BLOB, ANALYTICS_PATH)
+
+
+def render_report(completed, open_buys, prices):
+    """
+    → {"console", "line", "json"}
+    沒有新交易、報價也沒變（同一天重跑）時直接用快取，略過公司名稱解析與排版
+    """
+    cache = ReportCache()
+    key = fingerprint(completed, open_buys, prices, f"{TODAY}/{last_close_date()}")
+
+    outputs = cache.get(key)
+    if outputs is not None:
+        print("[Report] Cache hit, skip rendering")
+        return outputs
+
+    with stage("build_positions"):
+        completed, open_positions = build_positions(completed, open_buys, prices)
+
+    with stage("format_report"):
+        outputs = render_all(completed, open_positions, as_of=TODAY)
+
+    cache.put(key, outputs)
+    return outputs
+
+
+def write_report_json(text):
+    os.makedirs(os.path.dirname(REPORT_JSON_PATH) or ".", exist_ok=True)
+    with open(REPORT_JSON_PATH, "w", encoding="utf-8") as f:
+        f.write(text)
+    if USE_GCS:
+        upload_file_to_gcs(os.getenv("GCS_BUCKET"), REPORT_JSON_BLOB, REPORT_JSON_PATH)
+
+
+def run():
+    with stage("load_csv"):
+        data = load_csv()  # 先確保 CSV 正確讀取
+
+    with stage("process_trades"):
+        completed, open_buys, prices = replay_trades(data, snapshot_path=SNAPSHOT_PATH)
+    upload_snapshot()
+
+    outputs = render_report(completed, open_buys, prices)
+    print(outputs["console"])
+    write_report_json(outputs["json"])
+
+    with stage("push_message"):
+        push_message(outputs["line"])
+
+    if ENABLE_ANALYTICS:
+        with stage("analytics"):
+            run_analytics(data)
+
+
+if __name__ == "__main__":
+    if MULTI_PORTFOLIO:
+        run_portfolios()
+    else:
+        run()
 
-    print_report(completed, open_positions)
-    push_message(text)
\ No newline at end of file
+    flush_price_cache()
+    flush_company_cache()
+    log_summary()
\ No newline at end of file
@@ -0,0 +1,264 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.metrics import external, inc, retry, span
+from core.ratelimit import get_bucket
+
+LINE_API = os.getenv("LINE_API_BASE", "https://api.line.me")
+PATHS = {
+    "push": "/v2/bot/message/push",
+    "multicast": "/v2/bot/message/multicast",
+}
+
+# 每次 HTTP 呼叫的 timeout（連線, 讀取）與重試
+TIMEOUT = (float(os.getenv("LINE_CONNECT_TIMEOUT", "3")), float(os.getenv("LINE_TIMEOUT", "10")))
+RETRIES = int(os.getenv("LINE_RETRIES", "3"))
+BACKOFF = float(os.getenv("LINE_BACKOFF", "0.5"))
+# Retry-After 超過這個秒數就不在這次執行裡等，直接進 outbox
+MAX_RETRY_WAIT = float(os.getenv("LINE_MAX_RETRY_WAIT", "30"))
+
+# 連線池大小（同時送出的 push 數，對應 push_bot.MAX_WORKERS）
+POOL_SIZE = int(os.getenv("LINE_POOL_SIZE", "16"))
+
+# Messaging API 每秒上限約 2000 次（push / multicast 共用）
+RATE = float(os.getenv("LINE_RATE", "1000"))
+
+# LINE_OUTBOX=false → 失敗的 push 不保存
+OUTBOX = os.getenv("LINE_OUTBOX", "true").lower() == "true"
+OUTBOX_PREFIX = "line_outbox/"
+
+# 可重試：rate limit / LINE 端錯誤；其他 4xx（token 錯誤、格式錯誤）重送也不會成功
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+# ============================================================
+# LINE Messaging API 的送出端
+#
+# - 共用一個 Session（keep-alive 連線池），每次呼叫都有 timeout
+# - 429 / 5xx / 連線錯誤 → 指數 backoff + jitter 重試；有 Retry-After 時照它等，
+#   且同一個 client 的其他執行緒也一起暫停（不會一起再撞一次 rate limit）
+# - 同一個 request 的重試帶同一個 X-Line-Retry-Key：
+#   LINE 已經收過的會回 409，不會重複推播
+# - 重試用完仍失敗 → 存進 outbox（ledger 的 backend，line_outbox/），
+#   下一次執行（或同一個 process 的下一次 push）先送出 outbox
+# ============================================================
+def retry_after(response):
+    """Retry-After（秒數或 HTTP 日期）→ 秒；沒有或格式錯誤 → None"""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LineOutbox:
+    """失敗的 request 一個物件（create-only），送出成功才刪除；多個 Job 同時 drain 也不會互相覆蓋"""
+
+    def __init__(self, backend, prefix=OUTBOX_PREFIX):
+        self.backend = backend
+        self.prefix = prefix
+        # 這個 process 放進 outbox 之後還沒 drain 過
+        self.dirty = False
+
+    def put(self, op, body, retry_key, status=None):
+        name = f"{self.prefix}{time.strftime('%Y%m%d%H%M%S', time.gmtime())}-{retry_key}.json"
+        entry = {"op": op, "body": body, "retry_key": retry_key, "status": status, "queued_at": time.time()}
+        self.backend.write(name, json.dumps(entry, ensure_ascii=False).encode("utf-8"), if_generation_match=0)
+        self.dirty = True
+        inc("line_outbox_total", op=op)
+        return name
+
+    def entries(self):
+        """→ [(name, entry), ...]，依放入的時間排序"""
+        entries = []
+        for name in sorted(self.backend.list(self.prefix)):
+            obj = self.backend.read(name, with_metadata=False)
+            if obj is None:
+                continue  # 其他 Job 已經送出
+            entries.append((name, json.loads(obj.data)))
+        return entries
+
+    def delete(self, name):
+        self.backend.delete(name)
+
+
+class LineClient:
+    def __init__(self, token, base_url=None, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 max_retry_wait=MAX_RETRY_WAIT, pool_size=POOL_SIZE, rate=RATE, outbox=None):
+        self.base_url = (base_url or LINE_API).rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_wait = max_retry_wait
+        self.bucket = get_bucket("line", rate) if rate else None
+        self.outbox = outbox
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}",
+        })
+
+        # 收到 Retry-After → 到這個時間之前所有執行緒都先等
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failed": 0, "outboxed": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _wait_turn(self):
+        while True:
+            with self._lock:
+                wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def _post(self, op, data, retry_key):
+        """一次 HTTP 呼叫 → (status, response)；連線錯誤 / timeout → (None, None)"""
+        self._wait_turn()
+        self._count("requests")
+        try:
+            with external("line", op):
+                response = self.session.post(
+                    self.base_url + PATHS[op], data=data,
+                    headers={"X-Line-Retry-Key": retry_key}, timeout=self.timeout,
+                )
+        except requests.RequestException as e:
+            print(f"[LINE ERROR] {op}: {e}")
+            return None, None
+        if response.status_code >= 400 and response.status_code != 409:
+            inc("external_call_errors_total", service="line", op=op)
+        return response.status_code, response
+
+    def send(self, op, body, retry_key=None, queue=True):
+        """
+        op = push / multicast → status code（連線失敗為 None）
+        409 代表同一個 retry key LINE 已經收過 → 視為成功
+        queue=False：失敗時不放進 outbox（drain 時用）
+        """
+        retry_key = retry_key or str(uuid.uuid4())
+        data = json.dumps(body).encode("utf-8")
+
+        with span("line_delivery", op=op):
+            for attempt in range(self.retries + 1):
+                status, response = self._post(op, data, retry_key)
+                if status is not None and (status < 400 or status == 409):
+                    return status
+                if status is not None and status not in RETRY_STATUS:
+                    print(f"[LINE ERROR] {op} → {status} {response.text[:200]}")
+                    self._count("failed")
+                    return status
+
+                wait = retry_after(response)
+                if wait is not None:
+                    if wait > self.max_retry_wait:
+                        print(f"[LINE] {op} → {status}, Retry-After {wait:.0f}s 超過 {self.max_retry_wait:.0f}s，不等")
+                        break
+                    self._pause(wait)
+                else:
+                    wait = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                if attempt == self.retries:
+                    break
+
+                retry("line", op)
+                self._count("retries")
+                time.sleep(wait)
+
+        self._count("failed")
+        if queue and self.outbox is not None:
+            try:
+                self.outbox.put(op, body, retry_key, status)
+                self._count("outboxed")
+                print(f"[LINE] {op} → {status}，放進 outbox（下次執行重送）")
+            except Exception as e:
+                print(f"[LINE ERROR] outbox write failed: {e}")
+        return status
+
+    def drain_outbox(self):
+        """送出 outbox 裡之前失敗的 request → (送出, 仍失敗)；LINE 拒絕（4xx）的也刪除，不再重送"""
+        if self.outbox is None:
+            return 0, 0
+        self.outbox.dirty = False
+
+        sent = failed = 0
+        for name, entry in self.outbox.entries():
+            status = self.send(entry["op"], entry["body"], entry["retry_key"], queue=False)
+            if status is not None and status not in RETRY_STATUS:
+                self.outbox.delete(name)
+                sent += status < 400 or status == 409
+                continue
+            failed += 1
+            self.outbox.dirty = True
+
+        if sent or failed:
+            inc("line_outbox_drained_total", sent)
+            print(f"[LINE] Outbox: {sent} sent, {failed} still pending")
+        return sent, failed
+
+    def close(self):
+        self.session.close()
+
+
+# --------------------------------------------------------
+# Module-level client（同一個 token 共用連線池）
+# --------------------------------------------------------
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def open_outbox(backend=None):
+    """LINE_OUTBOX=false → None；outbox 與 ledger 放在同一個 backend（LEDGER_BACKEND / GCS_BUCKET）"""
+    if not OUTBOX:
+        return None
+    from storage.ledger import open_backend
+
+    return LineOutbox(open_backend(backend))
+
+
+def get_client(token):
+    """第一次取得時先 drain outbox（上一次執行失敗的 push）"""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is not None:
+            return client
+        client = _clients[token] = LineClient(token, outbox=open_outbox())
+
+    try:
+        client.drain_outbox()
+    except Exception as e:
+        print(f"[LINE ERROR] outbox drain failed: {e}")
+    return client
+
+
+def reset_clients():
+    """測試 / benchmark 用：關掉連線池、換新的設定"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
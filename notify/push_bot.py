@@ -1,26 +1,130 @@
-import requests
-import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-def push_message(text: str):
+from notify.line_client import get_client
+
+# multicast 一次最多 500 個收件者
+MULTICAST_LIMIT = 500
+
+# 一則文字訊息最多 5000 字、一次 request 最多 5 則訊息
+MAX_TEXT_LENGTH = 5000
+MESSAGES_PER_REQUEST = 5
+
+# 同時送出的 push 數
+MAX_WORKERS = int(os.getenv("LINE_PUSH_WORKERS", "8"))
+
+
+def _ok(status):
+    return status is not None and (status < 400 or status == 409)
+
+
+def _client(token):
+    """共用連線池的 LineClient；這個 process 有放進 outbox 的 → 先重送"""
+    client = get_client(token)
+    if client.outbox is not None and client.outbox.dirty:
+        client.drain_outbox()
+    return client
+
+
+def split_text(text, limit=MAX_TEXT_LENGTH):
+    """長報表依行切成不超過 limit 字的段落（單行超過 limit 才硬切）"""
+    chunks, current, size = [], [], 0
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+
+        added = len(line) + (1 if current else 0)
+        if size + added > limit:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+            added = len(line)
+        current.append(line)
+        size += added
+
+    if current or not chunks:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def text_batches(text):
+    """→ [[message, ...], ...]，每批最多 5 則（一次 request）"""
+    messages = [{"type": "text", "text": chunk} for chunk in split_text(text)]
+    return [messages[i:i + MESSAGES_PER_REQUEST] for i in range(0, len(messages), MESSAGES_PER_REQUEST)]
+
+
+def push_message(text: str, to=None):
     CHANNEL_TOKEN = os.getenv("LINE_CHANNEL_TOKEN")
-    USER_ID = os.getenv("LINE_USER_ID")
-    
+    USER_ID = to or os.getenv("LINE_USER_ID")
+
     if not CHANNEL_TOKEN or not USER_ID:
         print("[ERROR] Missing LINE credentials.")
         return
 
-    url = "https://api.line.me/v2/bot/message/push"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {CHANNEL_TOKEN}"
-    }
-    body = {
-        "to": USER_ID,
-        "messages": [
-            {"type": "text", "text": text}
-        ]
-    }
-
-    response = requests.post(url, headers=headers, data=json.dumps(body))
-    print("Push Response:", response.status_code, response.text)
\ No newline at end of file
+    # 超過 5000 字的報表切成多則訊息，5 則一次送出
+    client = _client(CHANNEL_TOKEN)
+    for messages in text_batches(text):
+        body = {
+            "to": USER_ID,
+            "messages": messages
+        }
+
+        status = client.send("push", body)
+        print("Push Response:", status)
+
+
+def push_messages(items):
+    """
+    多使用者報表：items = [(user_id, text), ...]
+    - 內容相同的收件者合併成 multicast（每次最多 500 人）
+    - 其餘各自 push，共用 LineClient 的連線池併發送出（重試 / outbox 見 line_client）
+    - 長報表切成多則訊息，每次 request 最多 5 則
+    → {user_id: status_code}
+    """
+    CHANNEL_TOKEN = os.getenv("LINE_CHANNEL_TOKEN")
+    if not CHANNEL_TOKEN:
+        print("[ERROR] Missing LINE credentials.")
+        return {}
+
+    by_text = {}
+    for user_id, text in items:
+        by_text.setdefault(text, []).append(user_id)
+
+    requests_to_send = []
+    for text, user_ids in by_text.items():
+        for messages in text_batches(text):
+            if len(user_ids) == 1:
+                requests_to_send.append(("push", {"to": user_ids[0], "messages": messages}, user_ids))
+                continue
+            for i in range(0, len(user_ids), MULTICAST_LIMIT):
+                to = user_ids[i:i + MULTICAST_LIMIT]
+                requests_to_send.append(("multicast", {"to": to, "messages": messages}, to))
+
+    client = _client(CHANNEL_TOKEN)
+    before = dict(client.stats)
+
+    def send(req):
+        op, body, user_ids = req
+        try:
+            return user_ids, client.send(op, body)
+        except Exception as e:
+            print(f"[LINE ERROR] {op} → {len(user_ids)} users: {e}")
+            return user_ids, None
+
+    statuses = {}
+    workers = max(1, min(MAX_WORKERS, len(requests_to_send)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for user_ids, status in pool.map(send, requests_to_send):
+            for user_id in user_ids:
+                # 同一使用者有多個 request（長報表）→ 保留第一個失敗的狀態
+                if _ok(statuses.get(user_id, 200)):
+                    statuses[user_id] = status
+
+    failed = sum(1 for s in statuses.values() if not _ok(s))
+    delta = {k: client.stats[k] - before[k] for k in client.stats}
+    print(f"[LINE] Sent {len(requests_to_send)} requests to {len(statuses)} users ({failed} failed, "
+          f"{delta['retries']} retries, {delta['outboxed']} queued in outbox)")
+    return statuses
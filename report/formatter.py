@@ -1,86 +1,157 @@
-def print_report(completed, open_positions):
-    wins = 0
-    total_trades = len(completed) + len(open_positions)
+from report.model import build_model, render_json
+
+
+def price_note(pos):
+    """報價標記（備援資料源 / 非最新收盤價 / 查不到）→ 附在收盤價後面的說明"""
+    flag = pos.get("price_flag")
+    if flag == "missing":
+        return " ⚠ 無報價"
+    if flag == "stale":
+        return f" ⚠ 舊收盤價 {pos.get('price_date')}"
+    if flag == "fallback":
+        return f" ⚠ 備援報價 {pos.get('price_source')}"
+    return ""
+
+
+def qty_note(lot):
+    """有股數的 lot / 交易 → " × 1,000 股"；舊的 4 欄資料不顯示"""
+    if "qty" not in lot:
+        return ""
+    return f" × {lot['qty']:,.0f} 股" if float(lot["qty"]).is_integer() else f" × {lot['qty']:,.4g} 股"
+
+
+def fee_note(trade):
+    """含手續費 / 證交稅的已實現交易 → 淨損益金額"""
+    if "pnl" not in trade:
+        return ""
+    return f"（淨損益 {trade['pnl']:+,.0f}，費用 {trade['fee']:,.0f}）"
+
+
+SEPARATOR = "------------------------------------------------------------"
+
+
+# ============================================================
+# Renderers：共用 report.model 算好的彙總，各自只負責排版
+# ============================================================
+def render_console(model):
+    """本地 / Cloud Run log 用的詳細版"""
+    lines = ["\n==================== COMPLETED TRADES ====================\n"]
+
+    for t in model.completed:
+        lines.append(f"[{t['code']}] — {t['company'] or 'Unknown Company'}")
+        lines.append("  Buy Details:")
+        lines.extend(f"    {b['date']} → {b['price']:.2f}{qty_note(b)}" for b in t["buy_detail"])
+        lines.append(f"  Sell Date   : {t['sell_date']}")
+        lines.append(f"  Avg Cost    : {t['avg_cost']:.2f}")
+        lines.append(f"  Sell Price  : {t['sell_price']:.2f}{qty_note(t)}")
+        lines.append(f"  P/L (%)     : {t['pct']:+.2f}%{fee_note(t)}")
+        lines.append(SEPARATOR)
+
+    lines.append("\n==================== OPEN POSITIONS ====================\n")
+
+    for pos in model.open_positions:
+        lines.append(f"[{pos['code']}] — {pos['company'] or 'Unknown Company'}")
+        lines.append("  Buy Details:")
+        lines.extend(f"    {b['date']} → {b['price']:.2f}{qty_note(b)}" for b in pos["buy_detail"])
+        lines.append(f"  Avg Cost    : {pos['avg_cost']:.2f}")
+        if pos["close_price"] is None:
+            lines.append(f"  Close Price : N/A{price_note(pos)}")
+        else:
+            lines.append(f"  Close Price : {pos['close_price']:.2f}{price_note(pos)}")
+            lines.append(f"  P/L (%)     : {pos['pct']:+.2f}%")
+        lines.append(SEPARATOR)
+
+    lines.append("\n==================== SUMMARY ====================\n")
+    if model.win_rate is not None:
+        lines.append(f"Win Rate: {model.win_rate:.2f}%")
+    else:
+        lines.append("No trades found.")
 
-    print("\n==================== COMPLETED TRADES ====================\n")
+    return "\n".join(lines)
 
-    for t in completed:
-        if t["pct"] > 0:
-            wins += 1
 
-        print(f"[{t['code']}] — {t['company'] or 'Unknown Company'}")
-        print("  Buy Details:")
-        for b in t["buy_detail"]:
-            print(f"    {b['date']} → {b['price']:.2f}")
+def render_line(model):
+    """LINE 推播用的精簡版"""
+    return "\n".join(iter_line(model))
 
-        print(f"  Sell Date   : {t['sell_date']}")
-        print(f"  Avg Cost    : {t['avg_cost']:.2f}")
-        print(f"  Sell Price  : {t['sell_price']:.2f}")
-        print(f"  P/L (%)     : {t['pct']:+.2f}%")
-        print("------------------------------------------------------------")
 
-    print("\n==================== OPEN POSITIONS ====================\n")
+def iter_line(model):
+    """render_line 逐行產生（webhook 回覆只取到填滿一次 reply 為止）"""
+    yield "=== COMPLETED TRADES ==="
 
-    for pos in open_positions:
-        if pos["pct"] > 0:
-            wins += 1
+    if not model.completed:
+        yield "\n(No recent completed trades)"
+    else:
+        yield from _line_completed(model.completed)
 
-        print(f"[{pos['code']}] — {pos['company'] or 'Unknown Company'}")
-        print("  Buy Details:")
-        for b in pos["buy_detail"]:
-            print(f"    {b['date']} → {b['price']:.2f}")
+    yield "\n=== OPEN POSITIONS ==="
 
-        print(f"  Avg Cost    : {pos['avg_cost']:.2f}")
-        print(f"  Close Price : {pos['close_price']:.2f}")
-        print(f"  P/L (%)     : {pos['pct']:+.2f}%")
-        print("------------------------------------------------------------")
+    if not model.open_positions:
+        yield "\n(No open positions)"
+    else:
+        yield from _line_open(model.open_positions)
 
-    print("\n==================== SUMMARY ====================\n")
-    if total_trades > 0:
-        print(f"Win Rate: {(wins / total_trades) * 100:.2f}%")
+    # Summary
+    yield f"\n=== SUMMARY ==="
+    yield f"Win Rate: {model.win_rate or 0:.2f}%"
+
+
+def _line_completed(trades):
+    for t in trades:
+        yield f"\n[{t['code']}] — {t['company']}"
+        yield from (f"  BUY  {b['date']} @ {b['price']:.2f}{qty_note(b)}" for b in t["buy_detail"])
+        yield f"  SELL {t['sell_date']} @ {t['sell_price']:.2f}{qty_note(t)}"
+        yield f"  P/L  {t['pct']:+.2f}%{fee_note(t)}"
+
+
+def _line_open(positions):
+    for pos in positions:
+        yield f"\n[{pos['code']}] — {pos['company']}"
+        yield from (f"  BUY   {b['date']} @ {b['price']:.2f}{qty_note(b)}" for b in pos["buy_detail"])
+        yield f"  Avg Cost    : {pos['avg_cost']:.2f}"
+        if pos["close_price"] is None:
+            yield f"  CLOSE @ N/A{price_note(pos)}"
+        else:
+            yield f"  CLOSE @ {pos['close_price']:.2f}{price_note(pos)}"
+            yield f"  P/L   {pos['pct']:+.2f}%"
+
+
+# --------------------------------------------------------
+# Webhook 查詢（即時回覆，格式與 LINE 推播相同）
+# --------------------------------------------------------
+def iter_positions(model):
+    """「持倉」：只列未平倉"""
+    yield "=== OPEN POSITIONS ==="
+    if not model.open_positions:
+        yield "\n(No open positions)"
     else:
-        print("No trades found.")
-        
-def format_report(completed, open_positions):
-    output = []
+        yield from _line_open(model.open_positions)
 
-    wins = 0
-    total_trades = len(completed) + len(open_positions)
 
-    output.append("=== COMPLETED TRADES ===")
+def iter_code(model, code):
+    """「<代號>」：該代號近期的已實現交易 + 未平倉（model 只含這個代號）"""
+    if code not in model.codes:
+        yield f"查無 {code} 的近期交易或未平倉"
+        return
 
-    if not completed:
-        output.append("\n(No recent completed trades)")
-    else:
-        for t in completed:
-            if t["pct"] > 0:
-                wins += 1
+    yield f"=== {code} ==="
+    yield from _line_completed(model.completed)
+    yield from _line_open(model.open_positions)
 
-            output.append(f"\n[{t['code']}] — {t['company']}")
-            for b in t["buy_detail"]:
-                output.append(f"  BUY  {b['date']} @ {b['price']:.2f}")
-            output.append(f"  SELL {t['sell_date']} @ {t['sell_price']:.2f}")
-            output.append(f"  P/L  {t['pct']:+.2f}%")
 
-    output.append("\n=== OPEN POSITIONS ===")
+def render_all(completed, open_positions, as_of=None):
+    """一次彙總 → {"console", "line", "json"}"""
+    model = build_model(completed, open_positions)
+    return {
+        "console": render_console(model),
+        "line": render_line(model),
+        "json": render_json(model, as_of),
+    }
 
-    if not open_positions:
-        output.append("\n(No open positions)")
-    else:
-        for pos in open_positions:
-            if pos["pct"] > 0:
-                wins += 1
 
-            output.append(f"\n[{pos['code']}] — {pos['company']}")
-            for b in pos["buy_detail"]:
-                output.append(f"  BUY   {b['date']} @ {b['price']:.2f}")
-            output.append(f"  Avg Cost    : {pos['avg_cost']:.2f}")
-            output.append(f"  CLOSE @ {pos['close_price']:.2f}")
-            output.append(f"  P/L   {pos['pct']:+.2f}%")
+def print_report(completed, open_positions):
+    print(render_console(build_model(completed, open_positions)))
 
-    # Summary
-    win_rate = (wins / total_trades * 100) if total_trades > 0 else 0
-    output.append(f"\n=== SUMMARY ===")
-    output.append(f"Win Rate: {win_rate:.2f}%")
 
-    return "\n".join(output)
\ No newline at end of file
+def format_report(completed, open_positions):
+    return render_line(build_model(completed, open_positions))
@@ -0,0 +1,183 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+
+from core.metrics import cache_lookup
+
+# 渲染結果快取（重播結果 + 報價 + 報表日期都相同 → 報表內容不變）
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(".cache", "reports"))
+
+# 只保留最近幾份
+REPORT_CACHE_KEEP = int(os.getenv("REPORT_CACHE_KEEP", "20"))
+
+
+# ============================================================
+# Report model：一次走訪算出所有彙總，各種輸出共用
+# ============================================================
+class ReportModel:
+    """
+    - completed / open_positions：trade_parser.build_positions 的結果
+    - wins / total_trades / win_rate：勝率（未平倉沒有現價的不列入）
+    - realized_pnl：有股數的已實現交易淨損益合計（舊的 4 欄資料沒有金額）
+    - codes：{code: 每檔的交易次數 / 勝場 / 平均報酬 / 淨損益 / 未平倉報酬}
+    """
+
+    def __init__(self, completed, open_positions):
+        self.completed = completed
+        self.open_positions = open_positions
+        self.wins = 0
+        self.total_trades = 0
+        self.realized_pnl = 0.0
+        self.codes = {}
+
+        for t in completed:
+            stats = self._code(t)
+            stats["trades"] += 1
+            stats["pct_sum"] += t["pct"]
+            if t["pct"] > 0:
+                self.wins += 1
+                stats["wins"] += 1
+            if "pnl" in t:
+                stats["pnl"] += t["pnl"]
+                self.realized_pnl += t["pnl"]
+            self.total_trades += 1
+
+        for pos in open_positions:
+            stats = self._code(pos)
+            stats["open_pct"] = pos["pct"]
+            if pos["pct"] is None:
+                continue
+            if pos["pct"] > 0:
+                self.wins += 1
+            self.total_trades += 1
+
+    def _code(self, row):
+        stats = self.codes.get(row["code"])
+        if stats is None:
+            stats = self.codes[row["code"]] = {
+                "company": row.get("company"),
+                "trades": 0, "wins": 0, "pct_sum": 0.0, "pnl": 0.0, "open_pct": None,
+            }
+        return stats
+
+    @property
+    def win_rate(self):
+        """→ %；沒有交易時為 None"""
+        if self.total_trades == 0:
+            return None
+        return (self.wins / self.total_trades) * 100
+
+
+def build_model(completed, open_positions):
+    return ReportModel(completed, open_positions)
+
+
+# --------------------------------------------------------
+# Compact JSON（給其他服務 / 前端讀，不含逐筆買進明細）
+# --------------------------------------------------------
+def render_json(model, as_of=None):
+    def r(value, digits=4):
+        return None if value is None else round(value, digits)
+
+    return json.dumps({
+        "as_of": as_of,
+        "summary": {
+            "win_rate": r(model.win_rate, 2),
+            "wins": model.wins,
+            "total_trades": model.total_trades,
+            "realized_pnl": r(model.realized_pnl, 2),
+        },
+        "codes": {
+            code: {
+                "company": s["company"],
+                "trades": s["trades"],
+                "wins": s["wins"],
+                "avg_pct": r(s["pct_sum"] / s["trades"]) if s["trades"] else None,
+                "pnl": r(s["pnl"], 2),
+                "open_pct": r(s["open_pct"]),
+            }
+            for code, s in model.codes.items()
+        },
+        "completed": [
+            [t["code"], t["sell_date"], t["action"], r(t["avg_cost"]), r(t["sell_price"]), r(t["pct"])]
+            for t in model.completed
+        ],
+        "open": [
+            [p["code"], r(p["avg_cost"]), r(p["close_price"]), r(p["pct"]), p.get("price_flag")]
+            for p in model.open_positions
+        ],
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+# ============================================================
+# Fingerprint + 渲染快取
+# ============================================================
+def fingerprint(completed, open_buys, prices, as_of):
+    """
+    重播結果（已實現交易 + 未平倉買進）+ 未平倉用到的報價（收盤價 / 交易日 / 來源）+ 報表日期
+    → 報表內容只由這些決定；ledger 沒有新資料、報價也沒變時 fingerprint 相同。
+    （不直接 hash ledger：接續快照時查的報價範圍不同，但報表相同）
+    """
+    quotes = [
+        (code, q[0], getattr(q, "trade_date", None), getattr(q, "source", None), getattr(q, "fallback", False))
+        for code in open_buys for q in [prices.get(code, (None, None))]
+    ]
+    # pickle 比 json.dumps 快數倍；fast 模式不做 memo → 只看內容、不受物件共用方式影響
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=4)
+    pickler.fast = True
+    pickler.dump((as_of, completed, open_buys, quotes))
+    return hashlib.sha256(buffer.getbuffer()).hexdigest()
+
+
+class ReportCache:
+    """渲染結果：{REPORT_CACHE_DIR}/{fingerprint}.json → {"console", "line", "json"}"""
+
+    def __init__(self, cache_dir=REPORT_CACHE_DIR, keep=REPORT_CACHE_KEEP):
+        self.cache_dir = cache_dir
+        self.keep = keep
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                outputs = json.load(f)
+            # mtime 當作最近使用時間（_prune 依此淘汰）
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            cache_lookup("report", False)
+            return None
+
+        cache_lookup("report", True)
+        return outputs
+
+    def put(self, key, outputs):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(outputs, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+            self._prune()
+        except OSError as e:
+            # 快取寫不進去不影響報表
+            print(f"[ReportCache ERROR] {e}")
+
+    def _prune(self):
+        entries = [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir) if name.endswith(".json")
+        ]
+        if len(entries) <= self.keep:
+            return
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
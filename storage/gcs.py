@@ -0,0 +1,248 @@
+import io
+import threading
+import time
+
+from core.metrics import cache_lookup, external
+
+# ============================================================
+# 共用的物件儲存存取層
+#
+# - 每個 process 只建立一個 storage.Client，bucket handle 也重複使用
+# - 不再先呼叫 blob.exists()：直接下載，NotFound 就回傳 None
+# - 支援 generation 條件式 GET：內容沒變就不重新下載
+# - open()：串流下載，大檔不必整份放進記憶體
+# - MemoryStore：in-memory 假後端，測試 / benchmark 用
+# ============================================================
+
+
+# 串流下載每次向 GCS 要的大小
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
+# GCS 的 custom metadata（key + value 合計）上限
+METADATA_LIMIT = 8 * 1024
+
+
+class NotModified(Exception):
+    """if_generation_not_match 命中：物件沒有變動"""
+
+
+class PreconditionFailed(Exception):
+    """generation 不符：物件在讀取之後被別人改過（或 create-only 時已存在）"""
+
+
+class StoredObject:
+    def __init__(self, data, generation, metadata=None):
+        self.data = data
+        self.generation = generation
+        self.metadata = metadata or {}
+
+
+# ------------------------------------------------------------
+# GCS
+# ------------------------------------------------------------
+class GCSStore:
+    def __init__(self):
+        self._client = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import storage
+
+                    self._client = storage.Client()
+        return self._client
+
+    def bucket(self, name):
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets.setdefault(name, self.client.bucket(name))
+        return bucket
+
+    def read(self, bucket, name, if_generation_not_match=None):
+        from google.api_core.exceptions import NotFound, NotModified as GCSNotModified
+
+        blob = self.bucket(bucket).blob(name)
+        try:
+            with external("gcs", "read"):
+                data = blob.download_as_bytes(if_generation_not_match=if_generation_not_match)
+        except NotFound:
+            return None
+        except GCSNotModified as e:
+            raise NotModified(f"gs://{bucket}/{name}") from e
+        return StoredObject(data, blob.generation)
+
+    def stat(self, bucket, name):
+        """只取 generation + metadata（不下載內容）"""
+        with external("gcs", "stat"):
+            blob = self.bucket(bucket).get_blob(name)
+        if blob is None:
+            return None
+        return StoredObject(None, blob.generation, blob.metadata)
+
+    def open(self, bucket, name, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        串流下載（每次只抓 chunk_size bytes）→ StoredObject，data 為 binary file object
+        讀取固定在開啟當下的 generation
+        """
+        with external("gcs", "stat"):
+            blob = self.bucket(bucket).get_blob(name)
+        if blob is None:
+            return None
+        stream = blob.open("rb", chunk_size=chunk_size, if_generation_match=blob.generation)
+        return StoredObject(stream, blob.generation, blob.metadata)
+
+    def write(self, bucket, name, data, if_generation_match=None, metadata=None, content_type=None):
+        from google.api_core.exceptions import PreconditionFailed as GCSPreconditionFailed
+
+        blob = self.bucket(bucket).blob(name)
+        if metadata:
+            blob.metadata = metadata
+        try:
+            with external("gcs", "write"):
+                blob.upload_from_string(
+                    data,
+                    content_type=content_type or "application/octet-stream",
+                    if_generation_match=if_generation_match,
+                )
+        except GCSPreconditionFailed as e:
+            raise PreconditionFailed(f"gs://{bucket}/{name}") from e
+        return blob.generation
+
+    def list(self, bucket, prefix):
+        with external("gcs", "list"):
+            return sorted(b.name for b in self.client.list_blobs(bucket, prefix=prefix))
+
+    def delete(self, bucket, name):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            with external("gcs", "delete"):
+                self.bucket(bucket).blob(name).delete()
+        except NotFound:
+            pass
+
+
+# ------------------------------------------------------------
+# In-memory fake
+# ------------------------------------------------------------
+class MemoryStore:
+    """與 GCSStore 相同介面；calls 記錄每種操作的次數"""
+
+    def __init__(self, latency=0.0):
+        self.objects = {}
+        self.latency = latency
+        self.calls = {"read": 0, "stat": 0, "write": 0, "list": 0, "delete": 0, "not_modified": 0}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _call(self, op):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[op] += 1
+
+    def read(self, bucket, name, if_generation_not_match=None):
+        self._call("read")
+        obj = self.objects.get((bucket, name))
+        if obj is None:
+            return None
+        if if_generation_not_match is not None and obj.generation == if_generation_not_match:
+            with self._lock:
+                self.calls["not_modified"] += 1
+            raise NotModified(f"mem://{bucket}/{name}")
+        return StoredObject(obj.data, obj.generation)
+
+    def stat(self, bucket, name):
+        self._call("stat")
+        obj = self.objects.get((bucket, name))
+        if obj is None:
+            return None
+        return StoredObject(None, obj.generation, dict(obj.metadata))
+
+    def open(self, bucket, name, chunk_size=STREAM_CHUNK_SIZE):
+        self._call("read")
+        obj = self.objects.get((bucket, name))
+        if obj is None:
+            return None
+        return StoredObject(io.BytesIO(obj.data), obj.generation, dict(obj.metadata))
+
+    def write(self, bucket, name, data, if_generation_match=None, metadata=None, content_type=None):
+        self._call("write")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if sum(len(k.encode("utf-8")) + len(v.encode("utf-8")) for k, v in (metadata or {}).items()) > METADATA_LIMIT:
+            # 與 GCS 相同：超過上限的寫入整個失敗（400）
+            raise ValueError(f"mem://{bucket}/{name}: custom metadata exceeds {METADATA_LIMIT} bytes")
+        with self._lock:
+            current = self.objects.get((bucket, name))
+            current_generation = current.generation if current else 0
+            if if_generation_match is not None and if_generation_match != current_generation:
+                raise PreconditionFailed(f"mem://{bucket}/{name}")
+
+            self._generation += 1
+            self.objects[(bucket, name)] = StoredObject(bytes(data), self._generation, dict(metadata or {}))
+            return self._generation
+
+    def list(self, bucket, prefix):
+        self._call("list")
+        return sorted(n for b, n in list(self.objects) if b == bucket and n.startswith(prefix))
+
+    def delete(self, bucket, name):
+        self._call("delete")
+        with self._lock:
+            self.objects.pop((bucket, name), None)
+
+
+# ------------------------------------------------------------
+# Process-wide store + 條件式 GET 快取
+# ------------------------------------------------------------
+_store = None
+_store_lock = threading.Lock()
+
+# (store, bucket, name) → 最後一次下載到的 StoredObject
+_object_cache = {}
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = GCSStore()
+    return _store
+
+
+def set_store(store):
+    """替換全域 store（測試 / benchmark 用）"""
+    global _store
+    _store = store
+    _object_cache.clear()
+
+
+def read_object(bucket, name, store=None):
+    """
+    下載物件；之前下載過就帶 if_generation_not_match，
+    內容沒變時直接回傳記憶體中的版本（不重新下載）
+    """
+    store = store or get_store()
+    key = (id(store), bucket, name)
+    cached = _object_cache.get(key)
+
+    try:
+        obj = store.read(bucket, name, if_generation_not_match=cached.generation if cached else None)
+    except NotModified:
+        cache_lookup("gcs_object", True)
+        return cached
+
+    if cached is not None:
+        cache_lookup("gcs_object", False)
+    if obj is None:
+        _object_cache.pop(key, None)
+        return None
+
+    _object_cache[key] = obj
+    return obj
@@ -1,6 +1,8 @@
-from google.cloud import storage
 import time
 
+from storage.gcs import get_store, read_object
+
+
 def download_csv_from_gcs(bucket_name, blob_name, local_path):
     print("---------------------------------------------------")
     print(f"[GCS] START download")
@@ -12,22 +14,16 @@ def download_csv_from_gcs(bucket_name, blob_name, local_path):
     start = time.time()
 
     try:
-        client = storage.Client()
-        print("[GCS] Client created OK")
-
-        bucket = client.bucket(bucket_name)
-        print("[GCS] Bucket object OK")
+        # 不先呼叫 exists()：直接下載，不存在時回傳 None
+        obj = read_object(bucket_name, blob_name)
 
-        blob = bucket.blob(blob_name)
-        print(f"[GCS] Blob exists? {blob.exists()}")
-
-        if not blob.exists():
+        if obj is None:
             print(f"[ERROR] File not found: gs://{bucket_name}/{blob_name}")
             return False
 
-        print("[GCS] Downloading...")
-        blob.download_to_filename(local_path)
-        print("[GCS] Download DONE")
+        with open(local_path, "wb") as f:
+            f.write(obj.data)
+        print(f"[GCS] Download DONE (generation={obj.generation})")
 
         return True
 
@@ -37,4 +33,21 @@ def download_csv_from_gcs(bucket_name, blob_name, local_path):
 
     finally:
         print(f"[GCS] Total time: {time.time() - start:.2f} sec")
-        print("---------------------------------------------------")
\ No newline at end of file
+        print("---------------------------------------------------")
+
+
+def upload_file_to_gcs(bucket_name, blob_name, local_path):
+    start = time.time()
+
+    try:
+        with open(local_path, "rb") as f:
+            get_store().write(bucket_name, blob_name, f.read())
+        print(f"[GCS] Uploaded {local_path} → gs://{bucket_name}/{blob_name}")
+        return True
+
+    except Exception as e:
+        print(f"[GCS ERROR] {e}")
+        return False
+
+    finally:
+        print(f"[GCS] Total time: {time.time() - start:.2f} sec")
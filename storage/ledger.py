@@ -0,0 +1,464 @@
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地開發
+    fcntl = None
+
+from core.metrics import retry
+from storage.gcs import PreconditionFailed, StoredObject, get_store, read_object
+
+LEDGER_COLUMNS = ["date", "code", "action", "value"]
+
+# 選填欄位（股數 / 實付手續費）：有填才寫，舊的 4 欄列照常讀得到
+LOT_COLUMNS = ["qty", "fee"]
+
+# 多使用者 ledger：portfolios/<LINE user id>/trades.csv
+PORTFOLIO_PREFIX = "portfolios/"
+PORTFOLIO_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# 單次 compaction 最多合併的 segment 數（已合併清單記在 base 的 metadata 裡）
+MAX_SEGMENTS_PER_COMPACTION = 100
+
+# 已合併清單的上限（GCS 的 custom metadata 合計最多 8 KiB）
+MAX_COMPACTED_BYTES = 6 * 1024
+
+
+# ============================================================
+# Backends
+#
+# 介面：
+#   read(name, with_metadata=True) → StoredObject | None
+#   stat(name) → StoredObject（data 為 None，只有 generation + metadata）| None
+#   write(name, data, if_generation_match=None, metadata=None)
+#                  if_generation_match=0 代表「只能新建」
+#   list(prefix) → [name, ...]（依名稱排序）
+#   delete(name)
+#   open(name) → StoredObject（data 為 binary file object）| None
+# ============================================================
+class GCSLedgerBackend:
+    """
+    物件儲存版本；store 預設為共用的 GCSStore，
+    傳入 storage.gcs.MemoryStore 即為 in-memory 版本
+    """
+
+    def __init__(self, bucket_name, store=None):
+        self.bucket_name = bucket_name
+        self.store = store or get_store()
+
+    def read(self, name, with_metadata=True):
+        if not with_metadata:
+            return self.store.read(self.bucket_name, name)
+
+        # 先取 generation + metadata，再做條件式 GET（沒變就用記憶體中的版本）
+        while True:
+            meta = self.store.stat(self.bucket_name, name)
+            if meta is None:
+                return None
+
+            obj = read_object(self.bucket_name, name, self.store)
+            if obj is None:
+                return None
+            if obj.generation == meta.generation:
+                return StoredObject(obj.data, obj.generation, meta.metadata)
+
+            # stat 與下載之間物件被改過 → 重來一次
+            retry("gcs", "read")
+
+    def stat(self, name):
+        return self.store.stat(self.bucket_name, name)
+
+    def write(self, name, data, if_generation_match=None, metadata=None):
+        return self.store.write(
+            self.bucket_name, name, data,
+            if_generation_match=if_generation_match,
+            metadata=metadata,
+            content_type="text/csv" if name.endswith(".csv") else "application/octet-stream",
+        )
+
+    def list(self, prefix):
+        return self.store.list(self.bucket_name, prefix)
+
+    def open(self, name):
+        return self.store.open(self.bucket_name, name)
+
+    def delete(self, name):
+        self.store.delete(self.bucket_name, name)
+
+
+class LocalLedgerBackend:
+    """
+    本地檔案系統版本（開發 / 測試用）
+    generation 與 metadata 存在旁邊的 .meta 檔，寫入時以 flock 保護
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _meta_path(self, name):
+        return os.path.join(self.root, ".meta", f"{name}.json")
+
+    def _read_meta(self, name):
+        try:
+            with open(self._meta_path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # 沒有 meta 的既有檔案視為 generation 1
+            return {"generation": 1, "metadata": {}}
+
+    def read(self, name, with_metadata=True):
+        try:
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        meta = self._read_meta(name)
+        return StoredObject(data, meta["generation"], meta["metadata"])
+
+    def stat(self, name):
+        if not os.path.exists(self._path(name)):
+            return None
+        meta = self._read_meta(name)
+        return StoredObject(None, meta["generation"], meta["metadata"])
+
+    def open(self, name):
+        try:
+            stream = open(self._path(name), "rb")
+        except FileNotFoundError:
+            return None
+        meta = self._read_meta(name)
+        return StoredObject(stream, meta["generation"], meta["metadata"])
+
+    def write(self, name, data, if_generation_match=None, metadata=None):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.makedirs(os.path.dirname(self._meta_path(name)), exist_ok=True)
+
+        with open(os.path.join(self.root, ".meta", ".lock"), "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            exists = os.path.exists(path)
+            current = self._read_meta(name)["generation"] if exists else 0
+            if if_generation_match is not None and if_generation_match != current:
+                raise PreconditionFailed(path)
+
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            generation = current + 1
+            with open(self._meta_path(name), "w", encoding="utf-8") as f:
+                json.dump({"generation": generation, "metadata": metadata or {}}, f)
+
+        return generation
+
+    def list(self, prefix):
+        directory = os.path.dirname(self._path(prefix))
+        if not os.path.isdir(directory):
+            return []
+        names = (os.path.relpath(os.path.join(directory, f), self.root) for f in os.listdir(directory))
+        return sorted(n.replace(os.sep, "/") for n in names if n.startswith(prefix) and not n.endswith(".tmp"))
+
+    def delete(self, name):
+        for path in (self._path(name), self._meta_path(name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# ============================================================
+# Append-only ledger
+# ============================================================
+class AppendOnlyLedger:
+    """
+    base（trades.csv）+ pending segments（trades.csv.pending/*.csv）
+
+    - append()：每則訊息寫成一個不可變的小 segment（create-only），
+      不再下載 / 上傳整份 CSV，同時進來的訊息也不會互相覆蓋
+    - read_bytes()：base + 尚未合併的 segments，依名稱排序接在後面
+    - compact()：把 segments 接到 base 後面（generation-match 寫入），再刪除
+    """
+
+    def __init__(self, backend, base="trades.csv"):
+        self.backend = backend
+        self.base = base
+        self.pending_prefix = f"{base}.pending/"
+
+    # ---- write ----
+    def segment_name(self):
+        """新的 segment 名稱（依時間排序）；先取名字再 append，可以在寫入前先記下它"""
+        return f"{self.pending_prefix}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.csv"
+
+    def append(self, rows, name=None):
+        """rows: [{"date", "code", "action", "value"[, "qty", "fee"]}, ...] → segment 名稱"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for row in rows:
+            values = [row[k] for k in LEDGER_COLUMNS]
+            lots = [row.get(k) for k in LOT_COLUMNS]
+            if any(v not in (None, "") for v in lots):
+                values += ["" if v is None else v for v in lots]
+            writer.writerow(values)
+
+        name = name or self.segment_name()
+        self.backend.write(name, buffer.getvalue().encode("utf-8"), if_generation_match=0)
+        return name
+
+    # ---- read ----
+    def pending(self):
+        return self.backend.list(self.pending_prefix)
+
+    def read_parts(self):
+        """→ (base 內容, [尚未合併的 segment 內容, ...])"""
+        base_data, segments, _ = self._read_versioned_parts()
+        return base_data, segments
+
+    def _read_versioned_parts(self):
+        base = self.backend.read(self.base)
+        names, segments = self._read_pending(base)
+        return (base.data if base else b""), segments, (base.generation if base else 0, tuple(names))
+
+    def _read_segments(self, base):
+        return self._read_pending(base)[1]
+
+    def _read_pending(self, base):
+        """→ (實際讀到的 segment 名稱, 內容)"""
+        done = _compacted(base)
+
+        names, segments = [], []
+        for name in self.pending():
+            if _segment_id(name) in done:
+                continue
+            segment = self.backend.read(name, with_metadata=False)
+            if segment is not None:
+                names.append(name)
+                segments.append(segment.data)
+        return names, segments
+
+    def read_bytes(self):
+        return self.merge(*self.read_parts())
+
+    # ---- version ----
+    def version(self):
+        """
+        → (base generation, 尚未合併的 segment 名稱)
+        只 stat + list、不下載；append / compaction 之後才會變
+        """
+        base = self.backend.stat(self.base)
+        done = _compacted(base)
+        return (base.generation if base else 0, tuple(n for n in self.pending() if _segment_id(n) not in done))
+
+    def read_versioned(self):
+        """→ (read_bytes() 的內容, 這份內容對應的 version())"""
+        base_data, segments, version = self._read_versioned_parts()
+        return self.merge(base_data, segments), version
+
+    def open_stream(self):
+        """
+        串流版 read_bytes()：base 邊讀邊下載，segments（小檔）先讀進記憶體
+        讀出的內容與 read_bytes() 相同
+        """
+        base = self.backend.open(self.base)
+        segments = self._read_segments(base)
+        return io.BufferedReader(LedgerStream(base.data if base else None, segments))
+
+    def merge(self, base_data, segments):
+        """base + segments → 新的 base 內容（CSV 直接接在後面）"""
+        return b"".join([_with_header(base_data), *segments])
+
+    # ---- compaction ----
+    def compact(self):
+        """→ 這次合併的 segment 數；被其他 compaction 搶先時回傳 0"""
+        base = self.backend.read(self.base)
+        done = _compacted(base)
+
+        # 上次合併後沒刪乾淨的 segment（內容已在 base 裡）→ 直接刪
+        names = self.pending()
+        for name in names:
+            if _segment_id(name) in done:
+                self.backend.delete(name)
+
+        names = [n for n in names if _segment_id(n) not in done][:MAX_SEGMENTS_PER_COMPACTION]
+        if not names:
+            return 0
+
+        # metadata 只記 segment 的檔名（不含 portfolio / pending 路徑），並限制總長度
+        segments = []
+        merged = []
+        size = 2
+        for name in names:
+            size += len(json.dumps(_segment_id(name))) + 1
+            if merged and size > MAX_COMPACTED_BYTES:
+                break
+            segment = self.backend.read(name, with_metadata=False)
+            if segment is not None:
+                segments.append(segment.data)
+                merged.append(name)
+
+        try:
+            self.backend.write(
+                self.base,
+                self.merge(base.data if base else b"", segments),
+                if_generation_match=base.generation if base else 0,
+                metadata={"compacted": json.dumps([_segment_id(n) for n in merged], separators=(",", ":"))},
+            )
+        except PreconditionFailed:
+            print("[Ledger] base 已被其他程序更新，略過這次 compaction")
+            return 0
+
+        for name in merged:
+            self.backend.delete(name)
+
+        print(f"[Ledger] Compacted {len(merged)} segments into {self.base}")
+        return len(merged)
+
+
+class LedgerStream(io.RawIOBase):
+    """
+    base stream + segments 串成一個唯讀 stream；
+    base 讀完才知道要不要補 header（空 base）或換行（結尾沒換行）
+    """
+
+    def __init__(self, base, segments):
+        self.base = base
+        self.segments = segments
+        self.tail = None
+        self.last = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.base is not None:
+            data = self.base.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self.last = data[-1:]
+                return len(data)
+            self.base.close()
+            self.base = None
+
+        if self.tail is None:
+            if not self.last:
+                head = (",".join(LEDGER_COLUMNS) + "\n").encode("utf-8")
+            else:
+                head = b"" if self.last == b"\n" else b"\n"
+            self.tail = io.BytesIO(b"".join([head, *self.segments]))
+            self.segments = None
+
+        return self.tail.readinto(buffer)
+
+    def close(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+        super().close()
+
+
+def _compacted(base):
+    """base 最近一次合併的 segment 檔名（舊版記的是完整路徑 → 一樣取檔名）"""
+    if base is None:
+        return set()
+    return {_segment_id(name) for name in json.loads(base.metadata.get("compacted", "[]"))}
+
+
+def _segment_id(name):
+    return name.rsplit("/", 1)[-1]
+
+
+def segment_written(backend, name):
+    """
+    segment 是否已寫入：還在 <base>.pending/，或已由最近一次 compaction 合併進 base
+    （看 base metadata 的已合併清單；再之前的 compaction 合併掉的認不出來）
+    """
+    if backend.stat(name) is not None:
+        return True
+    base, sep, _ = name.rpartition(".pending/")
+    return bool(sep) and _segment_id(name) in _compacted(backend.stat(base))
+
+
+def _with_header(data):
+    """空 base 補上 header；結尾沒換行的補上換行，讓 segment 能直接接在後面"""
+    if not data.strip():
+        return (",".join(LEDGER_COLUMNS) + "\n").encode("utf-8")
+    if not data.endswith(b"\n"):
+        return data + b"\n"
+    return data
+
+
+def open_backend(backend=None):
+    """LEDGER_BACKEND=gcs|local；未設定時有 GCS_BUCKET 就用 GCS"""
+    backend = backend or os.getenv("LEDGER_BACKEND") or ("gcs" if os.getenv("GCS_BUCKET") else "local")
+    if isinstance(backend, str):
+        if backend == "gcs":
+            return GCSLedgerBackend(os.getenv("GCS_BUCKET"))
+        return LocalLedgerBackend(os.getenv("LEDGER_DIR", "data"))
+    return backend
+
+
+def open_ledger(backend=None, fmt=None, user_id=None):
+    """
+    LEDGER_BACKEND=gcs   → gs://$GCS_BUCKET/$GCS_CSV_PATH
+    LEDGER_BACKEND=local → $LEDGER_DIR/trades.csv（預設 data/）
+    未設定時有 GCS_BUCKET 就用 GCS；也可以直接傳入 backend 物件
+
+    LEDGER_FORMAT=parquet → base 改用 typed Parquet（$GCS_PARQUET_PATH，預設 trades.parquet）
+
+    user_id → 該使用者自己的 partition：portfolios/<user_id>/trades.csv
+    """
+    fmt = fmt or os.getenv("LEDGER_FORMAT", "csv")
+    store = open_backend(backend)
+
+    if fmt == "parquet":
+        from storage.parquet_ledger import ParquetLedger
+
+        base = os.getenv("GCS_PARQUET_PATH", "trades.parquet")
+        return ParquetLedger(store, portfolio_base(base, user_id))
+
+    base = os.getenv("GCS_CSV_PATH", "trades.csv") if isinstance(store, GCSLedgerBackend) else "trades.csv"
+    return AppendOnlyLedger(store, portfolio_base(base, user_id))
+
+
+# ============================================================
+# Portfolios：每個 LINE 使用者一個 ledger partition
+# ============================================================
+def portfolio_base(base, user_id=None):
+    if user_id is None:
+        return base
+    if not PORTFOLIO_ID.fullmatch(user_id):
+        raise ValueError(f"Invalid portfolio id: {user_id!r}")
+    return f"{PORTFOLIO_PREFIX}{user_id}/{base.rsplit('/', 1)[-1]}"
+
+
+def list_portfolios(backend=None):
+    """→ 有 ledger 的 user_id（依名稱排序）"""
+    names = open_backend(backend).list(PORTFOLIO_PREFIX)
+    return sorted({n[len(PORTFOLIO_PREFIX):].split("/", 1)[0] for n in names} - {""})
+
+
+# ============================================================
+# CLI：python -m storage.ledger compact [gcs|local]
+# ============================================================
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("usage: python -m storage.ledger compact [gcs|local]")
+        sys.exit(1)
+
+    ledger = open_ledger(sys.argv[2] if len(sys.argv) > 2 else None)
+    while ledger.compact() == MAX_SEGMENTS_PER_COMPACTION:
+        pass
@@ -0,0 +1,177 @@
+import io
+import sys
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from storage.ledger import AppendOnlyLedger, LEDGER_COLUMNS, LOT_COLUMNS
+
+ACTIONS = ["BUY", "KEEP", "SELL", "REDUCE"]
+NULL_VALUES = ["null", "", "none", "nan"]
+
+# date32 / dictionary code / enum action / nullable float64（qty / fee 為選填，舊檔讀出來是 null）
+SCHEMA = pa.schema([
+    pa.field("date", pa.date32(), nullable=False),
+    pa.field("code", pa.dictionary(pa.int32(), pa.string()), nullable=False),
+    pa.field("action", pa.dictionary(pa.int8(), pa.string()), nullable=False),
+    pa.field("value", pa.float64()),
+    pa.field("qty", pa.float64()),
+    pa.field("fee", pa.float64()),
+])
+
+
+# --------------------------------------------------------
+# CSV → typed table
+# --------------------------------------------------------
+def csv_to_table(data: bytes):
+    """
+    解析 ledger CSV（所有欄位依位置、當字串讀）：
+    - date：YYYY-MM-DD 或 YYYY/MM/DD
+    - code：去掉 ".0"
+    - action：大寫，只接受 BUY / KEEP / SELL / REDUCE
+    - value：null → 缺值（用收盤價）；其他無法解析的列直接丟掉（原本也會被略過）
+    - qty / fee：選填，空的或舊的 4 欄列為缺值
+    """
+    df = pd.read_csv(
+        io.BytesIO(data), dtype=str, keep_default_na=False,
+        header=None, skiprows=1, names=LEDGER_COLUMNS + LOT_COLUMNS,
+    )
+    if df.empty:
+        return SCHEMA.empty_table()
+
+    dates = pd.to_datetime(df["date"].str.strip().str.replace("/", "-"), format="%Y-%m-%d", errors="coerce")
+    codes = df["code"].str.strip().str.replace(".0", "", regex=False)
+    actions = df["action"].str.strip().str.upper()
+
+    raw = df["value"].str.strip()
+    is_null = raw.str.lower().isin(NULL_VALUES)
+    values = pd.to_numeric(raw.where(~is_null), errors="coerce")
+
+    valid = dates.notna() & actions.isin(ACTIONS) & (is_null | values.notna())
+    if (~valid).any():
+        print(f"[Parquet] 略過 {int((~valid).sum())} 筆無法解析的資料")
+
+    return pa.table({
+        "date": pa.array(dates[valid].dt.date, pa.date32()),
+        "code": pa.array(codes[valid], pa.string()).dictionary_encode(),
+        "action": pa.DictionaryArray.from_arrays(
+            pa.array(actions[valid].map(ACTIONS.index), pa.int8()),
+            pa.array(ACTIONS),
+        ),
+        "value": pa.array(values[valid], pa.float64(), from_pandas=True),
+        **{
+            column: pa.array(
+                pd.to_numeric(df[column].fillna("").str.strip()[valid], errors="coerce"),
+                pa.float64(), from_pandas=True,
+            )
+            for column in LOT_COLUMNS
+        },
+    }, schema=SCHEMA)
+
+
+def table_to_bytes(table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+def read_table(data: bytes, columns=None, start=None, end=None):
+    """只讀需要的欄位與日期區間（row group 統計值可跳過不相關的區塊）"""
+    filters = []
+    if start is not None:
+        filters.append(("date", ">=", _as_date(start)))
+    if end is not None:
+        filters.append(("date", "<=", _as_date(end)))
+
+    return pq.read_table(
+        io.BytesIO(data),
+        columns=columns,
+        filters=filters or None,
+        schema=SCHEMA,
+    )
+
+
+def to_ledger_frame(table):
+    """
+    typed table → process_trades 用的 DataFrame
+    date 為 YYYY-MM-DD 字串（與 CSV ledger 經 normalize_ledger 後相同）、action 小寫、value 為 float（NaN = null）
+    """
+    df = table.to_pandas()
+    if "date" in df:
+        df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+    if "code" in df:
+        df["code"] = df["code"].astype(str)
+    if "action" in df:
+        df["action"] = df["action"].astype(str).str.lower()
+    return df
+
+
+def _as_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).replace("/", "-"))
+
+
+# --------------------------------------------------------
+# Parquet base + CSV pending segments
+# --------------------------------------------------------
+class ParquetLedger(AppendOnlyLedger):
+    """
+    webhook 依舊寫 CSV segment（append 路徑不變），
+    compaction 時才轉成 typed Parquet 合併進 base
+    """
+
+    def merge(self, base_data, segments):
+        tables = []
+        if base_data:
+            tables.append(pq.read_table(io.BytesIO(base_data), schema=SCHEMA))
+        if segments:
+            header = (",".join(LEDGER_COLUMNS) + "\n").encode("utf-8")
+            tables.append(csv_to_table(header + b"".join(segments)))
+
+        table = pa.concat_tables(tables).unify_dictionaries() if tables else SCHEMA.empty_table()
+        return table_to_bytes(table.combine_chunks())
+
+    def read_frame(self, columns=None, start=None, end=None):
+        return self._frame(*self.read_parts(), columns, start, end)
+
+    def read_versioned(self):
+        """→ (typed DataFrame, version())"""
+        base_data, segments, version = self._read_versioned_parts()
+        return self._frame(base_data, segments), version
+
+    def _frame(self, base_data, segments, columns=None, start=None, end=None):
+        tables = []
+        if base_data:
+            tables.append(read_table(base_data, columns, start, end))
+        if segments:
+            pending = self.merge(b"", segments)
+            tables.append(read_table(pending, columns, start, end))
+
+        if not tables:
+            return to_ledger_frame(SCHEMA.empty_table())
+        return to_ledger_frame(pa.concat_tables(tables).unify_dictionaries())
+
+
+# ============================================================
+# 一次性搬移：python -m storage.parquet_ledger migrate trades.csv trades.parquet
+# ============================================================
+def migrate(csv_path, parquet_path):
+    with open(csv_path, "rb") as f:
+        table = csv_to_table(f.read())
+
+    data = table_to_bytes(table)
+    with open(parquet_path, "wb") as f:
+        f.write(data)
+
+    print(f"[Parquet] {csv_path} → {parquet_path}（{table.num_rows} rows, {len(data)} bytes）")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "migrate":
+        print("usage: python -m storage.parquet_ledger migrate <trades.csv> <trades.parquet>")
+        sys.exit(1)
+
+    migrate(sys.argv[2], sys.argv[3])
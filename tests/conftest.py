@@ -0,0 +1,50 @@
+"""
+測試共用設定：全部離線（MemoryStore 模擬 GCS、stub 報價 / 公司名稱 / LINE）
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import tempfile
+
+import pytest
+
+# webhook_server / line_client 在 import 時讀這些設定
+os.environ.update(
+    TRACE_LOG="off",
+    LINE_CHANNEL_SECRET="test-secret",
+    WEBHOOK_FLUSH_INTERVAL="0.05",
+    LINE_BACKOFF="0.01",
+    LINE_RETRIES="4",
+)
+
+
+@pytest.fixture(autouse=True)
+def quiet_metrics():
+    from core.metrics import registry, set_trace_log
+
+    set_trace_log("off")
+    registry.reset()
+    yield
+
+
+@pytest.fixture
+def store():
+    """共用的 storage 換成 MemoryStore（測試結束後換回原本的）"""
+    from storage import gcs
+
+    original = gcs._store
+    store = gcs.MemoryStore()
+    gcs.set_store(store)
+    yield store
+    gcs.set_store(original)
+
+
+@pytest.fixture
+def stub_names(monkeypatch):
+    """公司名稱查詢不連外"""
+    from bench.synthetic import StubNameLookup
+    from core import company
+
+    monkeypatch.setattr(company, "_lookup_yahoo", StubNameLookup())
+    monkeypatch.setattr(company, "_cache", company.NameCache(tempfile.mkdtemp()))
@@ -0,0 +1,38 @@
+"""回測（core.backtest）：不套任何規則時的損益必須等於權益曲線的損益（float64，各種規模）"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench.bench_analytics import make_history, make_ledger
+
+
+def synthetic(years, codes, rows):
+    from core.price import LocalPriceProvider
+
+    end = pd.Timestamp("2025-12-31")
+    history = make_history(pd.Index([str(1000 + i) for i in range(codes)]), end - pd.DateOffset(years=years), end)
+    ledger = make_ledger(history, rows)
+    return ledger, LocalPriceProvider(history.iloc[-1].to_dict(), history=history), end
+
+
+@pytest.mark.parametrize("years, codes, rows", [(1, 30, 2000), (2, 100, 10000), (5, 300, 50000)])
+def test_baseline_matches_equity_curve(years, codes, rows):
+    from core.analytics import equity_curve
+    from core.backtest import load_trades, parameter_grid, run_grid
+
+    ledger, provider, end = synthetic(years, codes, rows)
+    trades = load_trades(ledger, provider, end)
+    baseline = run_grid(trades, parameter_grid(), max_workers=1).iloc[0]["pnl"]
+    equity = equity_curve(ledger, provider, end)["equity"].iloc[-1]
+
+    assert trades.X.dtype == np.float64
+    assert baseline == pytest.approx(equity, rel=1e-9)
+
+
+def test_results_do_not_depend_on_worker_count():
+    from core.backtest import load_trades, parameter_grid, run_grid
+
+    ledger, provider, end = synthetic(1, 30, 2000)
+    trades = load_trades(ledger, provider, end)
+    grid = parameter_grid(stops=range(0, 21, 5), trails=range(0, 31, 10), caps=[0, 20], sizing=["ledger", "equal"])
+    assert run_grid(trades, grid, max_workers=1).equals(run_grid(trades, grid, max_workers=2))
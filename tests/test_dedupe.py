@@ -0,0 +1,163 @@
+"""LINE 重送（同一個 webhookEventId）：ledger 只能有一列，重啟 / 處理到一半掛掉也一樣"""
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from bench.bench_dedupe import FakeLine, deliveries, make_event, sign
+
+EVENTS = 60
+
+
+@pytest.fixture
+def webhook(store, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+    from webhook import webhook_server
+    from webhook.dedupe import EventDeduper
+
+    backend = GCSLedgerBackend("test", store)
+    monkeypatch.setattr(webhook_server, "ledger", AppendOnlyLedger(backend))
+    monkeypatch.setattr(webhook_server, "deduper", EventDeduper(backend))
+    monkeypatch.setattr(webhook_server, "line_api", FakeLine(0))
+    with TestClient(webhook_server.app) as client:
+        yield webhook_server, client, backend
+
+
+def send(client, events):
+    body = json.dumps({"destination": "Ubot", "events": events})
+    res = client.post("/callback", content=body, headers={"X-Line-Signature": sign(body, os.environ["LINE_CHANNEL_SECRET"])})
+    assert res.status_code == 200, res.text
+
+
+def replay(webhook_server, client, bodies, threads=4):
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda events: send(client, events), bodies))
+    client.portal.call(webhook_server.event_queue.join)
+
+
+def ledger_rows(webhook_server):
+    return sorted(webhook_server.ledger.read_bytes().decode().splitlines()[1:])
+
+
+def test_redeliveries_write_one_row_per_event(webhook):
+    webhook_server, client, backend = webhook
+    replay(webhook_server, client, deliveries(EVENTS, 3, random.Random(0)))
+    assert len(ledger_rows(webhook_server)) == EVENTS
+    assert len(webhook_server.line_api.replies) == EVENTS
+
+    # 重啟 / 另一個 instance：LRU 是空的，只剩 storage 上的標記
+    from webhook.dedupe import EventDeduper
+
+    webhook_server.deduper = EventDeduper(backend)
+    replay(webhook_server, client, deliveries(EVENTS, 0, random.Random(1)))
+    assert len(ledger_rows(webhook_server)) == EVENTS
+    assert len(webhook_server.line_api.replies) == EVENTS
+
+
+def parsed(event):
+    """webhook payload 的事件 → EventDeduper 用到的欄位"""
+    return SimpleNamespace(webhook_event_id=event["webhookEventId"], timestamp=event["timestamp"])
+
+
+def crashed_claim(webhook_server, backend, event, appended):
+    """claim 之後 process 掛掉：appended → segment 已寫入、沒來得及 complete"""
+    from webhook.dedupe import EventDeduper
+
+    segment = webhook_server.ledger.segment_name()
+    assert EventDeduper(backend).claim(parsed(event), segment, now=time.time() - 3600)
+    if appended:
+        row, _ = webhook_server.parse_trade_message(event["message"]["text"])
+        webhook_server.ledger.append([row], segment)
+
+
+@pytest.mark.parametrize("appended,compacted", [(False, False), (True, False), (True, True)])
+def test_crash_between_claim_and_complete(webhook, appended, compacted):
+    from webhook.dedupe import EventDeduper
+
+    webhook_server, client, backend = webhook
+    event = make_event(0)
+    crashed_claim(webhook_server, backend, event, appended)
+    if compacted:
+        # 重送前 compaction 已經把 segment 合併進 base、刪掉了
+        assert webhook_server.ledger.compact() == 1
+
+    # 新的 instance 收到重送：pending 標記已過 lease
+    webhook_server.deduper = EventDeduper(backend)
+    replay(webhook_server, client, [[make_event(0, redelivery=True)]])
+    replay(webhook_server, client, [[make_event(0, redelivery=True)]])
+
+    assert len(ledger_rows(webhook_server)) == 1
+    assert len(webhook_server.line_api.replies) == (0 if appended else 1)
+    marker = backend.read(webhook_server.deduper.marker(parsed(event)))
+    assert json.loads(marker.data)["state"] == "done"
+
+
+def test_fresh_pending_marker_is_not_retaken(webhook):
+    from webhook.dedupe import EventDeduper
+
+    webhook_server, client, backend = webhook
+    event = make_event(0)
+    # 另一個 instance 剛 claim、還在處理中
+    assert EventDeduper(backend).claim(parsed(event), webhook_server.ledger.segment_name())
+    webhook_server.deduper = EventDeduper(backend)
+    replay(webhook_server, client, [[make_event(0, redelivery=True)]])
+    assert ledger_rows(webhook_server) == []
+
+
+def test_claim_error_replies_to_that_user_only(webhook, monkeypatch):
+    """claim 丟例外（storage 錯誤）→ 該事件不寫入、回覆錯誤；同一批的其他事件照常寫入"""
+    webhook_server, client, backend = webhook
+    claim = webhook_server.deduper.claim
+
+    def flaky_claim(event, segment=None, now=None):
+        if event.webhook_event_id == make_event(1)["webhookEventId"]:
+            raise OSError("storage unavailable")
+        return claim(event, segment, now)
+
+    monkeypatch.setattr(webhook_server.deduper, "claim", flaky_claim)
+    replay(webhook_server, client, [[make_event(0), make_event(1)]])
+
+    assert len(ledger_rows(webhook_server)) == 1
+    assert "✔" in webhook_server.line_api.texts["token-0"]
+    assert "❌ 錯誤：storage unavailable" in webhook_server.line_api.texts["token-1"]
+
+    # LINE 重送 → 可以重試
+    monkeypatch.setattr(webhook_server.deduper, "claim", claim)
+    replay(webhook_server, client, [[make_event(1, redelivery=True)]])
+    assert len(ledger_rows(webhook_server)) == 2
+
+
+def test_live_apply_error_still_replies(webhook, monkeypatch):
+    """寫入後接不上記憶體中的持倉 → 回覆照常，丟掉該持倉讓下次查詢重新載入"""
+    webhook_server, client, _ = webhook
+
+    class BrokenLive:
+        def apply(self, rows, segment):
+            raise ValueError("bad row")
+
+    monkeypatch.setitem(webhook_server.live_portfolios, None, BrokenLive())
+    replay(webhook_server, client, [[make_event(0)]])
+
+    assert len(ledger_rows(webhook_server)) == 1
+    assert "✔" in webhook_server.line_api.texts["token-0"]
+    assert None not in webhook_server.live_portfolios
+
+
+def test_unknown_user_leaves_no_marker(webhook, monkeypatch):
+    """多使用者模式的群組訊息（沒有 user_id）不寫入，也不能留下 pending 標記"""
+    from webhook.dedupe import DEDUPE_PREFIX
+
+    webhook_server, client, backend = webhook
+    monkeypatch.setattr(webhook_server, "MULTI_PORTFOLIO", True)
+    event = make_event(0)
+    event["source"] = {"type": "group", "groupId": "Gbench"}
+    replay(webhook_server, client, [[event]])
+
+    assert "無法辨識使用者" in webhook_server.line_api.texts["token-0"]
+    assert backend.list(DEDUPE_PREFIX) == []
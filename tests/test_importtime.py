@@ -0,0 +1,27 @@
+"""
+冷啟動的 import 預算（bench.importtime 解析 `python -X importtime` 的輸出）
+IMPORTTIME_BUDGET_SCALE=2 → 較慢的機器 / CI 放寬預算
+"""
+import os
+
+import pytest
+
+from bench.importtime import ENTRY_POINTS, fastest, loaded
+
+BUDGET_SCALE = float(os.getenv("IMPORTTIME_BUDGET_SCALE", "1"))
+
+
+@pytest.mark.parametrize("module", list(ENTRY_POINTS))
+def test_import_budget(module):
+    budget, forbidden = ENTRY_POINTS[module]
+    total, times = fastest(module)
+
+    assert {package: loaded(times, package) for package in forbidden if loaded(times, package)} == {}
+    assert total <= budget * BUDGET_SCALE, f"import {module}: {total:.0f} ms > {budget * BUDGET_SCALE:.0f} ms"
+
+
+def test_parse_importtime_output():
+    times = fastest("json", repeat=1)[1]
+    total, depth = times["json"]
+    assert depth == 0 and total > 0
+    assert times["json.decoder"][1] == 1
@@ -0,0 +1,43 @@
+"""AppendOnlyLedger 的 compaction：已合併清單放得進 GCS 的 metadata 上限，segment 不遺失、不重複"""
+import json
+
+from storage.gcs import METADATA_LIMIT
+from storage.ledger import MAX_SEGMENTS_PER_COMPACTION, AppendOnlyLedger, GCSLedgerBackend, portfolio_base
+
+USER_ID = "U" + "f" * 32
+
+
+def make_ledger(store):
+    return AppendOnlyLedger(GCSLedgerBackend("test", store), portfolio_base("trades.csv", USER_ID))
+
+
+def test_compaction_metadata_fits_gcs_limit(store):
+    ledger = make_ledger(store)
+    n = MAX_SEGMENTS_PER_COMPACTION * 2 + 7
+    for i in range(n):
+        ledger.append([{"date": "2025-01-02", "code": str(1000 + i), "action": "BUY", "value": "10"}])
+
+    merged = []
+    while True:
+        count = ledger.compact()
+        if not count:
+            break
+        merged.append(count)
+        metadata = store.stat("test", ledger.base).metadata
+        assert sum(len(k) + len(v) for k, v in metadata.items()) <= METADATA_LIMIT
+
+    assert sum(merged) == n
+    assert ledger.pending() == []
+    rows = ledger.read_bytes().decode().splitlines()[1:]
+    assert sorted(r.split(",")[1] for r in rows) == sorted(str(1000 + i) for i in range(n))
+
+
+def test_old_full_path_metadata_still_recognized(store):
+    """舊版 metadata 記完整路徑：沒刪掉的 segment 仍視為已合併"""
+    ledger = make_ledger(store)
+    name = ledger.append([{"date": "2025-01-02", "code": "2330", "action": "BUY", "value": "600"}])
+    data = ledger.read_bytes()
+    store.write("test", ledger.base, data, metadata={"compacted": json.dumps([name])})
+
+    assert ledger.version()[1] == ()
+    assert ledger.read_bytes() == data
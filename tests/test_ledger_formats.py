@@ -0,0 +1,42 @@
+"""同一份 ledger 存成 CSV 或 Parquet，重播的結果必須相同（日期格式不能影響報表）"""
+import io
+
+from datetime import datetime, timedelta
+
+from core.price import LocalPriceProvider
+from core.trade_parser import load_ledger, replay_trades
+from storage.parquet_ledger import csv_to_table, read_table, table_to_bytes, to_ledger_frame
+
+TODAY = datetime.today()
+# webhook 寫入 YYYY/MM/DD；手動輸入的可能是 YYYY-MM-DD 或月日沒補零
+WEBHOOK_TODAY = TODAY.strftime("%Y/%m/%d")
+YESTERDAY = (TODAY - timedelta(days=1)).strftime("%Y-%m-%d")
+SHORT_TODAY = f"{TODAY.year}/{TODAY.month}/{TODAY.day}"
+
+LEDGER = (
+    "date,code,action,value,qty,fee\n"
+    "2025-01-02,2330,BUY,500,1000,\n"
+    f"{WEBHOOK_TODAY},2330,SELL,520,1000,\n"
+    "2025/01/03,2317,BUY,null,,\n"
+    f"{YESTERDAY},2317,SELL,110,,\n"
+    "2025/1/6,2454,BUY,900,2000,\n"
+    f"{SHORT_TODAY},2454,REDUCE,950,500,\n"
+).encode()
+
+
+def replay(source):
+    completed, open_buys, _ = replay_trades(source, LocalPriceProvider({"2317": 105.0, "2454": 930.0}))
+    return completed, open_buys
+
+
+def test_csv_dates_match_parquet():
+    frame = to_ledger_frame(read_table(table_to_bytes(csv_to_table(LEDGER))))
+    assert load_ledger(io.BytesIO(LEDGER))["date"].tolist() == frame["date"].tolist()
+
+
+def test_same_report_for_csv_and_parquet():
+    csv_result = replay(LEDGER)
+    parquet_result = replay(to_ledger_frame(read_table(table_to_bytes(csv_to_table(LEDGER)))))
+    assert csv_result == parquet_result
+    # 今天 / 昨天的 SELL 都列入報表，不論日期寫法
+    assert [t["code"] for t in csv_result[0]] == ["2330", "2317", "2454"]
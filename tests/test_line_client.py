@@ -0,0 +1,85 @@
+"""LINE 送出端（notify.line_client）對本機的 mock LINE server：重試、retry key、outbox"""
+import random
+
+import pytest
+
+from bench.bench_line import TOKEN, MockLine, delivery_errors, make_reports, serve
+
+
+@pytest.fixture
+def mock_line(store, monkeypatch):
+    from notify import line_client
+
+    mock = MockLine(seed=0)
+    server, url = serve(mock)
+    # outbox 放在 MemoryStore（與 ledger 同一個 backend）
+    monkeypatch.setenv("LEDGER_BACKEND", "gcs")
+    monkeypatch.setenv("GCS_BUCKET", "test")
+    monkeypatch.setenv("LINE_CHANNEL_TOKEN", TOKEN)
+    monkeypatch.setattr(line_client, "LINE_API", url)
+    monkeypatch.setattr(line_client, "OUTBOX", True)
+    line_client.reset_clients()
+    yield mock
+    line_client.reset_clients()
+    server.shutdown()
+    server.server_close()
+
+
+def outbox(store):
+    from notify.line_client import OUTBOX_PREFIX
+
+    return store.list("test", OUTBOX_PREFIX)
+
+
+def test_flaky_server_delivers_each_message_once(mock_line, store):
+    from notify import push_bot
+
+    mock_line.error_rate, mock_line.drop_rate, mock_line.throttle_at = 0.1, 0.05, 20
+    reports = make_reports(60, random.Random(0))
+    statuses = push_bot.push_messages(reports)
+
+    assert all(push_bot._ok(s) for s in statuses.values())
+    assert delivery_errors(mock_line, reports) == (set(), [])
+    assert mock_line.status.get(429, 0) > 0 and mock_line.status.get(500, 0) > 0
+    assert outbox(store) == []
+
+
+def test_outage_goes_to_outbox_and_next_run_drains_it(mock_line, store):
+    from notify import line_client, push_bot
+
+    mock_line.outage = True
+    reports = make_reports(20, random.Random(1))
+    statuses = push_bot.push_messages(reports)
+    assert not any(push_bot._ok(s) for s in statuses.values())
+    queued = len(outbox(store))
+    assert queued > 0
+
+    # 下一次執行：新的 client 先送出 outbox；部分回應遺失也不重複推播
+    mock_line.outage = False
+    mock_line.drop_rate = 0.2
+    line_client.reset_clients()
+    client = line_client.get_client(TOKEN)
+
+    assert outbox(store) == []
+    assert client.stats["outboxed"] == 0
+    assert delivery_errors(mock_line, reports) == (set(), [])
+
+
+def test_rejected_push_is_not_queued(mock_line, store, monkeypatch):
+    from notify import push_bot
+
+    monkeypatch.setenv("LINE_CHANNEL_TOKEN", "wrong-token")
+    statuses = push_bot.push_messages([("U1", "hello")])
+    assert statuses == {"U1": 401}
+    assert mock_line.requests == 1
+    assert outbox(store) == []
+
+
+def test_connections_are_pooled(mock_line):
+    from notify.line_client import LineClient
+
+    client = LineClient(TOKEN, pool_size=4, rate=None)
+    for i in range(50):
+        assert client.send("push", {"to": f"U{i}", "messages": [{"type": "text", "text": "hi"}]}) == 200
+    client.close()
+    assert mock_line.connections == 1
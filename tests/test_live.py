@@ -0,0 +1,74 @@
+"""webhook 查詢路徑（core.live.LivePortfolio）：記憶體中的持倉必須與完整重播相同"""
+import pytest
+
+
+class Event:
+    source = None
+
+
+@pytest.fixture
+def live(store, stub_names, monkeypatch):
+    from bench.synthetic import make_ledger
+    from core.live import LivePortfolio, QuoteCache
+    from core.price import LocalPriceProvider
+    from storage.ledger import AppendOnlyLedger, GCSLedgerBackend
+    from webhook import webhook_server
+
+    df, prices = make_ledger(2000, 30)
+    store.write("test", "trades.csv", df.to_csv(index=False))
+    ledger = AppendOnlyLedger(GCSLedgerBackend("test", store))
+    provider = LocalPriceProvider({c: p[0] for c, p in prices.items()})
+    live = LivePortfolio(ledger, QuoteCache(provider), check_interval=60)
+    monkeypatch.setitem(webhook_server.live_portfolios, None, live)
+    return live, ledger, provider, df["code"].iloc[-1]
+
+
+def query(text):
+    from webhook import webhook_server
+
+    return "\n".join(webhook_server.answer_query(Event(), webhook_server.parse_query(text)))
+
+
+def full_replay(ledger, provider):
+    from core.live import QuoteCache
+    from core.trade_parser import replay_trades
+
+    completed, open_buys, _ = replay_trades(ledger.read_bytes(), QuoteCache(provider))
+    return completed, open_buys
+
+
+def test_live_matches_full_replay(live):
+    live, ledger, provider, _ = live
+    query("持倉")
+    assert live.loads == 1
+    assert (live.completed, live.open_buys) == full_replay(ledger, provider)
+
+
+def test_warm_queries_do_not_touch_storage(live, store):
+    live, _, _, code = live
+    query("持倉")
+    before = dict(store.calls)
+    for text in ["持倉", "報告", code]:
+        query(text)
+    assert store.calls == before
+
+
+def test_apply_and_foreign_write(live):
+    from core.trade_parser import valid_sell_dates
+
+    live, ledger, provider, code = live
+    query("持倉")
+
+    # webhook 自己寫入 → apply，不重新載入
+    row = {"date": valid_sell_dates().pop(), "code": code, "action": "BUY", "value": "123.45"}
+    live.apply([row], ledger.append([row]))
+    assert "123.45" in query(code)
+    assert live.loads == 1
+
+    # 其他 instance 寫入 → 版本變了才重新載入
+    ledger.append([dict(row, value="99.5")])
+    live.checked_at -= live.check_interval
+    assert "99.50" in query(code)
+    assert live.loads == 2
+
+    assert (live.completed, live.open_buys) == full_replay(ledger, provider)
@@ -0,0 +1,76 @@
+"""CallPolicy：只重試暫時性的失敗；逾時的呼叫跑完之前仍佔著併發名額"""
+import threading
+import time
+
+import pytest
+import requests
+
+from core.ratelimit import CallPolicy, ProviderError
+
+
+def policy(**kwargs):
+    return CallPolicy("test", **dict(dict(retries=2, backoff=0.001), **kwargs))
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize("error, attempts", [
+    (ValueError("bad symbol"), 1),
+    (http_error(404), 1),
+    (http_error(503), 3),
+    (http_error(429), 3),
+    (requests.ConnectionError("reset"), 3),
+    (requests.Timeout("read timeout"), 3),
+])
+def test_only_transient_errors_are_retried(error, attempts):
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise error
+
+    with pytest.raises(ProviderError):
+        policy().call(fail)
+    assert len(calls) == attempts
+
+
+def test_transient_error_then_success():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise requests.ConnectionError("reset")
+        return "ok"
+
+    assert policy().call(flaky) == "ok"
+
+
+def test_timed_out_calls_keep_their_slot():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.3)
+        with lock:
+            running[0] -= 1
+
+    shared = policy(max_concurrency=2, timeout=0.05)
+
+    def call():
+        with pytest.raises(ProviderError):
+            shared.call(slow)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] <= 2
@@ -0,0 +1,87 @@
+"""快照接續（replay_trades / replay_trades_stream）：結果必須與完整重播相同，包含 null 價格的列"""
+import io
+import json
+
+import pytest
+
+from core.price import LocalPriceProvider
+from core.trade_parser import TODAY, replay_trades
+from core.stream import replay_trades_stream
+
+HEAD = (
+    "date,code,action,value,qty,fee\n"
+    "2025-01-02,2330,BUY,null,,\n"
+    f"{TODAY},2330,REDUCE,null,,\n"
+    "2025-01-03,2317,BUY,100,,\n"
+    "2025-01-04,2454,KEEP,null,2000,\n"
+    "2025-01-05,2454,SELL,950,500,\n"
+    "2025-01-04,1101,BUY,null,,\n"
+    "2025-01-05,1101,SELL,40,,\n"
+).encode()
+TAIL = (
+    f"{TODAY},2317,SELL,110,,\n"
+    "2025-01-05,2603,BUY,null,,\n"
+    "2025-01-06,2454,KEEP,null,1000,\n"
+).encode()
+
+CLOSES = {"2330": 500.0, "2454": 900.0, "1101": 42.0, "2603": 50.0}
+MOVED = {"2330": 520.0, "2454": 880.0, "1101": 45.0, "2603": 55.0}
+
+REPLAYS = {
+    "bytes": lambda data, provider, path: replay_trades(data, provider, path),
+    "stream": lambda data, provider, path: replay_trades_stream(lambda: io.BytesIO(data), provider, path),
+}
+
+
+@pytest.fixture(params=list(REPLAYS))
+def replay(request):
+    return REPLAYS[request.param]
+
+
+def positions(result):
+    completed, open_buys, _ = result
+    return completed, open_buys
+
+
+@pytest.mark.parametrize("closes", [CLOSES, MOVED], ids=["same-close", "moved-close"])
+def test_resume_matches_full_replay(replay, tmp_path, closes, capsys):
+    """收盤價變了也接續快照（只重播追蹤代號），不做完整重算"""
+    path = str(tmp_path / "snapshot.json")
+    replay(HEAD, LocalPriceProvider(CLOSES), path)
+    capsys.readouterr()
+
+    provider = LocalPriceProvider(closes)
+    resumed = replay(HEAD + TAIL, provider, path)
+    assert "完整重算" not in capsys.readouterr().out
+    assert positions(resumed) == positions(replay(HEAD + TAIL, provider, None))
+
+    # 再接續一次（沒有新資料）也相同
+    assert positions(replay(HEAD + TAIL, provider, path)) == positions(resumed)
+
+
+def test_only_codes_still_using_close_are_tracked(replay, tmp_path):
+    """null 列已平倉且不在報表上（1101）→ 不追蹤；仍未平倉 / REDUCE 列在報表上 → 追蹤"""
+    path = tmp_path / "snapshot.json"
+    replay(HEAD + TAIL, LocalPriceProvider(CLOSES), str(path))
+    snapshot = json.loads(path.read_text())
+
+    assert set(snapshot["tracked"]) == {"2330", "2454", "2603"}
+    assert not set(snapshot["tracked"]) & set(snapshot["open_buys"])
+    assert [t["code"] for t in snapshot["completed"] if t.get("replay")] == ["2330"]
+
+
+def test_repo_ledger_resumes_after_closes_move(replay, tmp_path, capsys):
+    """data/trades.csv（大量 KEEP null）：隔天收盤價全變了，仍接續快照"""
+    with open("data/trades.csv", "rb") as f:
+        data = f.read()
+    head = data[:data.rfind(b"\n", 0, len(data) - 1) + 1]
+    codes = {line.split(b",")[1].decode() for line in data.splitlines()[1:]}
+
+    path = str(tmp_path / "snapshot.json")
+    replay(head, LocalPriceProvider({c: 100.0 for c in codes}), path)
+    capsys.readouterr()
+
+    provider = LocalPriceProvider({c: 100.0 + i for i, c in enumerate(sorted(codes))})
+    resumed = replay(data, provider, path)
+    assert "完整重算" not in capsys.readouterr().out
+    assert positions(resumed) == positions(replay(data, provider, None))
@@ -0,0 +1,42 @@
+"""collect_price_codes：跑 ledger 之前找出的代號必須涵蓋所有未平倉（引擎略過的列不算出場）"""
+import io
+
+import pytest
+
+from core.price import LocalPriceProvider
+from core.stream import replay_trades_stream
+from core.trade_parser import TODAY, collect_price_codes, load_ledger, replay_trades
+
+LEDGER = (
+    "date,code,action,value,qty,fee\n"
+    # 價格打錯的 SELL 被略過 → 仍有持倉
+    "2025-01-02,2330,BUY,500,,\n"
+    f"{TODAY},2330,SELL,abc,,\n"
+    # 部分出場 → 仍有持倉
+    "2025-01-02,2317,BUY,100,2000,\n"
+    f"{TODAY},2317,SELL,110,1000,\n"
+    # 股數為 0 的買進被略過 → 已平倉
+    "2025-01-02,2454,BUY,900,,\n"
+    f"{TODAY},2454,SELL,950,,\n"
+    "2025-01-03,2454,BUY,920,0,\n"
+    # null 價格一律要查
+    "2025-01-02,2603,BUY,50,,\n"
+    f"{TODAY},2603,SELL,null,,\n"
+).encode()
+
+CLOSES = {"2330": 510.0, "2317": 105.0, "2454": 930.0, "2603": 55.0}
+
+
+def test_collect_price_codes_covers_open_positions():
+    codes = collect_price_codes(load_ledger(io.BytesIO(LEDGER)))
+    assert set(codes) == {"2330", "2317", "2603"}
+
+
+@pytest.mark.parametrize("replay", [
+    lambda provider: replay_trades(LEDGER, provider),
+    lambda provider: replay_trades_stream(lambda: io.BytesIO(LEDGER), provider),
+], ids=["bytes", "stream"])
+def test_every_open_position_has_a_close(replay):
+    _, open_buys, prices = replay(LocalPriceProvider(CLOSES))
+    assert set(open_buys) == {"2330", "2317"}
+    assert all(prices[code][0] == CLOSES[code] for code in open_buys)
@@ -1,8 +1,9 @@
 import pandas as pd
-from google.cloud import storage
 import io
 import os
 
+from storage.gcs import get_store, read_object
+
 BUCKET_NAME = os.getenv("GCS_BUCKET")
 CSV_FILE = os.getenv("GCS_CSV_PATH", "trades.csv")
 
@@ -11,27 +12,24 @@ if not BUCKET_NAME:
 
 
 def get_gcs_client():
-    """建立 GCS Client（預設使用 Cloud Run 的 service account）"""
-    return storage.Client()
+    """共用的 GCS Client（每個 process 只建立一次，預設使用 Cloud Run 的 service account）"""
+    return get_store().client
 
 
 def read_csv_from_gcs():
     """
     從 GCS 讀取 trades.csv
     若不存在 → 回傳空 DataFrame
+    內容沒變時（generation 相同）不會重新下載
     """
 
-    client = get_gcs_client()
-    bucket = client.bucket(BUCKET_NAME)
-    blob = bucket.blob(CSV_FILE)
+    obj = read_object(BUCKET_NAME, CSV_FILE)
 
-    if not blob.exists():
+    if obj is None:
         print("⚠ GCS CSV 不存在，建立新空白 CSV...")
         return pd.DataFrame(columns=["date", "code", "action", "value"])
 
-    csv_bytes = blob.download_as_bytes()
-    
-    df = pd.read_csv(io.BytesIO(csv_bytes), dtype=str)
+    df = pd.read_csv(io.BytesIO(obj.data), dtype=str)
     df = df.fillna("null")
     return df
 
@@ -45,12 +43,8 @@ def write_csv_to_gcs(df: pd.DataFrame):
     
     df["code"] = df["code"].str.replace(".0", "", regex=False)
 
-    client = get_gcs_client()
-    bucket = client.bucket(BUCKET_NAME)
-    blob = bucket.blob(CSV_FILE)
-
     csv_buffer = io.StringIO()
     df.to_csv(csv_buffer, index=False)
 
-    blob.upload_from_string(csv_buffer.getvalue(), content_type="text/csv")
-    print(f"✔ CSV 已成功寫回 GCS：gs://{BUCKET_NAME}/{CSV_FILE}")
\ No newline at end of file
+    get_store().write(BUCKET_NAME, CSV_FILE, csv_buffer.getvalue(), content_type="text/csv")
+    print(f"✔ CSV 已成功寫回 GCS：gs://{BUCKET_NAME}/{CSV_FILE}")
@@ -0,0 +1,151 @@
+import csv
+import io
+import os
+
+from core.stock_index import CODE_PATTERN, get_stock_index
+
+# 一次匯入的上限（多行訊息 / CSV 檔）
+MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "10000"))
+MAX_FILE_SIZE = int(os.getenv("BULK_MAX_FILE_SIZE", str(2 * 1024 * 1024)))
+
+# 回覆裡最多列出幾行錯誤
+MAX_ERRORS_SHOWN = 20
+
+ACTIONS = ["BUY", "KEEP", "SELL", "REDUCE"]
+FIELDS = ["date", "code", "action", "value", "qty", "fee"]
+
+# 依序檢查，每行只回報第一個錯誤
+FORMAT_ERROR = "格式錯誤：需為 日期, 代號, 動作, 價格[, 股數[, 手續費]]"
+DATE_ERROR = "日期格式錯誤：YYYY/MM/DD"
+ACTION_ERROR = f"動作需為 {' / '.join(ACTIONS)}"
+VALUE_ERROR = "價格需為數字或 null"
+LOT_ERROR = "股數需為正數、手續費不可為負"
+
+
+# ============================================================
+# 批次匯入：多行文字訊息 / LINE 檔案訊息（CSV）
+#
+# 所有行先組成一個 DataFrame，欄位檢查都是整欄的向量化運算
+# （規則與 parse_trade_message 相同，另外檢查動作與價格）；
+# 公司名稱 → 代號只對「不重複的名稱」各查一次索引。
+# 通過的列交給 process_batch，與同一批的其他訊息一起寫成一個 segment
+# ============================================================
+def read_records(text):
+    """文字 / CSV 內容 → [(行號, [欄位, ...]), ...]；空行、# 開頭的行略過"""
+    records = []
+    reader = csv.reader(io.StringIO(text), skipinitialspace=True)
+    for fields in reader:
+        fields = [f.strip() for f in fields]
+        if not any(fields) or fields[0].startswith("#"):
+            continue
+        records.append((reader.line_num, fields))
+    return records
+
+
+def decode_file(data):
+    """券商匯出的 CSV 常是 Big5（cp950）"""
+    for encoding in ("utf-8-sig", "cp950"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def is_header(fields):
+    first = fields[0].lower()
+    return first in ("date", "日期") or "date" in first
+
+
+def parse_bulk(text):
+    """→ (rows, errors)；rows 為 parse_trade_message 的 row 格式，errors = [(行號, 原因), ...]"""
+    import numpy as np
+    import pandas as pd
+
+    records = read_records(text)
+    if records and is_header(records[0][1]):
+        records = records[1:]
+
+    errors = []
+    if len(records) > MAX_ROWS:
+        errors.append((records[MAX_ROWS][0], f"超過 {MAX_ROWS} 行，之後的略過"))
+        records = records[:MAX_ROWS]
+    if not records:
+        return [], errors
+
+    line_no = np.array([n for n, _ in records])
+    n_fields = np.array([len(f) for _, f in records])
+    df = pd.DataFrame([(f + [""] * 6)[:6] for _, f in records], columns=FIELDS)
+
+    # ---- 日期（YYYY/MM/DD，也接受 YYYY-MM-DD）----
+    date = df["date"].str.replace("-", "/", regex=False)
+    bad_date = pd.to_datetime(date, format="%Y/%m/%d", errors="coerce").isna().to_numpy()
+
+    # ---- 代號（不是代號的當作公司名稱，查索引）----
+    code = df["code"].str.replace(".0", "", regex=False).str.upper()
+    is_code = code.str.fullmatch(CODE_PATTERN.pattern).to_numpy()
+    code_errors = {}
+    if not is_code.all():
+        resolved = {}
+        index = get_stock_index()
+        for name in pd.unique(code[~is_code]):
+            match, candidates = index.resolve(name)
+            if match:
+                resolved[name] = match
+            elif candidates:
+                code_errors[name] = f"「{name}」對到多檔股票：" + "、".join(f"{c} {n}" for c, n in candidates[:3])
+            else:
+                code_errors[name] = f"找不到股票：{name}"
+        code = code.where(is_code, code.map(resolved).fillna(code))
+    bad_code = code.isin(list(code_errors)).to_numpy() | (code == "").to_numpy()
+
+    # ---- 動作 / 價格 / 股數 / 手續費 ----
+    action = df["action"].str.upper()
+    bad_action = ~action.isin(ACTIONS).to_numpy()
+
+    value = df["value"]
+    is_null = value.str.lower().isin(["", "none", "null"])
+    value = value.where(~is_null, "null")
+    bad_value = (~is_null & pd.to_numeric(value.where(~is_null), errors="coerce").isna()).to_numpy()
+
+    qty = pd.to_numeric(df["qty"].where(df["qty"] != ""), errors="coerce")
+    fee = pd.to_numeric(df["fee"].where(df["fee"] != ""), errors="coerce")
+    bad_lots = (
+        ((df["qty"] != "") & ~(qty > 0)) | ((df["fee"] != "") & ~(fee >= 0))
+    ).to_numpy()
+
+    # ---- 每行第一個錯誤 ----
+    bad_format = (n_fields < 4) | (n_fields > 6)
+    checks = [bad_format, bad_date, bad_code, bad_action, bad_value, bad_lots]
+    reason = np.select(checks, ["format", "date", "code", "action", "value", "lots"], default="")
+    messages = {"format": FORMAT_ERROR, "date": DATE_ERROR, "action": ACTION_ERROR,
+                "value": VALUE_ERROR, "lots": LOT_ERROR}
+
+    for i in np.flatnonzero(reason != ""):
+        if reason[i] == "code":
+            errors.append((int(line_no[i]), code_errors.get(code.iat[i], "缺少代號")))
+        else:
+            errors.append((int(line_no[i]), messages[reason[i]]))
+    errors.sort()
+
+    ok = reason == ""
+    columns = [date[ok].tolist(), code[ok].tolist(), action[ok].tolist(), value[ok].tolist()]
+    rows = []
+    for d, c, a, v, q, f in zip(*columns, df["qty"][ok].tolist(), df["fee"][ok].tolist()):
+        row = {"date": d, "code": c, "action": a, "value": v}
+        if q:
+            row["qty"] = q
+        if f:
+            row["fee"] = f
+        rows.append(row)
+    return rows, errors
+
+
+def bulk_reply(source, rows, errors):
+    """收到 N 列：成功 / 失敗，列出前 MAX_ERRORS_SHOWN 個錯誤"""
+    lines = [f"收到{source}：可匯入 {len(rows)} 列" + (f"，{len(errors)} 行有誤（未匯入）" if errors else "")]
+    for line_no, reason in errors[:MAX_ERRORS_SHOWN]:
+        lines.append(f"第 {line_no} 行：{reason}")
+    if len(errors) > MAX_ERRORS_SHOWN:
+        lines.append(f"…其餘 {len(errors) - MAX_ERRORS_SHOWN} 行省略")
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from storage.gcs import PreconditionFailed
+from storage.ledger import segment_written
+
+# 記憶體中記住最近幾個 webhookEventId（同一個 instance 的重送不必碰 storage）
+DEDUPE_CACHE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_CACHE_SIZE", "10000"))
+
+# 已處理事件的標記：<prefix><事件日期 YYYYMMDD>/<webhookEventId>（與 ledger 同一個 backend）
+DEDUPE_PREFIX = "webhook_events/"
+
+# prune 保留幾天的標記（LINE 只會重送近期的事件）
+DEDUPE_KEEP_DAYS = int(os.getenv("WEBHOOK_DEDUPE_KEEP_DAYS", "7"))
+
+# pending 標記超過幾秒仍未完成 → 視為處理中的 instance 已經掛掉，重送可以接手
+DEDUPE_LEASE = float(os.getenv("WEBHOOK_DEDUPE_LEASE", "120"))
+
+
+# ============================================================
+# webhookEventId 去重
+#
+# LINE 在 /callback 太慢或失敗時會重送同一個事件（webhookEventId 相同、
+# deliveryContext.isRedelivery=true），每次重送都會多寫一列交易。
+#
+# - seen()：callback 收到時先查記憶體 LRU（不碰 storage），已收過的直接丟掉
+# - claim()：worker 寫入 ledger 前，以 create-only（if_generation_match=0）
+#   建立 pending 標記，內容記下這批要寫入的 segment 名稱
+# - complete()：segment 寫入成功後把標記改成 done；之後的重送一律丟掉
+# - release()：寫入 ledger 失敗時刪掉標記，讓 LINE 的下一次重送可以重試
+#
+# claim 之後、complete 之前 process 掛掉 → 標記停在 pending：
+# 超過 DEDUPE_LEASE 秒的 pending 標記，重送時先看它記下的 segment 寫入了沒
+# （還在 pending/ 或已合併進 base → 其實已經寫入，補成 done 並丟掉重送；
+#   都不是 → 以 generation-match 接手重寫）
+# base 的 metadata 只記最近一次 compaction 合併的 segment，lease 要遠短於 compaction 的間隔
+# ============================================================
+class EventDeduper:
+    def __init__(self, backend=None, prefix=DEDUPE_PREFIX, maxsize=DEDUPE_CACHE_SIZE):
+        """backend 為 None → 只用記憶體 LRU（單一 instance、重啟後不保留）"""
+        self.backend = backend
+        self.prefix = prefix
+        self.maxsize = maxsize
+        self.recent = OrderedDict()
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    # ---- 記憶體 LRU ----
+    def seen(self, event):
+        """已收過 → True（並計入 duplicates）；否則記下來 → False；沒有 webhookEventId 一律 False"""
+        event_id = webhook_event_id(event)
+        if event_id is None:
+            return False
+        with self._lock:
+            if event_id in self.recent:
+                self.recent.move_to_end(event_id)
+                self.duplicates += 1
+                return True
+            self._remember(event_id)
+            return False
+
+    def _remember(self, event_id):
+        self.recent[event_id] = True
+        if len(self.recent) > self.maxsize:
+            self.recent.popitem(last=False)
+
+    def forget(self, event):
+        """事件最後沒處理（例如 queue 滿了回 503）→ 讓重送可以再進來"""
+        with self._lock:
+            self.recent.pop(webhook_event_id(event), None)
+
+    # ---- 持久化標記 ----
+    def marker(self, event):
+        timestamp = getattr(event, "timestamp", None)
+        day = time.strftime("%Y%m%d", time.gmtime(timestamp / 1000 if timestamp else None))
+        return f"{self.prefix}{day}/{webhook_event_id(event)}"
+
+    def claim(self, event, segment=None, now=None):
+        """寫入 ledger 前呼叫；→ False 代表已經處理過 / 正在處理（重複事件，計入 duplicates）"""
+        if self.backend is None or webhook_event_id(event) is None:
+            return True
+        name = self.marker(event)
+        now = now or time.time()
+        pending = json.dumps({"state": "pending", "segment": segment, "at": now}).encode("utf-8")
+        try:
+            self.backend.write(name, pending, if_generation_match=0)
+            return True
+        except PreconditionFailed:
+            pass
+
+        existing = self.backend.read(name)
+        if existing is None:
+            # 剛好被 release → 再建一次
+            return self.claim(event, segment, now)
+        state = marker_state(existing.data)
+        if state["state"] == "pending" and now - state["at"] >= DEDUPE_LEASE:
+            if state["segment"] and segment_written(self.backend, state["segment"]):
+                # 上一次寫入成功、只是沒來得及標成 done
+                self._write_done(name, state["segment"])
+            else:
+                try:
+                    self.backend.write(name, pending, if_generation_match=existing.generation)
+                    print(f"♻ Retaking stale dedupe marker {name}")
+                    return True
+                except PreconditionFailed:
+                    pass  # 另一個重送先接手了
+
+        with self._lock:
+            self.duplicates += 1
+        return False
+
+    def complete(self, event, segment):
+        """segment 寫入成功 → 標記改成 done"""
+        if self.backend is not None and webhook_event_id(event) is not None:
+            self._write_done(self.marker(event), segment)
+
+    def _write_done(self, name, segment):
+        self.backend.write(name, json.dumps({"state": "done", "segment": segment}).encode("utf-8"))
+
+    def release(self, event):
+        """ledger 寫入失敗 → 刪除標記、移出 LRU"""
+        self.forget(event)
+        if self.backend is not None and webhook_event_id(event) is not None:
+            self.backend.delete(self.marker(event))
+
+    def prune(self, keep_days=DEDUPE_KEEP_DAYS, now=None):
+        """刪除 keep_days 天以前的標記 → 刪除的數量"""
+        if self.backend is None:
+            return 0
+        cutoff = time.strftime("%Y%m%d", time.gmtime((now or time.time()) - keep_days * 86400))
+        days = sorted({name[len(self.prefix):].split("/")[0] for name in self.backend.list(self.prefix)})
+
+        deleted = 0
+        for day in days:
+            if day >= cutoff:
+                break
+            for name in self.backend.list(f"{self.prefix}{day}/"):
+                self.backend.delete(name)
+                deleted += 1
+        return deleted
+
+
+def webhook_event_id(event):
+    return getattr(event, "webhook_event_id", None)
+
+
+def marker_state(data):
+    """標記內容 → {"state", "segment", "at"}；舊版的空標記視為 done"""
+    if not data:
+        return {"state": "done", "segment": None, "at": 0.0}
+    state = json.loads(data)
+    return {"state": state.get("state", "done"), "segment": state.get("segment"), "at": state.get("at", 0.0)}
+
+
+# ============================================================
+# CLI：python -m webhook.dedupe prune [gcs|local]
+# ============================================================
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "prune":
+        print("usage: python -m webhook.dedupe prune [gcs|local]")
+        sys.exit(1)
+
+    from storage.ledger import open_backend
+
+    deleted = EventDeduper(open_backend(sys.argv[2] if len(sys.argv) > 2 else None)).prune()
+    print(f"[Dedupe] pruned {deleted} markers")
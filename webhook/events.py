@@ -0,0 +1,88 @@
+import base64
+import hashlib
+import hmac
+import json
+from types import SimpleNamespace
+
+
+# ============================================================
+# LINE webhook 事件解析
+#
+# webhook 只需要文字 / 檔案訊息的 reply_token / text / user_id，
+# TextEventParser 用標準函式庫驗證簽章、取出這幾個欄位，
+# 不必 import line-bot-sdk 的 webhook models（冷啟動約 0.3 秒）。
+# SDKTextEventParser 沿用 WebhookParser（FAST_STARTUP=false）。
+# 兩者都只回傳文字 / 檔案（批次匯入的 CSV）訊息事件，屬性名稱與 SDK 的 MessageEvent 相同。
+# ============================================================
+MESSAGE_TYPES = ("text", "file")
+
+
+def is_file_message(event):
+    return getattr(event.message, "type", "text") == "file"
+
+
+class InvalidSignatureError(Exception):
+    """X-Line-Signature 與 body 不符"""
+
+
+class TextEventParser:
+    def __init__(self, channel_secret):
+        self.channel_secret = channel_secret.encode("utf-8")
+
+    def verify(self, body, signature):
+        digest = hmac.new(self.channel_secret, body.encode("utf-8"), hashlib.sha256).digest()
+        return hmac.compare_digest(base64.b64encode(digest).decode("utf-8"), signature)
+
+    def parse(self, body, signature):
+        if not self.verify(body, signature):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+
+        events = []
+        for event in json.loads(body).get("events", []):
+            message = event.get("message") or {}
+            if event.get("type") != "message" or message.get("type") not in MESSAGE_TYPES:
+                continue
+
+            source = event.get("source") or {}
+            delivery = event.get("deliveryContext") or {}
+            events.append(SimpleNamespace(
+                reply_token=event.get("replyToken"),
+                timestamp=event.get("timestamp"),
+                webhook_event_id=event.get("webhookEventId"),
+                delivery_context=SimpleNamespace(is_redelivery=delivery.get("isRedelivery", False)),
+                source=SimpleNamespace(
+                    type=source.get("type"),
+                    user_id=source.get("userId"),
+                    group_id=source.get("groupId"),
+                    room_id=source.get("roomId"),
+                ),
+                message=SimpleNamespace(
+                    id=message.get("id"),
+                    type=message["type"],
+                    text=message.get("text", ""),
+                    file_name=message.get("fileName"),
+                    file_size=message.get("fileSize"),
+                ),
+            ))
+        return events
+
+
+class SDKTextEventParser:
+    def __init__(self, channel_secret):
+        from linebot.v3 import WebhookParser
+
+        self.parser = WebhookParser(channel_secret)
+
+    def parse(self, body, signature):
+        from linebot.v3.exceptions import InvalidSignatureError as SDKInvalidSignatureError
+        from linebot.v3.webhooks import FileMessageContent, MessageEvent, TextMessageContent
+
+        try:
+            events = self.parser.parse(body, signature)
+        except SDKInvalidSignatureError as e:
+            raise InvalidSignatureError(str(e)) from e
+
+        return [
+            e for e in events
+            if isinstance(e, MessageEvent) and isinstance(e.message, (TextMessageContent, FileMessageContent))
+        ]
@@ -1,59 +1,235 @@
+import asyncio
+import gc
+import importlib
 import os
-import uvicorn
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import PlainTextResponse
 
-from utils.gcs_csv import read_csv_from_gcs, write_csv_to_gcs
-
-from linebot.v3 import WebhookHandler
-from linebot.v3.messaging import MessagingApi, ApiClient, Configuration, TextMessage, ReplyMessageRequest
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from core.metrics import external, inc, observe, render_prometheus, span
+from core.stock_index import CODE_PATTERN, get_stock_index
+from storage.ledger import open_ledger
+from webhook.dedupe import EventDeduper
+from webhook.events import InvalidSignatureError, SDKTextEventParser, TextEventParser, is_file_message
 
-import pandas as pd
 from datetime import datetime
 
+# ------------------------------------------------------------
+# 寫入路徑（簽章驗證 → append segment → 回覆）只用到上面這些；
+# pandas（查詢用的持倉）、line-bot-sdk 的 messaging client 都在第一次用到時才 import
+# ------------------------------------------------------------
+
+# 背景 worker 設定
+QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+FLUSH_INTERVAL = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", "0.5"))
+MAX_BATCH = int(os.getenv("WEBHOOK_MAX_BATCH", "200"))
+
+# WEBHOOK_DEDUPE=true → 以 webhookEventId 去掉 LINE 的重送；
+# WEBHOOK_DEDUPE_STORE=true → 另外在 ledger 的 backend 留下標記（跨 instance / 重啟）
+DEDUPE = os.getenv("WEBHOOK_DEDUPE", "true").lower() == "true"
+DEDUPE_STORE = os.getenv("WEBHOOK_DEDUPE_STORE", "true").lower() == "true"
+
+# MULTI_PORTFOLIO=true → 每個 LINE 使用者寫進自己的 ledger（portfolios/<user_id>/）
+MULTI_PORTFOLIO = os.getenv("MULTI_PORTFOLIO", "false").lower() == "true"
+
+# FAST_STARTUP=true（預設）→ 標準函式庫驗證簽章 / 解析事件，啟動時不預先載入持倉；
+# false → 沿用 line-bot-sdk 的 WebhookParser，啟動時在背景載入持倉
+FAST_STARTUP = os.getenv("FAST_STARTUP", "true").lower() == "true"
+
+# METRICS_ENDPOINT=true 才開 Prometheus /metrics
+METRICS_ENDPOINT = os.getenv("METRICS_ENDPOINT", "false").lower() == "true"
+
+# LIVE_QUERIES=true → 「持倉」「報告」「<代號>」「<公司名稱>」直接由記憶體中的持倉回覆
+LIVE_QUERIES = os.getenv("LIVE_QUERIES", "true").lower() == "true"
+
+# WEBHOOK_GC_FREEZE=true → 啟動時 gc.collect() + gc.freeze()：import 進來的模組 / 類別移出 GC 追蹤，
+# 之後的 gen2 回收不必每次掃過（只在啟動時做一次；之後再 freeze 會把尚未回收的循環垃圾一起凍住）
+GC_FREEZE = os.getenv("WEBHOOK_GC_FREEZE", "false").lower() == "true"
+
+# 查詢指令（不寫入 ledger）
+QUERY_POSITIONS = {"持倉", "持股"}
+QUERY_REPORT = {"報告", "報表"}
+QUERY_CODE = CODE_PATTERN
+
+# 名稱搜尋最多列出幾個候選
+MAX_CANDIDATES = 5
+
 # ============================================================
-# INIT HANDLER (Must be global, cannot lazy init)
+# INIT PARSER (Must be global, cannot lazy init)
 # ============================================================
 channel_secret = os.getenv("LINE_CHANNEL_SECRET")
 
 if not channel_secret:
     print("❌ Missing LINE_CHANNEL_SECRET (env not loaded yet!)")
-    handler = None
+    parser = None
+elif FAST_STARTUP:
+    parser = TextEventParser(channel_secret)
 else:
-    handler = WebhookHandler(channel_secret)
+    parser = SDKTextEventParser(channel_secret)
+
+
+# ============================================================
+# QUEUE STATS（/stats）
+# ============================================================
+class WebhookStats:
+    def __init__(self, window=1000):
+        self.received = 0
+        self.processed = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, latency):
+        self.processed += 1
+        self.latencies.append(latency)
+
+    def to_dict(self, queue_depth):
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 4)
+
+        return {
+            "queue_depth": queue_depth,
+            "queue_size": QUEUE_SIZE,
+            "received": self.received,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "latency_p50": pct(0.50),
+            "latency_p99": pct(0.99),
+        }
+
+
+stats = WebhookStats()
+event_queue: asyncio.Queue | None = None
 
 
 # ============================================================
 # FASTAPI APP
 # ============================================================
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    global event_queue
+    event_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    worker = asyncio.create_task(event_worker())
+
+    # 背景工作要留著 reference（event loop 只保留 weak reference，沒人拿著可能做到一半被回收）
+    background = []
+
+    # messaging client 的 import 放到背景，不擋住啟動；第一個 callback 時多半已載入完
+    background.append(start_background("import_linebot", importlib.import_module, "linebot.v3.messaging"))
+
+    # 共用 ledger 先在背景載入，第一個查詢不必等完整重播
+    # （FAST_STARTUP 時延到第一個查詢，instance 只處理寫入就不會載入 pandas）
+    if LIVE_QUERIES and not MULTI_PORTFOLIO and not FAST_STARTUP:
+        background.append(start_background("warm_live", warm_live))
+
+    if GC_FREEZE:
+        gc.collect()
+        gc.freeze()
+
+    yield
+
+    # Cloud Run 關機前先把已收下的事件處理完
+    try:
+        await asyncio.wait_for(event_queue.join(), timeout=8)
+    except asyncio.TimeoutError:
+        print(f"⚠ Shutdown with {event_queue.qsize()} events still queued")
+    worker.cancel()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(worker, *background, return_exceptions=True)
+    if line_api_client is not None:
+        await line_api_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
 
-line_api: MessagingApi | None = None
+def start_background(name, fn, *args):
+    """在 thread 裡跑 fn 的 task；失敗時印出來（不會沒人 await 而默默吞掉）"""
+    task = asyncio.create_task(asyncio.to_thread(fn, *args), name=name)
+    task.add_done_callback(log_background_error)
+    return task
+
+
+def log_background_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"❌ Background task {task.get_name()} failed:", task.exception())
+
+# init_line_api() 第一次呼叫時才建立（import linebot.v3.messaging 約 0.7 秒）
+line_api_client = None
+line_api = None
+# 檔案訊息（批次匯入的 CSV）的內容下載
+line_api_blob = None
+
+# append-only ledger：每則訊息寫成一個 segment，不再整份 CSV 讀寫
+ledger = open_ledger()
+portfolio_ledgers = {}
+
+# 已收過的 webhookEventId（標記與 ledger 放在同一個 backend；事件 ID 全域唯一，不分使用者）
+deduper = EventDeduper(ledger.backend if DEDUPE_STORE else None)
+
+
+def ledger_for(user_id):
+    """MULTI_PORTFOLIO 時依使用者分開；否則所有人共用同一個 ledger"""
+    if not MULTI_PORTFOLIO:
+        return ledger
+    if user_id not in portfolio_ledgers:
+        portfolio_ledgers[user_id] = open_ledger(ledger.backend, user_id=user_id)
+    return portfolio_ledgers[user_id]
+
+
+# 查詢用的持倉狀態（與 ledger_for 一樣依使用者分開）；報價快取所有人共用
+quote_cache = None
+live_portfolios = {}
+
+
+def live_for(user_id):
+    global quote_cache
+    if user_id not in live_portfolios:
+        from core.live import LivePortfolio, QuoteCache
+
+        if quote_cache is None:
+            quote_cache = QuoteCache()
+        live_portfolios[user_id] = LivePortfolio(ledger_for(user_id), quote_cache)
+    return live_portfolios[user_id]
+
+
+def warm_live():
+    try:
+        live_for(None).refresh()
+    except Exception as e:
+        print("❌ Error loading live portfolio:", e)
 
 
 def init_line_api():
     """Lazy initialize Messaging API only."""
-    global line_api
+    global line_api, line_api_blob, line_api_client
     if line_api is None:
         token = os.getenv("LINE_CHANNEL_TOKEN")
         if not token:
             print("❌ Missing LINE_CHANNEL_TOKEN")
             return False
 
-        print("🔧 Creating Messaging API Client")
+        from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi, AsyncMessagingApiBlob, Configuration
+
+        print("🔧 Creating Async Messaging API Client")
         config = Configuration(access_token=token)
-        line_api = MessagingApi(ApiClient(config))
+        line_api_client = AsyncApiClient(config)
+        line_api = AsyncMessagingApi(line_api_client)
+        line_api_blob = AsyncMessagingApiBlob(line_api_client)
 
     return True
 
-# ============================================================
-# DECORATOR BINDING — The ONLY supported method in SDK v3
-# ============================================================
-if handler:
-    @handler.add(MessageEvent, message=TextMessageContent)
-    def _(event):
-        handle_text_message(event)
 
 # ============================================================
 # HEALTH CHECK
@@ -63,17 +239,29 @@ def health():
     return {"ok": True}
 
 
+@app.get("/stats")
+def queue_stats():
+    return stats.to_dict(event_queue.qsize() if event_queue else 0)
+
+
+if METRICS_ENDPOINT:
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 # ============================================================
 # WEBHOOK ENDPOINT
+# 驗證簽章 → 丟進 queue → 立刻回 200，寫檔與回覆交給背景 worker
 # ============================================================
 @app.post("/callback")
 async def callback(request: Request):
 
     print("\n==============================")
     print("🔥 Received /callback")
-    
-    if handler is None:
-        print("❌ handler is None (missing env on start)")
+
+    if parser is None:
+        print("❌ parser is None (missing env on start)")
         raise HTTPException(500, "Handler not initialized")
 
     if not init_line_api():
@@ -91,102 +279,424 @@ async def callback(request: Request):
     body_text = body_bytes.decode("utf-8")
     print("📩 Body:", body_text)
 
-    # ---- Handle ----
+    # ---- Verify + parse（只取文字訊息）----
     try:
-        handler.handle(body_text, signature)
-        print("✅ handler.handle finished")
-    except Exception as e:
+        events = parser.parse(body_text, signature)
+    except InvalidSignatureError as e:
         print("❌ Webhook Error:", e)
         raise HTTPException(400, "Invalid signature")
 
+    # ---- Dedupe（記憶體 LRU，不碰 storage）----
+    if DEDUPE:
+        fresh = [e for e in events if not deduper.seen(e)]
+        record_duplicates(len(events) - len(fresh))
+        events = fresh
+
+    # ---- Enqueue ----
+    # queue 滿了就整批拒收（503），讓 LINE 稍後重送，不會只收一半
+    if event_queue.qsize() + len(events) > QUEUE_SIZE:
+        stats.rejected += len(events)
+        inc("webhook_events_total", len(events), status="rejected")
+        for event in events:
+            deduper.forget(event)
+        print(f"❌ Queue full ({event_queue.qsize()}/{QUEUE_SIZE})")
+        raise HTTPException(503, "Queue full")
+
+    received_at = time.monotonic()
+    for event in events:
+        event_queue.put_nowait((received_at, event))
+    stats.received += len(events)
+    inc("webhook_events_total", len(events), status="accepted")
+
     return PlainTextResponse("OK")
 
 
+def record_duplicates(count):
+    if count:
+        stats.duplicates += count
+        inc("webhook_events_total", count, status="duplicate")
+        print(f"♻ Dropped {count} redelivered events")
+
+
 # ============================================================
-# EVENT DISPATCHER
+# BACKGROUND WORKER
 # ============================================================
-def handle_text_message(event: MessageEvent):
+async def event_worker():
+    """每 FLUSH_INTERVAL 秒（或滿 MAX_BATCH 筆）處理一批事件"""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = [await event_queue.get()]
+        deadline = loop.time() + FLUSH_INTERVAL
+
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(event_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            with span("webhook_batch"):
+                await process_batch(batch)
+        except Exception as e:
+            print("❌ Error processing batch:", e)
+        finally:
+            for _ in batch:
+                event_queue.task_done()
+
+
+async def process_batch(batch):
+    """整批訊息（含批次匯入的多行訊息 / CSV 檔）每個 ledger 只寫一個 segment，再併發送出所有回覆"""
+    results = await asyncio.gather(*(parse_event(event) for _, event in batch))
+    parsed = [(received_at, event, *result) for (received_at, event), result in zip(batch, results)]
+
+    # 每個 ledger 這批要寫的 segment 先取好名字，記在 webhookEventId 的 pending 標記裡；
+    # 標記已存在 → 其他 instance 處理過 / 正在處理，不寫入也不回覆
+    # claim 失敗（storage 錯誤）的事件不寫入，只回覆錯誤給該使用者
+    segments, claim_errors = {}, {}
+    if DEDUPE and deduper.backend is not None:
+        # 多使用者模式下拿不到 user_id 的不會寫入 → 不建標記
+        writes = [item for item in parsed if item[2] and not (MULTI_PORTFOLIO and portfolio_id(item[1]) is None)]
+        for _, event, *_ in writes:
+            user_id = portfolio_id(event)
+            if user_id not in segments:
+                segments[user_id] = ledger_for(user_id).segment_name()
+        claims = await asyncio.gather(*(
+            asyncio.to_thread(deduper.claim, event, segments[portfolio_id(event)]) for _, event, *_ in writes
+        ), return_exceptions=True)
+
+        duplicates = set()
+        for (_, event, *_), claimed in zip(writes, claims):
+            if isinstance(claimed, Exception):
+                print("❌ Error claiming event:", claimed)
+                claim_errors[id(event)] = f"\n❌ 錯誤：{str(claimed)}"
+                # 沒寫入 → 移出 LRU，LINE 重送時可以重試
+                deduper.forget(event)
+            elif not claimed:
+                duplicates.add(id(event))
+        record_duplicates(len(duplicates))
+        parsed = [item for item in parsed if id(item[1]) not in duplicates]
+
+    rows_by_user, events_by_user = {}, {}
+    for _, event, rows, _, _ in parsed:
+        if rows and id(event) not in claim_errors:
+            rows_by_user.setdefault(portfolio_id(event), []).extend(rows)
+            events_by_user.setdefault(portfolio_id(event), []).append(event)
+
+    # 群組訊息等拿不到 user_id 的，在多使用者模式下不寫入
+    if MULTI_PORTFOLIO and None in rows_by_user:
+        del rows_by_user[None]
+
+    results = await asyncio.gather(*(
+        asyncio.to_thread(ledger_for(user_id).append, rows, segments.get(user_id))
+        for user_id, rows in rows_by_user.items()
+    ), return_exceptions=True)
+
+    statuses = {}
+    for (user_id, rows), result in zip(rows_by_user.items(), results):
+        if isinstance(result, Exception):
+            print("❌ Error writing ledger:", result)
+            statuses[user_id] = f"\n❌ 錯誤：{str(result)}"
+            # 沒寫進去 → 拿掉標記，LINE 重送時可以重試
+            if DEDUPE:
+                await asyncio.gather(*(
+                    asyncio.to_thread(deduper.release, event) for event in events_by_user[user_id]
+                ), return_exceptions=True)
+        else:
+            print(f"💾 Successfully appended {len(rows)} rows → {result}")
+            statuses[user_id] = "\n✔ 已寫入 trades.csv！"
+            # 寫入成功才把標記改成 done（之前掛掉 → pending 標記過了 lease 可以由重送接手）
+            if DEDUPE:
+                await asyncio.gather(*(
+                    asyncio.to_thread(deduper.complete, event, result) for event in events_by_user[user_id]
+                ), return_exceptions=True)
+            # 已載入的持倉直接接上新寫入的列（同一批後面的查詢就看得到）
+            # 接不上 → 丟掉這個使用者的持倉，下次查詢重新載入（已寫入，回覆照常）
+            if user_id in live_portfolios:
+                try:
+                    await asyncio.to_thread(live_portfolios[user_id].apply, rows, result)
+                except Exception as e:
+                    print("❌ Error applying rows to live portfolio:", e)
+                    live_portfolios.pop(user_id, None)
+
+    def status_for(event, rows):
+        if not rows:
+            return ""
+        if id(event) in claim_errors:
+            return claim_errors[id(event)]
+        return statuses.get(portfolio_id(event), "\n⚠ 無法辨識使用者，未寫入")
+
+    async def reply(event, rows, reply_text, query):
+        if query is None:
+            return await reply_message(event.reply_token, reply_text + status_for(event, rows))
+        texts = await asyncio.to_thread(answer_query, event, query)
+        return await reply_message(event.reply_token, *texts)
+
+    await asyncio.gather(*(
+        reply(event, rows, reply_text, query)
+        for _, event, rows, reply_text, query in parsed
+    ))
+
+    now = time.monotonic()
+    for received_at, *_ in parsed:
+        stats.record(now - received_at)
+        observe("webhook_event_latency_seconds", now - received_at)
+    stats.batches += 1
+
+
+def portfolio_id(event):
+    """多使用者模式 → 發訊者的 LINE user_id；單一 ledger 時一律 None（整批寫成一個 segment）"""
+    if not MULTI_PORTFOLIO:
+        return None
+    return getattr(event.source, "user_id", None)
+
+
+# ============================================================
+# MESSAGE PARSER
+# ============================================================
+async def parse_event(event):
+    """→ (rows, reply_text, query)；多行訊息 / CSV 檔在 thread 裡解析（用到 pandas）"""
+    if is_file_message(event):
+        return await parse_file_message(event)
+    if is_bulk_text(event.message.text):
+        return await asyncio.to_thread(parse_message, event.message.text)
+    return parse_message(event.message.text)
+
+
+def parse_message(user_text):
+    """→ (rows, reply_text, query)；查詢指令不寫入 ledger（rows 為空、reply_text 為 None）"""
+    if is_bulk_text(user_text):
+        return (*parse_bulk_message("多行訊息", user_text), None)
+
+    query = parse_query(user_text) if LIVE_QUERIES else None
+    if query is not None:
+        return [], None, query
+    row, reply_text = parse_trade_message(user_text)
+    return ([row] if row is not None else []), reply_text, None
+
+
+def is_bulk_text(user_text):
+    return "\n" in user_text.strip()
+
+
+def parse_bulk_message(source, text):
+    """多行訊息 / CSV 內容 → (通過檢查的 rows, 回覆：筆數 + 每行的錯誤)"""
+    from webhook.bulk import bulk_reply, parse_bulk
+
+    with span("webhook_bulk_parse"):
+        rows, errors = parse_bulk(text)
+    inc("webhook_bulk_rows_total", len(rows), status="accepted")
+    inc("webhook_bulk_rows_total", len(errors), status="rejected")
+    print(f"📥 Bulk {source}: {len(rows)} rows accepted, {len(errors)} rejected")
+    return rows, bulk_reply(source, rows, errors)
+
+
+async def parse_file_message(event):
+    """LINE 檔案訊息（CSV）→ 下載內容 → 與多行訊息相同的批次解析"""
+    from webhook.bulk import MAX_FILE_SIZE, decode_file
+
+    name = event.message.file_name or "file"
+    source = f"檔案「{name}」"
+    if not name.lower().endswith((".csv", ".txt")):
+        return [], f"收到{source}\n⚠ 只支援 CSV 檔（日期, 代號, 動作, 價格[, 股數[, 手續費]]）", None
+    if (event.message.file_size or 0) > MAX_FILE_SIZE:
+        return [], f"收到{source}\n⚠ 檔案超過 {MAX_FILE_SIZE // 1024} KB", None
+    if line_api_blob is None:
+        return [], f"收到{source}\n❌ Messaging API not initialized", None
+
+    try:
+        with external("line", "get_content"):
+            data = await line_api_blob.get_message_content(event.message.id)
+    except Exception as e:
+        print("❌ Error downloading file:", e)
+        return [], f"收到{source}\n❌ 下載失敗：{e}", None
+
+    return (*await asyncio.to_thread(parse_bulk_message, source, decode_file(bytes(data))), None)
+
+
+def parse_query(user_text):
     """
-    Handle user text input.
-    Format: YYYY/MM/DD, code, action, value
+    「持倉」→ ("positions", None)、「報告」→ ("report", None)、「2330」/「台積電」→ ("code", "2330")
+    名稱對到多檔 → ("search", [(code, name), ...])；其他 → None
     """
-    user_text = event.message.text.strip()
+    text = user_text.strip().upper()
+    if text in QUERY_POSITIONS:
+        return "positions", None
+    if text in QUERY_REPORT:
+        return "report", None
+    if QUERY_CODE.fullmatch(text):
+        return "code", text
+    if text and "," not in text:
+        code, candidates = resolve_code(user_text)
+        if code:
+            return "code", code
+        if candidates:
+            return "search", candidates
+    return None
+
+
+def resolve_code(text):
+    """代號或公司名稱 → (code, 候選清單)；索引無法使用時 → (None, [])"""
+    try:
+        return get_stock_index().resolve(text)
+    except Exception as e:
+        print("❌ Stock index unavailable:", e)
+        return None, []
+
+
+def format_candidates(candidates):
+    return "\n".join(f"{code} {name}" for code, name in candidates[:MAX_CANDIDATES])
+
+
+def parse_trade_message(user_text):
+    """
+    Parse user text input.
+    Format: YYYY/MM/DD, code, action, value[, qty[, fee]]
+
+    → (row, reply_text)；格式錯誤時 row 為 None
+    """
+    user_text = user_text.strip()
     print(f"💬 Received Text: {user_text}")
 
     reply_text = f"收到：{user_text}"
 
-    # ---- Parse input ----
+    parts = [p.strip() for p in user_text.split(",")]
+
+    if not 4 <= len(parts) <= 6:
+        return None, reply_text + "\n⚠ 格式錯誤：需為\n日期, 代號, 動作, 價格[, 股數[, 手續費]]"
+
+    date, code, action, value = parts[:4]
+    qty, fee = (parts[4:] + ["", ""])[:2]
+    action = action.upper()
+
+    # ---- 日期檢查 ----
+    try:
+        datetime.strptime(date, "%Y/%m/%d")
+    except:
+        return None, reply_text + "\n⚠ 日期格式錯誤：YYYY/MM/DD"
+
+    value_norm = value.strip().lower()
+    if value_norm in ["", "none", "null"]:
+        value = "null"
+
+    code = code.replace(".0", "").upper()
+
+    # ---- 代號 / 公司名稱 → 代號 ----
+    if not CODE_PATTERN.fullmatch(code):
+        resolved, candidates = resolve_code(code)
+        if resolved is None:
+            if candidates:
+                return None, reply_text + f"\n⚠ 「{code}」對到多檔股票，請改用代號：\n" + format_candidates(candidates)
+            return None, reply_text + f"\n⚠ 找不到股票：{code}"
+        reply_text += f"\n（{code} → {resolved}）"
+        code = resolved
+
+    # ---- 股數 / 手續費（選填；沒填手續費時依費率計算）----
     try:
-        df = read_csv_from_gcs()
-        print("📄 Loaded trades.csv from GCS")
+        if qty and not float(qty) > 0:
+            raise ValueError
+        if fee and not float(fee) >= 0:
+            raise ValueError
+    except ValueError:
+        return None, reply_text + "\n⚠ 股數需為正數、手續費不可為負"
+
+    row = {
+        "date": date,
+        "code": code,
+        "action": action,
+        "value": value
+    }
+    if qty:
+        row["qty"] = qty
+    if fee:
+        row["fee"] = fee
+    return row, reply_text
 
-        parts = [p.strip() for p in user_text.split(",")]
 
-        if len(parts) != 4:
-            reply_message(event.reply_token,
-                          reply_text + "\n⚠ 格式錯誤：需為\n日期, 代號, 動作, 價格")
-            return
+# ============================================================
+# QUERY（由記憶體中的持倉回答，不讀整份 ledger）
+# ============================================================
+def answer_query(event, query):
+    """→ 回覆的訊息（最多 MESSAGES_PER_REQUEST 則）"""
+    kind, code = query
+    if kind == "search":
+        return ["請輸入代號：\n" + format_candidates(code)]
 
-        date, code, action, value = parts
-        action = action.upper()
+    user_id = portfolio_id(event)
+    if MULTI_PORTFOLIO and user_id is None:
+        return ["⚠ 無法辨識使用者"]
 
-        # ---- 日期檢查 ----
-        try:
-            datetime.strptime(date, "%Y/%m/%d")
-        except:
-            reply_message(event.reply_token,
-                          reply_text + "\n⚠ 日期格式錯誤：YYYY/MM/DD")
-            return
-        
-        value_norm = value.strip().lower()
-        if value_norm in ["", "none", "null"]:
-            value = "null"
-
-        code = code.replace(".0", "")
-
-        # ---- 新增 Row ----
-        new_row = pd.DataFrame([{
-            "date": date,
-            "code": code,
-            "action": action,
-            "value": value
-        }])
-
-        df = pd.concat([df, new_row], ignore_index=True)
-
-        write_csv_to_gcs(df)
-        print("💾 Successfully wrote to trades.csv")
-
-        reply_message(event.reply_token,
-                      reply_text + "\n✔ 已寫入 trades.csv！")
+    from report.formatter import iter_code, iter_line, iter_positions
+    from report.model import build_model
 
+    try:
+        # span → webhook_query_seconds{kind}
+        with span("webhook_query", kind=kind):
+            completed, open_positions = live_for(user_id).positions(code)
+            model = build_model(completed, open_positions)
+            if kind == "positions":
+                lines = iter_positions(model)
+            elif kind == "report":
+                lines = iter_line(model)
+            else:
+                lines = iter_code(model, code)
+            return reply_texts(lines)
     except Exception as e:
-        print("❌ Error handling message:", e)
-        reply_message(event.reply_token,
-                      reply_text + f"\n❌ 錯誤：{str(e)}")
+        print("❌ Error answering query:", e)
+        return [f"❌ 查詢失敗：{e}"]
+
+
+def reply_texts(lines):
+    """
+    逐行取到填滿一次 reply（MESSAGES_PER_REQUEST 則 × MAX_TEXT_LENGTH 字）為止，
+    長報表不必整份排版；超過的部分截掉並註明
+    """
+    from notify.push_bot import MAX_TEXT_LENGTH, MESSAGES_PER_REQUEST, split_text
+
+    budget = MAX_TEXT_LENGTH * MESSAGES_PER_REQUEST
+    taken, size, truncated = [], 0, False
+    for line in lines:
+        size += len(line) + 1
+        if size > budget:
+            truncated = True
+            break
+        taken.append(line)
+
+    texts = split_text("\n".join(taken))
+    if truncated or len(texts) > MESSAGES_PER_REQUEST:
+        note = "\n…（內容過長，其餘省略）"
+        texts = texts[:MESSAGES_PER_REQUEST]
+        texts[-1] = texts[-1][:MAX_TEXT_LENGTH - len(note)] + note
+    return texts
 
 
 # ============================================================
 # REPLY MESSAGE
 # ============================================================
-def reply_message(reply_token, text):
+async def reply_message(reply_token, *texts):
     print("====================================")
     print("🔁 reply_message CALLED")
     print("🔁 reply_token:", reply_token)
-    print("🔁 reply text:", text)
+    print("🔁 reply text:", "\n".join(texts))
     print("====================================")
 
     if line_api is None:
         print("❌ Messaging API not initialized")
         return
 
+    from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+
     try:
         req = ReplyMessageRequest(
             reply_token=reply_token,
-            messages=[TextMessage(text=text)],
+            messages=[TextMessage(text=text) for text in texts],
             x_line_delivery_notification_bot_id=os.getenv("LINE_BOT_ID", None)
         )
-        res = line_api.reply_message(req)
+        with external("line", "reply"):
+            res = await line_api.reply_message(req)
         print("✅ reply_message success:", res)
     except Exception as e:
         print("🔥 reply_message ERROR:", e)
@@ -196,7 +706,9 @@ def reply_message(reply_token, text):
 # LOCAL RUN
 # ============================================================
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("webhook.webhook_server:app",
                 host="0.0.0.0",
                 port=8080,
-                reload=True)
\ No newline at end of file
+                reload=True)